@@ -0,0 +1,256 @@
+"""Micro-benchmarks hors ligne des chemins chauds du Cazgino.
+
+Importe la logique du bot sans se connecter à Discord et mesure Database,
+RouletteGame et InterimJob à plusieurs échelles. Les résultats sont écrits en
+JSON pour comparer les versions entre elles:
+
+    python bench.py --accounts 1000,100000 --bets 10,1000 --output bench.json
+"""
+import argparse
+import atexit
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# Le bot lit et écrit ses fichiers dans le dossier courant: on travaille dans
+# un dossier temporaire pour ne jamais toucher aux vraies données
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+WORK_DIR = tempfile.mkdtemp(prefix='cazgino-bench-')
+sys.path.insert(0, REPO_DIR)
+os.chdir(WORK_DIR)
+
+
+def remove_work_dir():
+    # Après la fin des threads d'écriture du bot, qui sont attendus avant atexit
+    os.chdir(REPO_DIR)
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+atexit.register(remove_work_dir)
+
+import bot  # noqa: E402
+
+BET_CHOICES = ['rouge', 'noir', 'pair', 'impair', '1-18', '19-36', 'd1', 'c2', 't13', '8/11', '1/2/4/5'] + [str(n) for n in range(37)]
+
+
+def bytes_written():
+    """Octets passés à write() par le processus (Linux), None si indisponible"""
+    try:
+        with open('/proc/self/io') as f:
+            for line in f:
+                if line.startswith('wchar:'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def measure(name, params, ops, func):
+    """Lance func() qui effectue `ops` opérations et renvoie une ligne de résultat"""
+    written = bytes_written()
+    start = time.perf_counter()
+    func()
+    elapsed = time.perf_counter() - start
+    after = bytes_written()
+    result = {
+        'name': name,
+        'params': params,
+        'ops': ops,
+        'seconds': elapsed,
+        'ns_per_op': elapsed / ops * 1e9,
+        'ops_per_second': ops / elapsed if elapsed else None,
+        'bytes_written_per_op': None if written is None else (after - written) / ops,
+    }
+    print(f"{name:<32} {json.dumps(params):<40} {result['ns_per_op']:>12.0f} ns/op"
+          + ('' if written is None else f" {result['bytes_written_per_op']:>10.1f} o/op"))
+    return result
+
+
+def make_database(backend, accounts, folder):
+    """Base peuplée de `accounts` comptes, dont 80% ont déjà joué"""
+    rng = random.Random(accounts)
+    balances = {10**17 + i: rng.randint(0, 10000) for i in range(accounts)}
+    games = {user_id: rng.randint(1, 100) for user_id in balances if rng.random() < 0.8}
+    data_file = os.path.join(folder, 'cazgino_data.json')
+    stats_file = os.path.join(folder, 'cazgino_stats.json')
+    journal_file = os.path.join(folder, 'cazgino_journal.log')
+    if backend == 'sqlite':
+        storage = bot.SQLiteStorage(os.path.join(folder, 'cazgino.db'))
+        storage.commit(balances, games)
+    else:
+        with open(data_file, 'w') as f:
+            json.dump(balances, f)
+        with open(stats_file, 'w') as f:
+            json.dump({user_id: {'games_played': n} for user_id, n in games.items()}, f)
+        storage = bot.JsonStorage(data_file, stats_file, journal_file)
+        if backend == 'snapshot':
+            snapshot_file = os.path.join(folder, 'cazgino.snap')
+            bot.write_snapshot(snapshot_file, storage.accounts, storage.ranking.slice(0, len(storage.ranking)))
+            storage = bot.SnapshotStorage(snapshot_file, os.path.join(folder, 'cazgino_snapshot.log'))
+    stats = bot.StatsStore(os.path.join(folder, bot.STATS_FILE), os.path.join(folder, bot.STATS_JOURNAL_FILE))
+    return bot.Database(storage, stats), list(balances)
+
+
+def bench_database(backend, accounts, ops):
+    results = []
+    params = {'backend': backend, 'accounts': accounts}
+    with tempfile.TemporaryDirectory(dir=WORK_DIR) as folder:
+        start = time.perf_counter()
+        db, user_ids = make_database(backend, accounts, folder)
+        results.append({'name': 'db_load', 'params': params, 'ops': 1, 'seconds': time.perf_counter() - start})
+        rng = random.Random(0)
+        sample = [rng.choice(user_ids) for _ in range(ops)]
+        
+        def get_balance():
+            for user_id in sample:
+                db.get_balance(user_id)
+        results.append(measure('db_get_balance', params, ops, get_balance))
+        
+        def add_balance():
+            for user_id in sample:
+                db.add_balance(user_id, 1)
+        results.append(measure('db_add_balance', params, ops, add_balance))
+        
+        def settle_round():
+            with db.transaction() as tx:
+                for user_id in sample:
+                    tx.add_game_played(user_id)
+                    tx.add_balance(user_id, 10)
+        results.append(measure('db_transaction_per_account', params, ops, settle_round))
+        
+        leaderboard_ops = max(1, ops // 10)
+        
+        def get_leaderboard():
+            for _ in range(leaderboard_ops):
+                db.get_leaderboard(10)
+        results.append(measure('db_get_leaderboard_top10', params, leaderboard_ops, get_leaderboard))
+        
+        pages = max(1, db.count_ranked() // 10)
+        
+        def get_leaderboard_page():
+            for _ in range(leaderboard_ops):
+                db.get_leaderboard(10, rng.randrange(pages) * 10)
+        results.append(measure('db_get_leaderboard_page', params, leaderboard_ops, get_leaderboard_page))
+        
+        def get_rank():
+            for user_id in sample[:leaderboard_ops]:
+                db.get_rank(user_id)
+        results.append(measure('db_get_rank', params, leaderboard_ops, get_rank))
+        db.close()
+    return results
+
+
+def make_slips(bets, rng):
+    """Bulletins de 1 à 3 mises jusqu'à atteindre `bets` mises"""
+    slips = {}
+    user_id = 0
+    while bets > 0:
+        count = min(bets, rng.randint(1, 3))
+        slips[user_id] = bot.Slip([(bot.compile_bet(rng.choice(BET_CHOICES)), rng.randint(1, 100)) for _ in range(count)])
+        bets -= count
+        user_id += 1
+    return slips
+
+
+def bench_roulette(bets, rounds):
+    results = []
+    params = {'bets': bets}
+    rng = random.Random(bets)
+    game = bot.RouletteGame.__new__(bot.RouletteGame)
+    choices = [(rng.choice(BET_CHOICES), rng.randint(1, 100)) for _ in range(bets)]
+    results_numbers = [rng.randint(0, 36) for _ in range(rounds)]
+    
+    def calculate_winnings():
+        for number in results_numbers:
+            game.result = number
+            for choice, amount in choices:
+                game.calculate_winnings(choice, amount)
+    results.append(measure('roulette_calculate_winnings', params, rounds * bets, calculate_winnings))
+    
+    def get_color():
+        for number in results_numbers:
+            for _ in range(bets):
+                game.get_color(number)
+    results.append(measure('roulette_get_color', params, rounds * bets, get_color))
+    
+    def place_slips():
+        game.players = make_slips(bets, rng)
+    results.append(measure('roulette_place_bets', params, bets, place_slips))
+    
+    def settle():
+        for number in results_numbers:
+            game.result = number
+            game.settle()
+    results.append(measure('roulette_settle_round', params, rounds, settle))
+    return results
+
+
+def bench_interim(jobs):
+    recipe_keys = list(bot.RECIPES)
+    rng = random.Random(jobs)
+    
+    def play():
+        for i in range(jobs):
+            job = bot.InterimJob(i, recipe_keys[i % len(recipe_keys)], rng)
+            while True:
+                job.get_current_emoji()
+                if job.next_step():
+                    break
+                job.render_progress()
+    steps = sum(len(bot.RECIPES[recipe_keys[i % len(recipe_keys)]]['steps']) for i in range(jobs))
+    return [measure('interim_step', {'jobs': jobs}, steps, play)]
+
+
+def git_version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=REPO_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def parse_sizes(text):
+    return [int(size) for size in text.split(',') if size]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--accounts', default='1000,10000,100000', help='Tailles de base (ex: 1000,1000000)')
+    parser.add_argument('--bets', default='10,100,1000,10000', help='Nombres de mises par tour')
+    parser.add_argument('--backends', default='json,snapshot,sqlite', help='Backends de stockage à mesurer')
+    parser.add_argument('--ops', type=int, default=2000, help='Opérations par mesure de Database')
+    parser.add_argument('--rounds', type=int, default=100, help='Tirages par mesure de roulette')
+    parser.add_argument('--jobs', type=int, default=10000, help="Jobs d'intérim simulés")
+    parser.add_argument('--output', help='Fichier JSON de résultats (stdout sinon)')
+    args = parser.parse_args()
+    
+    results = []
+    for backend in args.backends.split(','):
+        for accounts in parse_sizes(args.accounts):
+            results += bench_database(backend, accounts, args.ops)
+    for bets in parse_sizes(args.bets):
+        results += bench_roulette(bets, args.rounds)
+    results += bench_interim(args.jobs)
+    
+    report = {
+        'version': git_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'results': results,
+    }
+    if args.output:
+        with open(os.path.join(REPO_DIR, args.output) if not os.path.isabs(args.output) else args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+    else:
+        print(json.dumps(report, indent=4))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,85 +1,2417 @@
 import discord
+from discord import app_commands
 from discord.ext import commands
 import json
 import random
+import bisect
+from array import array
+import time
+import heapq
+import itertools
+import traceback
+import contextvars
+import functools
+import concurrent.futures
+from collections import OrderedDict, Counter, deque
 import os
+import sys
+import threading
+import signal
+import sqlite3
+import mmap
+import struct
+import math
 import asyncio
-from datetime import datetime, timedelta
 
 # Configuration
   # Remplace par ton token
 STARTING_BALANCE = 500
 
+# Persistance: chaque modification est ajoutée au journal, puis le journal
+# est replié dans les fichiers JSON toutes les JOURNAL_COMPACT_EVERY écritures
+JOURNAL_FILE = 'cazgino_journal.log'
+JOURNAL_COMPACT_EVERY = 1000
+JOURNAL_FSYNC = False  # True pour survivre aussi à une coupure de courant
+
+# Stockage des comptes: 'json' (fichiers JSON + journal), 'snapshot' (instantané
+# binaire chargé à la demande, voir plus bas) ou 'sqlite'
+STORAGE_BACKEND = os.getenv('CAZGINO_STORAGE', 'json')
+SQLITE_FILE = 'cazgino.db'
+
+# Persistance du backend JSON:
+# - 'journal': journal + repli périodique (voir plus haut)
+# - 'background': instantanés écrits par un thread, au plus JSON_FLUSH_MAX_DELAY
+#   secondes après une modification (c'est aussi ce qu'on peut perdre en cas de crash)
+# - 'sync': fichiers complets réécrits à chaque modification
+JSON_PERSISTENCE = os.getenv('CAZGINO_JSON_PERSISTENCE', 'journal')
+JSON_FLUSH_MAX_DELAY = float(os.getenv('CAZGINO_JSON_FLUSH_DELAY', '1.0'))
+JSON_CHUNK_ITEMS = 2000  # Comptes encodés d'un coup par le thread d'écriture
+
+# Backend 'snapshot': instantané binaire projeté en mémoire + journal des
+# modifications, replié dans un nouvel instantané (en arrière-plan) tous les
+# SNAPSHOT_COMPACT_EVERY commits
+SNAPSHOT_FILE = 'cazgino.snap'
+SNAPSHOT_JOURNAL_FILE = 'cazgino_snapshot.log'
+SNAPSHOT_COMPACT_EVERY = 10000
+
+# Comptes gardés en mémoire par le backend 'snapshot' (les autres restent sur disque)
+HOT_ACCOUNTS = int(os.getenv('CAZGINO_HOT_ACCOUNTS', '10000'))  # Taille du LRU
+HOT_IDLE_SECONDS = int(os.getenv('CAZGINO_HOT_IDLE_SECONDS', '3600'))  # Inactif plus longtemps: retour sur disque
+HOT_TRIM_INTERVAL = 600
+
+# Service de comptes partagé (ledger.py): chemin de son socket Unix. S'il est
+# donné, le bot ne lit ni n'écrit les fichiers lui-même et plusieurs bots (un par
+# shard: CAZGINO_SHARD_ID / CAZGINO_SHARD_COUNT) partagent les mêmes soldes
+LEDGER_SOCKET = os.getenv('CAZGINO_LEDGER', '')
+LEDGER_MAX_PENDING = 1000  # Statistiques gardées en attendant une reconnexion, au plus
+LEDGER_TIMEOUT = float(os.getenv('CAZGINO_LEDGER_TIMEOUT', '5'))  # Attente d'une réponse (s)
+LEDGER_RECONNECT_DELAYS = (0.1, 5.0)  # Reconnexion: premier délai, doublé jusqu'au second
+
+# Journal des événements (commandes, réactions, boutons, graines des tables et
+# des jobs, modifications des comptes), une ligne JSON par événement: replay.py
+# le rejoue en temps virtuel pour reproduire un incident. Vide: pas de journal
+EVENT_LOG_FILE = os.getenv('CAZGINO_EVENT_LOG', '')
+
+# Statistiques détaillées des joueurs et des serveurs (!stats, !casino). Elles
+# ne passent pas par le commit des soldes: les lignes modifiées sont ajoutées à
+# leur journal au plus toutes les STATS_FLUSH_DELAY secondes
+STATS_FILE = 'cazgino_player_stats.snap'
+STATS_JOURNAL_FILE = 'cazgino_player_stats.log'
+STATS_FLUSH_DELAY = float(os.getenv('CAZGINO_STATS_FLUSH_DELAY', '30'))
+STATS_COMPACT_EVERY = 120  # Ajouts au journal avant de réécrire l'instantané
+STATS_MAGIC = b'CAZSTAT1'
+STATS_HEADER = struct.Struct('<8sQ')  # Signature, taille de la description JSON des tables
+
+# Classement
+LEADERBOARD_PAGE_SIZE = 10
+LEADERBOARD_CACHE_TTL = 300  # Les pages sont aussi rafraîchies pour suivre les changements de pseudo
+
+# Pseudos des joueurs absents du cache de discord.py
+USERNAME_CACHE_SIZE = 10000
+USERNAME_CACHE_TTL = 3600
+USERNAME_FETCH_CONCURRENCY = 8
+
+# Commandes: slash (/roulette...) et boutons de la table, plus les commandes
+# préfixées (!roulette...) tant que CAZGINO_PREFIX_COMMANDS vaut 1. Sans elles,
+# l'intent message_content n'est plus demandé: Discord n'envoie plus le texte
+# de chaque message du serveur (mentionner le bot reste possible: @Cazgino join)
+PREFIX_COMMANDS = os.getenv('CAZGINO_PREFIX_COMMANDS', '1') == '1'
+PREFIX = '!' if PREFIX_COMMANDS else '/'  # Préfixe affiché dans les messages du bot
+# Publie les commandes slash au démarrage. La liste est globale à l'application:
+# seul le shard 0 (ou le bot sans shards) la publie, les autres n'en ont pas besoin
+SYNC_COMMANDS = os.getenv('CAZGINO_SYNC_COMMANDS', '1') == '1'
+
 # Intents nécessaires
 intents = discord.Intents.default()
-intents.message_content = True
+intents.message_content = PREFIX_COMMANDS
 intents.members = True
 intents.reactions = True
 
-bot = commands.Bot(command_prefix='!', intents=intents)
+# Métriques au format Prometheus sur http://127.0.0.1:<port>/metrics (0 pour désactiver).
+# Chaque shard écoute sur le port suivant: <port> + CAZGINO_SHARD_ID
+METRICS_PORT = int(os.getenv('CAZGINO_METRICS_PORT', '9108'))
 
-# Classe pour gérer la base de données
-class Database:
-    def __init__(self, filename='cazgino_data.json'):
+# Les réactions d'intérim passent par on_raw_reaction_add: le cache des messages
+# de discord.py n'est plus nécessaire au jeu et peut rester petit
+MESSAGE_CACHE_SIZE = 100
+
+# Surveillance de la boucle d'événements
+LOOP_HEARTBEAT_INTERVAL = 0.1
+LOOP_BLOCK_THRESHOLD = float(os.getenv('CAZGINO_LOOP_BLOCK_THRESHOLD', '0.25'))  # Secondes avant de journaliser la pile
+PROFILE_SAMPLE_INTERVAL = 0.005
+PROFILE_MAX_SECONDS = 120
+PROFILE_DIR = 'profiles'
+
+SHARD_ID = os.getenv('CAZGINO_SHARD_ID')
+SHARD_COUNT = os.getenv('CAZGINO_SHARD_COUNT')
+
+bot = commands.Bot(
+    command_prefix=commands.when_mentioned_or('!') if PREFIX_COMMANDS else commands.when_mentioned,
+    intents=intents,
+    max_messages=MESSAGE_CACHE_SIZE,
+    shard_id=int(SHARD_ID) if SHARD_ID else None,
+    shard_count=int(SHARD_COUNT) if SHARD_COUNT else None,
+)
+
+# Métriques
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Commande (ou tâche de fond) à laquelle attribuer les appels à l'API Discord
+current_command = contextvars.ContextVar('current_command', default='aucune')
+
+class Histogram:
+    """Histogramme cumulatif à la Prometheus"""
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Dernière case: au-delà du plus grand seuil
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q):
+        """Borne supérieure du seuil contenant le quantile q (approximation)"""
+        if self.count == 0:
+            return None
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= target:
+                return bound
+        return float('inf')
+
+class Metrics:
+    """Compteurs, histogrammes et jauges, exportés au format texte Prometheus"""
+    def __init__(self):
+        self.counters = {}  # {(nom, labels): valeur}
+        self.histograms = {}  # {(nom, labels): Histogram}
+        self.gauges = {}  # {nom: fonction qui lit la valeur}
+        self.help = {}
+    
+    def describe(self, name, text):
+        self.help[name] = text
+    
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+    
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = Histogram()
+        histogram.observe(value)
+    
+    def gauge(self, name, read, text):
+        self.gauges[name] = read
+        self.describe(name, text)
+    
+    def counter_total(self, name, **labels):
+        """Somme d'un compteur sur les séries qui ont ces labels"""
+        wanted = set(labels.items())
+        return sum(value for (n, series), value in self.counters.items() if n == name and wanted <= set(series))
+    
+    @staticmethod
+    def format_labels(labels, extra=()):
+        labels = list(labels) + list(extra)
+        if not labels:
+            return ''
+        return '{' + ','.join(f'{k}="{v}"' for k, v in labels) + '}'
+    
+    def render(self):
+        """Texte au format d'exposition Prometheus 0.0.4"""
+        lines = []
+        described = set()
+        
+        def header(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in self.help:
+                    lines.append(f'# HELP {name} {self.help[name]}')
+                lines.append(f'# TYPE {name} {kind}')
+        
+        for (name, labels), value in sorted(self.counters.items()):
+            header(name, 'counter')
+            lines.append(f'{name}{self.format_labels(labels)} {value}')
+        for (name, labels), histogram in sorted(self.histograms.items(), key=lambda item: item[0]):
+            header(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{self.format_labels(labels, [("le", bound)])} {cumulative}')
+            lines.append(f'{name}_bucket{self.format_labels(labels, [("le", "+Inf")])} {histogram.count}')
+            lines.append(f'{name}_sum{self.format_labels(labels)} {histogram.sum}')
+            lines.append(f'{name}_count{self.format_labels(labels)} {histogram.count}')
+        for name, read in sorted(self.gauges.items()):
+            header(name, 'gauge')
+            lines.append(f'{name} {read()}')
+        return '\n'.join(lines) + '\n'
+
+metrics = Metrics()
+metrics.describe('cazgino_command_seconds', 'Durée de traitement des commandes')
+metrics.describe('cazgino_command_errors_total', 'Commandes terminées en erreur')
+metrics.describe('cazgino_discord_api_calls_total', "Appels à l'API Discord par commande et par type")
+metrics.describe('cazgino_discord_api_seconds', "Durée des appels à l'API Discord")
+metrics.describe('cazgino_db_writes_total', 'Écritures de la persistance')
+metrics.describe('cazgino_db_write_bytes_total', 'Octets écrits par la persistance')
+metrics.describe('cazgino_db_write_seconds', 'Durée des écritures de la persistance')
+metrics.describe('cazgino_loop_lag_seconds', "Retard des réveils de la boucle d'événements")
+metrics.describe('cazgino_loop_blocked_total', "Blocages de la boucle d'événements au-delà du seuil")
+metrics.describe('cazgino_account_lookups_total', 'Lectures de comptes par niveau (hot: en mémoire, cold: sur disque)')
+metrics.describe('cazgino_account_evictions_total', 'Comptes renvoyés sur disque')
+metrics.describe('cazgino_ledger_seconds', 'Durée des allers-retours avec le service de comptes')
+metrics.describe('cazgino_outbox_messages_total', 'Messages des files des salons: envoyés, remplacés ou expirés')
+
+def record_db_write(target, started, size=0):
+    """Enregistre une écriture de la persistance commencée à `started` (perf_counter)"""
+    metrics.inc('cazgino_db_writes_total', target=target)
+    metrics.inc('cazgino_db_write_bytes_total', size, target=target)
+    metrics.observe('cazgino_db_write_seconds', time.perf_counter() - started, target=target)
+
+def api_call_kind(route):
+    """Type d'appel à l'API Discord d'une route de discord.py"""
+    path = route.path
+    if path == '/channels/{channel_id}/messages' and route.method == 'POST':
+        return 'send'
+    if path == '/channels/{channel_id}/messages/{message_id}' and route.method == 'PATCH':
+        return 'edit'
+    if path.startswith('/users/{user_id}') and route.method == 'GET':
+        return 'fetch_user'
+    if path.endswith('/reactions/{emoji}/@me') and route.method == 'PUT':
+        return 'add_reaction'
+    if '/reactions/' in path and route.method == 'DELETE':
+        return 'remove_reaction'
+    return 'other'
+
+def instrument_http(http):
+    """Compte chaque requête REST de discord.py, attribuée à la commande en cours"""
+    request = http.request
+    
+    async def counted_request(route, **kwargs):
+        kind = api_call_kind(route)
+        metrics.inc('cazgino_discord_api_calls_total', command=current_command.get(), kind=kind)
+        started = time.perf_counter()
+        try:
+            return await request(route, **kwargs)
+        finally:
+            metrics.observe('cazgino_discord_api_seconds', time.perf_counter() - started, kind=kind)
+    http.request = counted_request
+
+instrument_http(bot.http)
+
+@bot.before_invoke
+async def start_command_timer(ctx):
+    current_command.set(ctx.command.qualified_name)
+    ctx.started = time.perf_counter()
+    events.command(ctx)
+
+@bot.after_invoke
+async def stop_command_timer(ctx):
+    name = ctx.command.qualified_name
+    metrics.observe('cazgino_command_seconds', time.perf_counter() - ctx.started, command=name)
+    if ctx.command_failed:
+        metrics.inc('cazgino_command_errors_total', command=name)
+
+async def serve_metrics(reader, writer):
+    """Mini serveur HTTP: GET /metrics renvoie les métriques au format Prometheus"""
+    try:
+        request_line = await reader.readline()
+        # Ignore les en-têtes de la requête
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', metrics.render().encode()
+        else:
+            status, body = '404 Not Found', b'not found\n'
+        writer.write(
+            f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n'
+            f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode() + body
+        )
+        await writer.drain()
+    finally:
+        writer.close()
+
+def collapse_stack(frame):
+    """Pile d'appels au format « replié » des flamegraphs: racine;...;fonction"""
+    names = []
+    while frame is not None:
+        code = frame.f_code
+        names.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class LoopWatchdog:
+    """Mesure le retard de la boucle d'événements et journalise la pile de ce qui la bloque.
+    
+    Une tâche de la boucle note un battement toutes les `interval` secondes; un thread
+    séparé vérifie les battements et, s'ils s'arrêtent plus de `threshold` secondes,
+    affiche la pile du thread de la boucle: c'est le rappel fautif, pris sur le fait."""
+    def __init__(self, interval=None, threshold=None):
+        self.interval = LOOP_HEARTBEAT_INTERVAL if interval is None else interval
+        self.threshold = LOOP_BLOCK_THRESHOLD if threshold is None else threshold
+        self.last_beat = time.monotonic()
+        self.loop_thread = None
+        self.task = None
+        self.reported = False  # Une seule pile par blocage
+        self.stopped = threading.Event()
+    
+    async def heartbeat(self):
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            metrics.observe('cazgino_loop_lag_seconds', max(0.0, now - expected))
+            self.last_beat = now
+    
+    def watch(self):
+        while not self.stopped.wait(self.interval):
+            blocked = time.monotonic() - self.last_beat - self.interval
+            if blocked < self.threshold:
+                self.reported = False
+                continue
+            if self.reported:
+                continue
+            self.reported = True
+            metrics.inc('cazgino_loop_blocked_total')
+            frame = sys._current_frames().get(self.loop_thread)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else '(pile indisponible)\n'
+            print(f"⚠️ Boucle d'événements bloquée depuis {blocked * 1000:.0f}ms, pile en cours:\n{stack}", end='')
+    
+    def start(self):
+        """Démarre la surveillance (à appeler depuis la boucle surveillée)"""
+        self.loop_thread = threading.get_ident()
+        self.last_beat = time.monotonic()
+        self.task = asyncio.get_running_loop().create_task(self.heartbeat())
+        threading.Thread(target=self.watch, name='cazgino-watchdog', daemon=True).start()
+    
+    def stop(self):
+        self.stopped.set()
+        if self.task is not None:
+            self.task.cancel()
+
+class SamplingProfiler:
+    """Profileur par échantillonnage: relève la pile d'un thread à intervalle régulier.
+    
+    Aucune instrumentation du code profilé, on peut donc l'activer sur le bot en production."""
+    def __init__(self, thread_id, seconds, interval=None):
+        self.thread_id = thread_id
+        self.seconds = seconds
+        self.interval = PROFILE_SAMPLE_INTERVAL if interval is None else interval
+        self.stacks = Counter()  # {pile repliée: échantillons}
+        self.samples = 0
+    
+    def run(self):
+        """Échantillonne pendant `seconds` secondes (bloquant, à lancer dans un thread)"""
+        deadline = time.monotonic() + self.seconds
+        while time.monotonic() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.stacks[collapse_stack(frame)] += 1
+                self.samples += 1
+            time.sleep(self.interval)
+    
+    def write(self, filename):
+        """Écrit les piles au format replié, lisible par flamegraph.pl ou speedscope"""
+        with open(filename, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+    
+    def top(self, limit=5):
+        """Fonctions où le thread passe le plus de temps: [(fonction, échantillons)]"""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(';', 1)[-1]] += count
+        return leaves.most_common(limit)
+
+watchdog = LoopWatchdog()
+profiler_lock = asyncio.Lock()
+
+async def setup_hook():
+    if METRICS_PORT:
+        port = METRICS_PORT + int(SHARD_ID or 0)
+        try:
+            await asyncio.start_server(serve_metrics, '127.0.0.1', port)
+            print(f'📈 Métriques sur http://127.0.0.1:{port}/metrics')
+        except OSError as e:
+            # Port déjà pris (autre bot sur la machine): le bot tourne sans métriques
+            print(f"⚠️ Métriques désactivées, port {port} indisponible: {e}")
+    watchdog.start()
+    # Les boutons des tables restent cliquables après un redémarrage
+    bot.add_view(RouletteView())
+    if SYNC_COMMANDS and int(SHARD_ID or 0) == 0:
+        await bot.tree.sync()
+
+bot.setup_hook = setup_hook
+
+def write_json_atomic(filename, obj):
+    """Écrit un fichier JSON via un fichier temporaire pour ne jamais le laisser à moitié écrit.
+    
+    Renvoie le nombre d'octets écrits."""
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(obj, f, indent=4)
+        size = f.tell()
+    os.replace(tmp, filename)
+    return size
+
+def write_json_compact(filename, obj, chunk_items=None):
+    """Comme write_json_atomic, en JSON compact et encodé par morceaux.
+    
+    L'encodeur JSON garde le GIL pendant tout un json.dump: par morceaux de
+    `chunk_items` entrées, un thread d'écriture laisse la boucle tourner entre deux."""
+    chunk_items = chunk_items or JSON_CHUNK_ITEMS
+    items = list(obj.items())
+    tmp = filename + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write('{')
+        for start in range(0, len(items), chunk_items):
+            if start:
+                f.write(',')
+            f.write(json.dumps(dict(items[start:start + chunk_items]), separators=(',', ':'))[1:-1])
+        f.write('}')
+        size = f.tell()
+    os.replace(tmp, filename)
+    return size
+
+class SnapshotWriter:
+    """Écrit les fichiers JSON d'un JsonStorage dans un thread, hors de la boucle.
+    
+    Une modification marque le fichier comme sale et programme une écriture dans
+    `max_delay` secondes: toutes les modifications d'ici là partent en une seule
+    écriture. L'instantané est une copie des colonnes de l'AccountStore, prise sur
+    la boucle (quelques memcpy); les dicts JSON sont construits dans le thread."""
+    def __init__(self, storage, max_delay=None):
+        self.storage = storage
+        self.max_delay = JSON_FLUSH_MAX_DELAY if max_delay is None else max_delay
+        self.dirty = set()  # {'data', 'stats'}
+        self.timer = None
+        self.pending = None  # Écriture en cours dans le thread
+        self.loop = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='cazgino-flush')
+    
+    def mark(self, target):
+        self.dirty.add(target)
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            # Pas de boucle (outils hors ligne): rien à bloquer, on écrit tout de suite
+            self.write(self.snapshot())
+            return
+        if self.timer is None and self.pending is None:
+            self.timer = self.loop.call_later(self.max_delay, self.flush)
+    
+    def snapshot(self):
+        targets, self.dirty = self.dirty, set()
+        return targets, self.storage.accounts.copy()
+    
+    def write(self, snapshot):
+        targets, accounts = snapshot
+        if 'data' in targets:
+            started = time.perf_counter()
+            record_db_write('data', started, write_json_compact(self.storage.filename, accounts.data_json()))
+        if 'stats' in targets:
+            started = time.perf_counter()
+            record_db_write('stats', started, write_json_compact(self.storage.stats_file, accounts.stats_json()))
+    
+    def flush(self):
+        self.timer = None
+        if self.pending is not None or not self.dirty:
+            return
+        snapshot = self.snapshot()
+        self.pending = self.executor.submit(self.write, snapshot)
+        self.pending.add_done_callback(lambda future: self.done(future, snapshot))
+    
+    def done(self, future, snapshot):
+        # Appelé depuis le thread d'écriture
+        try:
+            self.loop.call_soon_threadsafe(self.written, future, snapshot)
+        except RuntimeError:
+            pass  # Boucle déjà fermée: close() prend le relais
+    
+    def written(self, future, snapshot):
+        self.pending = None
+        error = future.exception()
+        if error is not None:
+            print(f'❌ Échec de la sauvegarde: {error!r}')
+            self.dirty.update(snapshot[0])  # Réessaie à la prochaine échéance
+        if self.dirty and self.timer is None:
+            self.timer = self.loop.call_later(self.max_delay, self.flush)
+    
+    def close(self):
+        """Attend l'écriture en cours puis écrit ce qui reste, de façon synchrone"""
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.executor.shutdown(wait=True)
+        if self.pending is not None and self.pending.exception() is not None:
+            self.dirty.update(('data', 'stats'))
+        self.pending = None
+        self.write(self.snapshot())
+
+# Stockage des comptes
+# Chaque backend expose la même interface: lecture d'un compte, écriture d'un lot
+# de valeurs absolues (commit), classement et rang des joueurs ayant joué.
+class RankIndex:
+    """Liste triée découpée en blocs, avec un arbre de Fenwick sur la taille des blocs.
+    
+    Insertion, suppression et calcul du rang en O(log n), lecture d'une page en
+    O(log n + taille de la page)."""
+    BLOCK_SIZE = 512
+    
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self.blocks = [keys[i:i + self.BLOCK_SIZE] for i in range(0, len(keys), self.BLOCK_SIZE)]
+        self.maxes = [block[-1] for block in self.blocks]
+        self.size = len(keys)
+        self.rebuild_tree()
+    
+    def __len__(self):
+        return self.size
+    
+    def rebuild_tree(self):
+        n = len(self.blocks)
+        self.tree = [0] * (n + 1)
+        for i in range(1, n + 1):
+            self.tree[i] += len(self.blocks[i - 1])
+            parent = i + (i & -i)
+            if parent <= n:
+                self.tree[parent] += self.tree[i]
+    
+    def tree_add(self, block_index, delta):
+        i = block_index + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+    
+    def count_before(self, block_index):
+        """Nombre de clés dans les blocs qui précèdent block_index"""
+        total = 0
+        i = block_index
+        while i > 0:
+            total += self.tree[i]
+            i -= i & -i
+        return total
+    
+    def locate(self, position):
+        """Bloc et position dans ce bloc de la clé de rang `position`"""
+        block_index = 0
+        step = 1 << (len(self.tree).bit_length() - 1)
+        while step:
+            i = block_index + step
+            if i < len(self.tree) and self.tree[i] <= position:
+                block_index = i
+                position -= self.tree[i]
+            step >>= 1
+        return block_index, position
+    
+    def add(self, key):
+        if not self.blocks:
+            self.blocks = [[key]]
+            self.maxes = [key]
+            self.size = 1
+            self.rebuild_tree()
+            return
+        b = min(bisect.bisect_left(self.maxes, key), len(self.blocks) - 1)
+        block = self.blocks[b]
+        bisect.insort(block, key)
+        self.maxes[b] = block[-1]
+        self.size += 1
+        if len(block) > 2 * self.BLOCK_SIZE:
+            half = len(block) // 2
+            self.blocks[b:b + 1] = [block[:half], block[half:]]
+            self.maxes[b:b + 1] = [block[half - 1], block[-1]]
+            self.rebuild_tree()
+        else:
+            self.tree_add(b, 1)
+    
+    def remove(self, key):
+        b = bisect.bisect_left(self.maxes, key)
+        block = self.blocks[b]
+        del block[bisect.bisect_left(block, key)]
+        self.size -= 1
+        if block:
+            self.maxes[b] = block[-1]
+            self.tree_add(b, -1)
+        else:
+            del self.blocks[b]
+            del self.maxes[b]
+            self.rebuild_tree()
+    
+    def rank(self, key):
+        """Nombre de clés strictement plus petites que `key`"""
+        b = bisect.bisect_left(self.maxes, key)
+        if b == len(self.blocks):
+            return self.size
+        return self.count_before(b) + bisect.bisect_left(self.blocks[b], key)
+    
+    def slice(self, offset, limit):
+        if offset >= self.size:
+            return []
+        b, i = self.locate(offset)
+        keys = []
+        while b < len(self.blocks) and len(keys) < limit:
+            keys.extend(self.blocks[b][i:i + limit - len(keys)])
+            b += 1
+            i = 0
+        return keys
+
+def rank_key(balance, user_id):
+    """Clé de classement (-solde, id) dans un seul entier, bien plus léger qu'un tuple"""
+    return ((2**63 - balance) << 64) | user_id
+
+def unpack_rank_key(key):
+    """(solde, id) d'une clé de classement"""
+    return 2**63 - (key >> 64), key & (2**64 - 1)
+
+class Account:
+    """Compte d'un joueur, lu depuis un AccountStore (les modifier ne change pas le store)"""
+    __slots__ = ('user_id', 'balance', 'games_played', 'last_activity')
+    
+    def __init__(self, user_id, balance, games_played, last_activity):
+        self.user_id = user_id
+        self.balance = balance
+        self.games_played = games_played
+        self.last_activity = last_activity
+
+class AccountStore:
+    """Comptes rangés en colonnes compactes (array), triées par snowflake.
+    
+    Un compte occupe 24 octets: id, solde, parties jouées et date de dernière
+    activité (secondes Unix). Une recherche est une dichotomie sur les ids."""
+    NO_BALANCE = -2**63  # Compte connu par ses parties mais sans solde enregistré
+    BULK_INSERT = 64  # Au-delà, les nouveaux comptes sont fusionnés en un seul passage
+    
+    def __init__(self, records=()):
+        self.fill(records)
+    
+    def fill(self, records):
+        """Remplace le contenu par `records`: [(id, solde, parties, activité)] triés par id"""
+        records = list(records)
+        self.ids = array('Q', [record[0] for record in records])
+        self.balances = array('q', [record[1] for record in records])
+        self.games = array('I', [record[2] for record in records])
+        self.activity = array('I', [record[3] for record in records])
+        self.funded = sum(1 for balance in self.balances if balance != self.NO_BALANCE)
+    
+    @classmethod
+    def from_json(cls, data, stats):
+        """Construit le store depuis le contenu des fichiers JSON ({id: solde} et {id: {...}})"""
+        records = {int(user_id): [balance, 0, 0] for user_id, balance in data.items()}
+        for user_id, entry in stats.items():
+            record = records.setdefault(int(user_id), [cls.NO_BALANCE, 0, 0])
+            record[1] = entry.get('games_played', 0)
+            record[2] = entry.get('last_activity', 0)
+        return cls(sorted((user_id, *record) for user_id, record in records.items()))
+    
+    def data_json(self):
+        return {str(user_id): balance for user_id, balance in zip(self.ids, self.balances) if balance != self.NO_BALANCE}
+    
+    def stats_json(self):
+        return {
+            str(user_id): {'games_played': games, 'last_activity': activity}
+            for user_id, games, activity in zip(self.ids, self.games, self.activity) if games or activity
+        }
+    
+    @classmethod
+    def from_columns(cls, ids, balances, games, activity, funded):
+        """Store posé sur des colonnes existantes (par exemple un instantané en mmap, en lecture seule)"""
+        store = cls.__new__(cls)
+        store.ids, store.balances, store.games, store.activity = ids, balances, games, activity
+        store.funded = funded
+        return store
+    
+    def copy(self):
+        clone = AccountStore.__new__(AccountStore)
+        clone.ids = self.ids[:]
+        clone.balances = self.balances[:]
+        clone.games = self.games[:]
+        clone.activity = self.activity[:]
+        clone.funded = self.funded
+        return clone
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __iter__(self):
+        for i in range(len(self.ids)):
+            yield self.account_at(i)
+    
+    def nbytes(self):
+        return sum(column.itemsize * len(column) for column in (self.ids, self.balances, self.games, self.activity))
+    
+    def find(self, user_id):
+        """Position du compte dans les colonnes, -1 s'il n'existe pas"""
+        i = bisect.bisect_left(self.ids, user_id)
+        return i if i < len(self.ids) and self.ids[i] == user_id else -1
+    
+    def account_at(self, i):
+        balance = self.balances[i]
+        return Account(self.ids[i], None if balance == self.NO_BALANCE else balance, self.games[i], self.activity[i])
+    
+    def get(self, user_id):
+        i = self.find(user_id)
+        return None if i < 0 else self.account_at(i)
+    
+    def get_balance(self, user_id):
+        i = self.find(user_id)
+        if i < 0 or self.balances[i] == self.NO_BALANCE:
+            return None
+        return self.balances[i]
+    
+    def get_games_played(self, user_id):
+        i = self.find(user_id)
+        return 0 if i < 0 else self.games[i]
+    
+    def ensure(self, user_ids):
+        """Crée les comptes manquants, sans solde ni partie"""
+        missing = sorted({user_id for user_id in user_ids if self.find(user_id) < 0})
+        if len(missing) <= self.BULK_INSERT:
+            for user_id in missing:
+                i = bisect.bisect_left(self.ids, user_id)
+                self.ids.insert(i, user_id)
+                self.balances.insert(i, self.NO_BALANCE)
+                self.games.insert(i, 0)
+                self.activity.insert(i, 0)
+            return
+        self.fill(sorted(itertools.chain(
+            zip(self.ids, self.balances, self.games, self.activity),
+            ((user_id, self.NO_BALANCE, 0, 0) for user_id in missing),
+        )))
+    
+    def set_balance(self, user_id, balance):
+        i = self.find(user_id)
+        if self.balances[i] == self.NO_BALANCE:
+            self.funded += 1
+        self.balances[i] = balance
+    
+    def set_games_played(self, user_id, games_played):
+        self.games[self.find(user_id)] = games_played
+    
+    def touch(self, user_id, when):
+        self.activity[self.find(user_id)] = when
+    
+    def discard(self, user_ids):
+        """Retire des comptes du store"""
+        user_ids = set(user_ids)
+        self.fill(record for record in zip(self.ids, self.balances, self.games, self.activity) if record[0] not in user_ids)
+    
+    def merged(self, changes):
+        """Nouveau store: ce store, où les comptes de `changes` remplacent ou s'ajoutent"""
+        merged = AccountStore()
+        columns = (merged.ids, merged.balances, merged.games, merged.activity)
+        sources = ((self.ids, self.balances, self.games, self.activity), (changes.ids, changes.balances, changes.games, changes.activity))
+        i = j = 0
+        while i < len(self.ids) or j < len(changes.ids):
+            if j == len(changes.ids) or (i < len(self.ids) and self.ids[i] < changes.ids[j]):
+                source, k = sources[0], i
+                i += 1
+            else:
+                if i < len(self.ids) and self.ids[i] == changes.ids[j]:
+                    i += 1
+                source, k = sources[1], j
+                j += 1
+            for column, values in zip(columns, source):
+                column.append(values[k])
+        merged.funded = sum(1 for balance in merged.balances if balance != self.NO_BALANCE)
+        return merged
+
+class Journal:
+    """Journal des transactions: une ligne JSON de valeurs absolues par commit, donc rejouable"""
+    def __init__(self, filename):
         self.filename = filename
-        self.data = self.load_data()
-        self.stats_file = 'cazgino_stats.json'
-        self.stats = self.load_stats()
+        self.rotated = filename + '.1'  # Journal en cours de repli dans un instantané
+        self.file = None
+        self.size = 0
+    
+    @staticmethod
+    def records(filename):
+        """Transactions d'un fichier journal: [(soldes, parties, date)]"""
+        if not os.path.exists(filename):
+            return
+        with open(filename, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # Dernière ligne tronquée par un crash: la transaction est ignorée en entier
+                    return
+                balances = {int(user_id): balance for user_id, balance in record['b'].items()}
+                games = {int(user_id): games_played for user_id, games_played in record['g'].items()}
+                yield balances, games, record.get('t', 0)
+    
+    def append(self, balances, games, now):
+        started = time.perf_counter()
+        if self.file is None:
+            self.file = open(self.filename, 'a')
+        line = json.dumps({'b': balances, 'g': games, 't': now}, separators=(',', ':')) + '\n'
+        self.file.write(line)
+        self.file.flush()
+        if JOURNAL_FSYNC:
+            os.fsync(self.file.fileno())
+        self.size += 1
+        record_db_write('journal', started, len(line.encode()))
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    
+    def clear(self):
+        """Vide le journal (son contenu est désormais dans les fichiers complets)"""
+        self.close()
+        if os.path.exists(self.filename):
+            open(self.filename, 'w').close()
+        self.size = 0
     
-    def load_data(self):
+    def rotate(self):
+        """Met le journal de côté dans `rotated` et repart d'un journal vide"""
+        self.close()
         if os.path.exists(self.filename):
-            with open(self.filename, 'r') as f:
-                return json.load(f)
-        return {}
+            if os.path.exists(self.rotated):
+                # Un repli précédent a échoué: on garde tout, dans l'ordre
+                with open(self.filename, 'r') as source, open(self.rotated, 'a') as target:
+                    target.write(source.read())
+                os.remove(self.filename)
+            else:
+                os.replace(self.filename, self.rotated)
+        self.size = 0
+
+class JsonStorage:
+    """Comptes en mémoire (AccountStore), persistés dans les fichiers JSON et le journal"""
+    def __init__(self, filename='cazgino_data.json', stats_file='cazgino_stats.json', journal_file=JOURNAL_FILE, flush_delay=None):
+        self.filename = filename
+        self.stats_file = stats_file
+        self.accounts = AccountStore.from_json(self.load_json(filename), self.load_json(stats_file))
+        # Sans journal, chaque modification réécrit les fichiers complets: tout de
+        # suite, ou depuis un thread au plus flush_delay secondes plus tard
+        self.writer = SnapshotWriter(self, flush_delay) if journal_file is None and flush_delay is not None else None
+        self.journal_file = journal_file
+        self.journal = None
+        if journal_file is not None:
+            self.journal = Journal(journal_file)
+            self.replay_journal()
+        # Classement trié par (-solde, id), tenu à jour à chaque commit
+        accounts = self.accounts
+        self.ranking = RankIndex(
+            rank_key(balance, user_id)
+            for user_id, balance, games in zip(accounts.ids, accounts.balances, accounts.games)
+            if games > 0 and balance != AccountStore.NO_BALANCE
+        )
+    
+    def ranking_key(self, user_id):
+        """Clé de tri du joueur dans le classement, None s'il n'y figure pas"""
+        balance = self.accounts.get_balance(user_id)
+        if balance is not None and self.accounts.get_games_played(user_id) > 0:
+            return rank_key(balance, user_id)
+        return None
     
-    def load_stats(self):
-        if os.path.exists(self.stats_file):
-            with open(self.stats_file, 'r') as f:
+    @staticmethod
+    def load_json(filename):
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
                 return json.load(f)
         return {}
     
     def save_data(self):
-        with open(self.filename, 'w') as f:
-            json.dump(self.data, f, indent=4)
+        if self.writer is not None:
+            self.writer.mark('data')
+            return
+        started = time.perf_counter()
+        record_db_write('data', started, write_json_atomic(self.filename, self.accounts.data_json()))
     
     def save_stats(self):
-        with open(self.stats_file, 'w') as f:
-            json.dump(self.stats, f, indent=4)
+        if self.writer is not None:
+            self.writer.mark('stats')
+            return
+        started = time.perf_counter()
+        record_db_write('stats', started, write_json_atomic(self.stats_file, self.accounts.stats_json()))
+    
+    def store(self, balances, games, now):
+        """Écrit des valeurs absolues dans le store (sans journal ni classement)"""
+        self.accounts.ensure(balances.keys() | games.keys())
+        for user_id, balance in balances.items():
+            self.accounts.set_balance(user_id, balance)
+        for user_id, games_played in games.items():
+            self.accounts.set_games_played(user_id, games_played)
+        for user_id in balances.keys() | games.keys():
+            self.accounts.touch(user_id, now)
+    
+    def replay_journal(self):
+        """Rejoue les modifications du journal par-dessus les fichiers JSON"""
+        replayed = 0
+        for balances, games, now in self.journal.records(self.journal_file):
+            self.store(balances, games, now)
+            replayed += 1
+        if replayed:
+            print(f'📒 {replayed} transactions rejouées depuis le journal')
+        if os.path.exists(self.journal_file) and os.path.getsize(self.journal_file) > 0:
+            # Replie le journal dans les fichiers et repart d'un journal vide
+            self.compact()
+    
+    def compact(self):
+        """Écrit les fichiers JSON complets puis vide le journal"""
+        self.save_data()
+        self.save_stats()
+        self.journal.clear()
+    
+    def close(self):
+        if self.journal_file is not None:
+            self.compact()
+        elif self.writer is not None:
+            self.writer.close()
     
     def get_balance(self, user_id):
-        user_id = str(user_id)
-        if user_id not in self.data:
-            self.data[user_id] = STARTING_BALANCE
-            self.save_data()
-        return self.data[user_id]
+        return self.accounts.get_balance(user_id)
+    
+    def get_games_played(self, user_id):
+        return self.accounts.get_games_played(user_id)
+    
+    def commit(self, balances, games):
+        now = int(time.time())
+        if self.journal is not None:
+            self.journal.append(balances, games, now)
+        
+        touched = balances.keys() | games.keys()
+        old_keys = [self.ranking_key(user_id) for user_id in touched]
+        self.store(balances, games, now)
+        for user_id, old_key in zip(touched, old_keys):
+            new_key = self.ranking_key(user_id)
+            if old_key != new_key:
+                if old_key is not None:
+                    self.ranking.remove(old_key)
+                if new_key is not None:
+                    self.ranking.add(new_key)
+        
+        if self.journal_file is None:
+            if balances:
+                self.save_data()
+            # La date d'activité change à chaque commit
+            self.save_stats()
+        elif self.journal.size >= JOURNAL_COMPACT_EVERY:
+            self.compact()
+    
+    def count(self):
+        return self.accounts.funded
+    
+    def ranked_count(self):
+        return len(self.ranking)
+    
+    def leaderboard(self, limit=None, offset=0):
+        keys = self.ranking.slice(offset, len(self.ranking) if limit is None else limit)
+        board = []
+        for key in keys:
+            balance, user_id = unpack_rank_key(key)
+            board.append((user_id, balance, self.accounts.get_games_played(user_id)))
+        return board
+    
+    def rank(self, user_id):
+        key = self.ranking_key(user_id)
+        return None if key is None else self.ranking.rank(key)
+
+SNAPSHOT_MAGIC = b'CAZSNAP1'
+SNAPSHOT_HEADER = struct.Struct('<8sQQQ32x')  # Signature, comptes, comptes avec solde, comptes classés
+
+def write_snapshot(filename, accounts, ranking):
+    """Écrit un instantané binaire via un fichier temporaire; renvoie le nombre d'octets écrits.
+    
+    Après l'en-tête de 64 octets viennent les colonnes, dans l'ordre de la machine:
+    ids, soldes, ids classés, soldes classés (64 bits), parties, activité (32 bits).
+    `accounts` est un AccountStore, `ranking` ses clés de classement triées."""
+    rank_ids = array('Q')
+    rank_balances = array('q')
+    for key in ranking:
+        balance, user_id = unpack_rank_key(key)
+        rank_ids.append(user_id)
+        rank_balances.append(balance)
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(accounts), accounts.funded, len(rank_ids)))
+        for column in (accounts.ids, accounts.balances, rank_ids, rank_balances, accounts.games, accounts.activity):
+            f.write(column)
+        size = f.tell()
+    os.replace(tmp, filename)
+    return size
+
+class RankColumn:
+    """Clés de classement d'un instantané, calculées à la lecture (séquence triée pour bisect)"""
+    def __init__(self, ids, balances):
+        self.ids = ids
+        self.balances = balances
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def __getitem__(self, i):
+        return rank_key(self.balances[i], self.ids[i])
+
+class SnapshotStorage:
+    """Comptes sur deux niveaux: un instantané binaire projeté en mémoire (mmap, niveau froid)
+    et un AccountStore des comptes utilisés récemment (`hot`, niveau chaud).
+    
+    L'ouverture ne lit que l'en-tête: le système charge les pages de l'instantané à
+    la demande, au fil des recherches dichotomiques. Un compte lu ou modifié passe
+    dans `hot`; les modifications pas encore dans l'instantané sont rejouées depuis
+    le journal au démarrage. Le classement fusionne celui de l'instantané, privé
+    des clés périmées (`stale`), et celui des comptes chauds.
+    
+    Les comptes jamais joués, inactifs depuis HOT_IDLE_SECONDS ou au-delà des
+    HOT_ACCOUNTS plus récents (LRU) retournent à l'instantané, qui est réécrit au
+    besoin: la mémoire suit les joueurs actifs, pas tous ceux qui ont tapé une commande."""
+    def __init__(self, filename=SNAPSHOT_FILE, journal_file=SNAPSHOT_JOURNAL_FILE):
+        self.filename = filename
+        if not os.path.exists(filename):
+            self.import_json()
+        self.open_base()
+        self.hot = AccountStore()
+        self.recent = OrderedDict()  # {id: dernière utilisation} des comptes chauds, du plus ancien au plus récent
+        self.last_trim = time.monotonic()
+        self.reindex()
+        metrics.gauge('cazgino_hot_accounts', lambda: len(self.hot), 'Comptes en mémoire (niveau chaud)')
+        self.compaction = None  # Écriture d'un nouvel instantané en cours
+        self.loop = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='cazgino-snapshot')
+        
+        self.journal = Journal(journal_file)
+        replayed = 0
+        for filename in (self.journal.rotated, journal_file):
+            for balances, games, now in self.journal.records(filename):
+                self.store(balances, games, now)
+                replayed += 1
+                if filename == journal_file:
+                    # Pas encore dans l'instantané: trim() devra le réécrire avant d'évincer
+                    self.journal.size += 1
+        if replayed:
+            print(f'📒 {replayed} transactions rejouées depuis le journal')
+    
+    def open_base(self):
+        with open(self.filename, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, count, funded, ranked = SNAPSHOT_HEADER.unpack_from(mapped)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"{self.filename} n'est pas un instantané du Cazgino")
+        view = memoryview(mapped)
+        offset = SNAPSHOT_HEADER.size
+        columns = []
+        for fmt, length in (('Q', count), ('q', count), ('Q', ranked), ('q', ranked), ('I', count), ('I', count)):
+            size = struct.calcsize(fmt) * length
+            columns.append(view[offset:offset + size].cast(fmt))
+            offset += size
+        ids, balances, rank_ids, rank_balances, games, activity = columns
+        self.base = AccountStore.from_columns(ids, balances, games, activity, funded)
+        self.base_ranking = RankColumn(rank_ids, rank_balances)
+    
+    def import_json(self, filename='cazgino_data.json', stats_file='cazgino_stats.json', journal_file=JOURNAL_FILE):
+        """Conversion depuis les fichiers JSON (journal compris)"""
+        source = JsonStorage(filename, stats_file, journal_file)
+        write_snapshot(self.filename, source.accounts, source.ranking.slice(0, len(source.ranking)))
+        print(f'💾 {source.count()} comptes convertis depuis {filename}')
+    
+    def export_json(self, filename='cazgino_data.json', stats_file='cazgino_stats.json'):
+        """Conversion inverse, vers les fichiers JSON"""
+        accounts = self.base.merged(self.hot)
+        write_json_atomic(filename, accounts.data_json())
+        write_json_atomic(stats_file, accounts.stats_json())
+    
+    def current(self, user_id):
+        """Le compte tel qu'il est maintenant: dans `hot` s'il y est, sinon dans l'instantané"""
+        return self.hot.get(user_id) or self.base.get(user_id)
+    
+    def lookup(self, user_id):
+        """Comme current(), mais un compte lu dans l'instantané est ramené dans `hot`"""
+        account = self.hot.get(user_id)
+        if account is not None:
+            metrics.inc('cazgino_account_lookups_total', tier='hot')
+            self.used(user_id)
+            return account
+        metrics.inc('cazgino_account_lookups_total', tier='cold')
+        account = self.base.get(user_id)
+        if account is not None:
+            self.hot.ensure((user_id,))
+            if account.balance is not None:
+                self.hot.set_balance(user_id, account.balance)
+            self.hot.set_games_played(user_id, account.games_played)
+            self.hot.touch(user_id, account.last_activity)
+            key = self.account_key(account)
+            if key is not None:
+                self.stale.add(key)
+                self.ranking.add(key)
+            self.used(user_id)
+            self.maybe_trim()
+        return account
+    
+    def used(self, user_id):
+        self.recent[user_id] = time.monotonic()
+        self.recent.move_to_end(user_id)
+    
+    @staticmethod
+    def account_key(account):
+        if account is None or account.balance is None or account.games_played == 0:
+            return None
+        return rank_key(account.balance, account.user_id)
+    
+    def reindex(self):
+        """Recalcule ce qui dépend de `hot` par rapport à l'instantané"""
+        stale = []
+        keys = []
+        self.funded_delta = 0
+        for account in self.hot:
+            base = self.base.get(account.user_id)
+            if self.account_key(base) is not None:
+                stale.append(self.account_key(base))
+            if self.account_key(account) is not None:
+                keys.append(self.account_key(account))
+            self.funded_delta += (account.balance is not None) - (base is not None and base.balance is not None)
+        self.stale = RankIndex(stale)
+        self.ranking = RankIndex(keys)
+    
+    def store(self, balances, games, now):
+        """Écrit des valeurs absolues dans `hot` et tient le classement à jour (sans journal)"""
+        touched = balances.keys() | games.keys()
+        fresh = {user_id for user_id in touched if self.hot.find(user_id) < 0}
+        before = {user_id: self.current(user_id) for user_id in touched}
+        self.hot.ensure(fresh)
+        for user_id, old in before.items():
+            old_key = self.account_key(old)
+            if user_id in fresh:
+                # Premier changement depuis l'instantané: le compte part de ses valeurs actuelles
+                if old is not None:
+                    if old.balance is not None:
+                        self.hot.set_balance(user_id, old.balance)
+                    self.hot.set_games_played(user_id, old.games_played)
+                if old_key is not None:
+                    self.stale.add(old_key)
+            elif old_key is not None:
+                self.ranking.remove(old_key)
+            if user_id in balances:
+                self.hot.set_balance(user_id, balances[user_id])
+            if user_id in games:
+                self.hot.set_games_played(user_id, games[user_id])
+            self.hot.touch(user_id, now)
+            self.used(user_id)
+            new = self.hot.get(user_id)
+            if self.account_key(new) is not None:
+                self.ranking.add(self.account_key(new))
+            self.funded_delta += (new.balance is not None) - (old is not None and old.balance is not None)
+    
+    def commit(self, balances, games):
+        now = int(time.time())
+        self.journal.append(balances, games, now)
+        self.store(balances, games, now)
+        if self.journal.size >= SNAPSHOT_COMPACT_EVERY:
+            self.compact()
+        else:
+            self.maybe_trim()
+    
+    def maybe_trim(self):
+        if len(self.hot) > 2 * HOT_ACCOUNTS or time.monotonic() - self.last_trim > HOT_TRIM_INTERVAL:
+            self.trim()
+    
+    def trim(self):
+        """Renvoie les comptes froids à l'instantané, en le réécrivant si besoin"""
+        self.last_trim = time.monotonic()
+        if self.compaction is not None:
+            return
+        if self.journal.size == 0 and not os.path.exists(self.journal.rotated):
+            # Rien à écrire: les comptes chauds sont tous identiques à l'instantané
+            self.evict(self.hot.copy())
+        else:
+            self.compact()
+    
+    def evict(self, persisted):
+        """Retire de `hot` les comptes de `persisted` qui n'ont pas bougé depuis, sauf les comptes encore chauds"""
+        now = time.monotonic()
+        keep = set()
+        for user_id in reversed(self.recent):
+            if len(keep) >= HOT_ACCOUNTS or now - self.recent[user_id] > HOT_IDLE_SECONDS:
+                break
+            if self.hot.get_games_played(user_id) > 0:
+                keep.add(user_id)
+        evicted = []
+        for account in persisted:
+            if account.user_id in keep:
+                continue
+            current = self.hot.get(account.user_id)
+            if (current.balance, current.games_played, current.last_activity) == (account.balance, account.games_played, account.last_activity):
+                evicted.append(account.user_id)
+        self.hot.discard(evicted)
+        for user_id in evicted:
+            del self.recent[user_id]
+        metrics.inc('cazgino_account_evictions_total', len(evicted))
+        self.reindex()
+    
+    def compact(self):
+        """Replie les changements dans un nouvel instantané, écrit par un thread si la boucle tourne"""
+        if self.compaction is not None:
+            return
+        self.journal.rotate()
+        changes = self.hot.copy()
+        job = functools.partial(self.write_base, self.base, self.base_ranking, changes, self.ranking.slice(0, len(self.ranking)))
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            job()
+            self.compacted(changes)
+            return
+        self.compaction = self.executor.submit(job)
+        self.compaction.add_done_callback(lambda future: self.done(future, changes))
+    
+    def write_base(self, base, base_ranking, changes, ranking):
+        """Fusionne instantané et changements dans un nouveau fichier (appelé depuis le thread)"""
+        started = time.perf_counter()
+        accounts = base.merged(changes)
+        kept = (base_ranking[i] for i in range(len(base_ranking)) if changes.find(base_ranking.ids[i]) < 0)
+        record_db_write('snapshot', started, write_snapshot(self.filename, accounts, heapq.merge(kept, ranking)))
+        # Le journal mis de côté est maintenant dans l'instantané
+        if os.path.exists(self.journal.rotated):
+            os.remove(self.journal.rotated)
+    
+    def done(self, future, changes):
+        # Appelé depuis le thread d'écriture
+        try:
+            self.loop.call_soon_threadsafe(self.compacted, changes, future.exception())
+        except RuntimeError:
+            pass  # Boucle déjà fermée: le prochain démarrage ouvrira le nouvel instantané
+    
+    def compacted(self, changes, error=None):
+        self.compaction = None
+        if error is not None:
+            # Le journal mis de côté reste là: il sera rejoué ou replié la prochaine fois
+            print(f"❌ Échec de l'écriture de l'instantané: {error!r}")
+            return
+        self.open_base()
+        # Les comptes copiés sont désormais dans l'instantané: les froids peuvent quitter la mémoire
+        self.evict(changes)
+    
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.journal.close()
+    
+    def get_balance(self, user_id):
+        account = self.lookup(user_id)
+        return None if account is None else account.balance
+    
+    def get_games_played(self, user_id):
+        account = self.lookup(user_id)
+        return 0 if account is None else account.games_played
+    
+    def count(self):
+        return self.base.funded + self.funded_delta
+    
+    def ranked_count(self):
+        return len(self.base_ranking) - len(self.stale) + len(self.ranking)
+    
+    def merged_rank(self, key):
+        """Nombre de clés du classement fusionné plus petites que `key`"""
+        return bisect.bisect_left(self.base_ranking, key) - self.stale.rank(key) + self.ranking.rank(key)
+    
+    def leaderboard(self, limit=None, offset=0):
+        total = self.ranked_count()
+        limit = total if limit is None else limit
+        if offset >= total or limit <= 0:
+            return []
+        base = self.base_ranking
+        # Dernière position de l'instantané précédée d'au plus `offset` clés du classement fusionné
+        lo, hi = 0, len(base)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            # Les clés de l'instantané sont uniques: `mid` clés de l'instantané la précèdent
+            key = base[mid]
+            if mid - self.stale.rank(key) + self.ranking.rank(key) <= offset:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == 0:
+            b = o = position = 0
+        else:
+            b = lo - 1
+            o = self.ranking.rank(base[b])
+            position = b - self.stale.rank(base[b]) + o
+        # Fusionne les deux classements à partir de là, en sautant les clés périmées
+        pending = self.ranking.slice(o, offset - position + limit)
+        k = 0
+        keys = []
+        while len(keys) < limit:
+            while b < len(base) and self.hot.find(base.ids[b]) >= 0:
+                b += 1
+            base_key = base[b] if b < len(base) else None
+            change_key = pending[k] if k < len(pending) else None
+            if base_key is None and change_key is None:
+                break
+            if change_key is None or (base_key is not None and base_key < change_key):
+                key = base_key
+                b += 1
+            else:
+                key = change_key
+                k += 1
+            if position >= offset:
+                keys.append(key)
+            position += 1
+        board = []
+        for key in keys:
+            balance, user_id = unpack_rank_key(key)
+            board.append((user_id, balance, self.current(user_id).games_played))
+        return board
+    
+    def rank(self, user_id):
+        key = self.account_key(self.current(user_id))
+        return None if key is None else self.merged_rank(key)
+
+class SQLiteStorage:
+    """Comptes dans une base SQLite (mode WAL).
+    
+    Comme pour les autres backends, le classement est un RankIndex en mémoire,
+    construit à l'ouverture et tenu à jour à chaque commit: rang et pages en
+    O(log n) au lieu d'un COUNT ou d'un OFFSET qui parcourent l'index SQLite."""
+    QUERY_CHUNK = 500  # Ids par requête `IN (...)`, sous la limite de variables de SQLite
+    def __init__(self, filename=SQLITE_FILE):
+        is_new = not os.path.exists(filename)
+        self.conn = sqlite3.connect(filename)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript("""
+            CREATE TABLE IF NOT EXISTS accounts (
+                user_id INTEGER PRIMARY KEY,
+                balance INTEGER,
+                games_played INTEGER NOT NULL DEFAULT 0,
+                last_activity INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS accounts_leaderboard
+                ON accounts (balance DESC, user_id)
+                WHERE games_played > 0 AND balance IS NOT NULL;
+        """)
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(accounts)')]
+        if 'last_activity' not in columns:
+            with self.conn:
+                self.conn.execute('ALTER TABLE accounts ADD COLUMN last_activity INTEGER NOT NULL DEFAULT 0')
+        if is_new:
+            self.import_json()
+        # Classement trié par (-solde, id), tenu à jour à chaque commit
+        self.ranking = RankIndex(
+            rank_key(balance, user_id) for balance, user_id in self.conn.execute(
+                'SELECT balance, user_id FROM accounts WHERE games_played > 0 AND balance IS NOT NULL'
+            )
+        )
+    
+    def select(self, columns, user_ids):
+        """Lignes `user_id, columns` des comptes `user_ids`, par lots de QUERY_CHUNK ids"""
+        user_ids = list(user_ids)
+        for start in range(0, len(user_ids), self.QUERY_CHUNK):
+            chunk = user_ids[start:start + self.QUERY_CHUNK]
+            yield from self.conn.execute(
+                f'SELECT user_id, {columns} FROM accounts WHERE user_id IN ({",".join("?" * len(chunk))})', chunk
+            )
+    
+    def ranking_keys(self, user_ids):
+        """{id: clé de classement} des comptes `user_ids` qui figurent au classement"""
+        return {
+            user_id: rank_key(balance, user_id)
+            for user_id, balance, games_played in self.select('balance, games_played', user_ids)
+            if balance is not None and games_played > 0
+        }
+    
+    def import_json(self, filename='cazgino_data.json', stats_file='cazgino_stats.json', journal_file=JOURNAL_FILE):
+        """Migration unique depuis les fichiers JSON (journal compris)"""
+        source = JsonStorage(filename, stats_file, journal_file)
+        if not len(source.accounts):
+            return
+        with self.conn:
+            self.conn.executemany(
+                'INSERT OR REPLACE INTO accounts (user_id, balance, games_played, last_activity) VALUES (?, ?, ?, ?)',
+                [(account.user_id, account.balance, account.games_played, account.last_activity)
+                 for account in source.accounts]
+            )
+        print(f'🗄️ {self.count()} comptes importés depuis {filename}')
+    
+    def close(self):
+        self.conn.close()
+    
+    def get_balance(self, user_id):
+        row = self.conn.execute('SELECT balance FROM accounts WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else None
+    
+    def get_games_played(self, user_id):
+        row = self.conn.execute('SELECT games_played FROM accounts WHERE user_id = ?', (user_id,)).fetchone()
+        return row[0] if row else 0
+    
+    def commit(self, balances, games):
+        started = time.perf_counter()
+        now = int(time.time())
+        touched = balances.keys() | games.keys()
+        old_keys = self.ranking_keys(touched)
+        with self.conn:
+            self.conn.executemany(
+                'INSERT INTO accounts (user_id, balance, last_activity) VALUES (?, ?, ?) '
+                'ON CONFLICT (user_id) DO UPDATE SET balance = excluded.balance, last_activity = excluded.last_activity',
+                [(user_id, balance, now) for user_id, balance in balances.items()]
+            )
+            self.conn.executemany(
+                'INSERT INTO accounts (user_id, games_played, last_activity) VALUES (?, ?, ?) '
+                'ON CONFLICT (user_id) DO UPDATE SET games_played = excluded.games_played, last_activity = excluded.last_activity',
+                [(user_id, games_played, now) for user_id, games_played in games.items()]
+            )
+        new_keys = self.ranking_keys(touched)
+        for user_id in touched:
+            old_key, new_key = old_keys.get(user_id), new_keys.get(user_id)
+            if old_key != new_key:
+                if old_key is not None:
+                    self.ranking.remove(old_key)
+                if new_key is not None:
+                    self.ranking.add(new_key)
+        record_db_write('sqlite', started)
+    
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM accounts WHERE balance IS NOT NULL').fetchone()[0]
+    
+    def ranked_count(self):
+        return len(self.ranking)
+    
+    def leaderboard(self, limit=None, offset=0):
+        keys = self.ranking.slice(offset, len(self.ranking) if limit is None else limit)
+        rows = [unpack_rank_key(key) for key in keys]
+        games = dict(self.select('games_played', (user_id for _, user_id in rows)))
+        return [(user_id, balance, games[user_id]) for balance, user_id in rows]
+    
+    def rank(self, user_id):
+        key = self.ranking_keys([user_id]).get(user_id)
+        return None if key is None else self.ranking.rank(key)
+
+class LeaderboardCache:
+    """Pages du classement déjà rendues, invalidées seulement si leur contenu change.
+    
+    Chaque page garde ses bornes (première et dernière clé de classement) et le
+    nombre de pages de son pied: une modification n'invalide que les pages que
+    l'ancienne et la nouvelle clé d'un compte encadrent, sans calculer de rang."""
+    def __init__(self, page_size=LEADERBOARD_PAGE_SIZE, ttl=LEADERBOARD_CACHE_TTL):
+        self.page_size = page_size
+        self.ttl = ttl
+        self.pages = {}  # {page: (texte, date de rendu, bornes, nombre de pages)}
+        self.versions = {}  # {page: nombre d'invalidations}
+    
+    def page_count(self, ranked):
+        return max(1, -(-ranked // self.page_size))
+    
+    def get(self, page):
+        entry = self.pages.get(page)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+    
+    def version(self, page):
+        return self.versions.get(page, 0)
+    
+    def track(self, page):
+        """Version d'une page avant son rendu: toute modification d'ici là l'invalide"""
+        self.pages.setdefault(page, (None, time.monotonic(), None, None))
+        return self.version(page)
+    
+    def put(self, page, text, version, rows, total_pages):
+        # Ignore un rendu commencé avant une invalidation de la page
+        if self.version(page) == version:
+            self.pages[page] = (text, time.monotonic(), self.bounds(rows), total_pages)
+    
+    def bounds(self, rows):
+        """Clés de classement couvertes par une page, jusqu'à la fin du classement si elle n'est pas pleine"""
+        first = rank_key(rows[0][1], rows[0][0]) if rows else math.inf
+        last = rank_key(rows[-1][1], rows[-1][0]) if len(rows) == self.page_size else math.inf
+        return first, last
+    
+    def invalidate(self, changes, total_pages=None):
+        """Invalide les pages touchées par `changes` [(ancienne clé, nouvelle clé)] (math.inf: hors du
+        classement), et, si `total_pages` est donné, celles qui affichent un autre nombre de pages"""
+        for page, (_, _, bounds, shown_pages) in list(self.pages.items()):
+            if bounds is None or (total_pages is not None and shown_pages != total_pages) or any(
+                    min(old, new) <= bounds[1] and max(old, new) >= bounds[0] for old, new in changes):
+                del self.pages[page]
+                self.versions[page] = self.version(page) + 1
+
+def open_storage(backend=STORAGE_BACKEND, persistence=JSON_PERSISTENCE):
+    if backend == 'sqlite':
+        return SQLiteStorage()
+    if backend == 'snapshot':
+        return SnapshotStorage()
+    if persistence == 'journal':
+        return JsonStorage()
+    if os.path.exists(JOURNAL_FILE) and os.path.getsize(JOURNAL_FILE) > 0:
+        # Replie le journal laissé par le mode 'journal' avant de s'en passer
+        JsonStorage().close()
+    if persistence == 'background':
+        return JsonStorage(journal_file=None, flush_delay=JSON_FLUSH_MAX_DELAY)
+    return JsonStorage(journal_file=None)
+
+class StatsTable:
+    """Compteurs entiers par id, en colonnes nommées, sur deux niveaux comme SnapshotStorage:
+    l'instantané (ids triés et une colonne par compteur, projetés en mémoire et lus
+    par dichotomie) et les lignes modifiées depuis (`rows`, une array('q') par id).
+    
+    Une colonne est ajoutée à sa première utilisation (nouvelle recette, nouveau
+    type de mise): les lignes plus courtes valent 0 dans les colonnes manquantes."""
+    def __init__(self):
+        self.dirty = set()  # Ids modifiés depuis le dernier ajout au journal
+        self.attach([], memoryview(array('Q')), [])
+    
+    def attach(self, fields, ids, columns, written=None):
+        """Pose la table sur les colonnes d'un instantané, qui contient alors toutes ses lignes.
+        
+        `written`: copie (copy()) écrite dans cet instantané pendant que la table
+        continuait à changer; les lignes modifiées depuis, et les colonnes ajoutées
+        depuis, sont gardées."""
+        rows = {}
+        if written is not None:
+            fields = list(fields) + self.fields[len(fields):]
+            rows = {key: row for key, row in self.rows.items() if key in self.dirty or written.rows.get(key) != row}
+        self.fields = list(fields)
+        self.index = {name: i for i, name in enumerate(self.fields)}
+        self.base_ids = ids
+        self.base_columns = columns
+        self.rows = rows
+    
+    def copy(self):
+        """Copie des lignes modifiées sur le même instantané, à écrire depuis un thread"""
+        table = StatsTable.__new__(StatsTable)
+        table.dirty = set()
+        table.fields = list(self.fields)
+        table.index = dict(self.index)
+        table.base_ids = self.base_ids
+        table.base_columns = self.base_columns
+        table.rows = {key: array('q', row) for key, row in self.rows.items()}
+        return table
+    
+    def column(self, name):
+        i = self.index.get(name)
+        if i is None:
+            i = self.index[name] = len(self.fields)
+            self.fields.append(name)
+        return i
+    
+    def find(self, key):
+        """Position de `key` dans l'instantané, -1 s'il n'y est pas"""
+        i = bisect.bisect_left(self.base_ids, key)
+        return i if i < len(self.base_ids) and self.base_ids[i] == key else -1
+    
+    def row(self, key):
+        row = self.rows.get(key)
+        if row is None:
+            # Premier changement depuis l'instantané: la ligne part de ses valeurs actuelles
+            i = self.find(key)
+            row = self.rows[key] = array('q', (column[i] for column in self.base_columns) if i >= 0 else ())
+        if len(row) < len(self.fields):
+            row.extend(itertools.repeat(0, len(self.fields) - len(row)))
+        self.dirty.add(key)
+        return row
+    
+    def add(self, key, name, value=1):
+        i = self.column(name)
+        self.row(key)[i] += value
+    
+    def set(self, key, name, value):
+        i = self.column(name)
+        self.row(key)[i] = value
+    
+    def value(self, key, name):
+        i = self.index.get(name)
+        if i is None:
+            return 0
+        row = self.rows.get(key)
+        if row is not None:
+            return row[i] if i < len(row) else 0
+        j = self.find(key)
+        return self.base_columns[i][j] if j >= 0 and i < len(self.base_columns) else 0
+    
+    def get(self, key):
+        """Compteurs d'un id: {colonne: valeur}, None s'il n'en a aucun"""
+        row = self.rows.get(key)
+        if row is None:
+            i = self.find(key)
+            if i < 0:
+                return None
+            row = [column[i] for column in self.base_columns]
+        return {name: row[i] if i < len(row) else 0 for i, name in enumerate(self.fields)}
+    
+    def to_json(self, keys):
+        return {'fields': self.fields, 'rows': {str(key): list(self.rows[key]) for key in keys}}
+    
+    def load(self, data):
+        """Remplace les lignes d'un ajout au journal, colonnes retrouvées par leur nom"""
+        columns = [self.column(name) for name in data['fields']]
+        for key, values in data['rows'].items():
+            row = array('q', itertools.repeat(0, len(self.fields)))
+            for i, value in zip(columns, values):
+                row[i] = value
+            self.rows[int(key)] = row
+    
+    def merge_plan(self):
+        """Lignes modifiées triées, morceaux de l'instantané qui les précèdent et nombre total de lignes"""
+        keys = sorted(self.rows)
+        cuts = []
+        start = 0
+        for key in keys:
+            end = bisect.bisect_left(self.base_ids, key, start)
+            cuts.append((start, end))
+            # Une ligne modifiée remplace celle de l'instantané
+            start = end + (end < len(self.base_ids) and self.base_ids[end] == key)
+        cuts.append((start, len(self.base_ids)))
+        return keys, cuts, sum(end - start for start, end in cuts) + len(keys)
+    
+    def write_columns(self, f, plan):
+        """Écrit ids puis colonnes, instantané et lignes modifiées fusionnés (morceaux copiés d'un bloc)"""
+        keys, cuts, _ = plan
+        sources = [(self.base_ids, 'Q', keys)]
+        for i in range(len(self.fields)):
+            values = [self.rows[key][i] if i < len(self.rows[key]) else 0 for key in keys]
+            sources.append((self.base_columns[i] if i < len(self.base_columns) else None, 'q', values))
+        for base, typecode, values in sources:
+            out = array(typecode)
+            for (start, end), value in zip(cuts, itertools.chain(values, [None])):
+                if base is None:
+                    out.frombytes(bytes(out.itemsize * (end - start)))  # Colonne ajoutée depuis: des 0
+                else:
+                    out.frombytes(base[start:end].cast('B'))
+                if value is not None:
+                    out.append(value)
+            f.write(out)
+
+def write_stats_snapshot(filename, tables):
+    """Écrit les StatsTable `tables` ({nom: table}) dans un instantané binaire, via un fichier temporaire.
+    
+    Après l'en-tête viennent leur description JSON (champs et nombre de lignes de
+    chaque table, complétée à un multiple de 8 octets), puis les colonnes de
+    chaque table dans l'ordre de la machine: ids (64 bits non signés) et compteurs.
+    Renvoie le nombre d'octets écrits."""
+    plans = {name: table.merge_plan() for name, table in tables.items()}
+    meta = json.dumps({name: {'fields': table.fields, 'count': plans[name][2]} for name, table in tables.items()},
+                      separators=(',', ':')).encode()
+    meta += b' ' * (-len(meta) % 8)
+    tmp = filename + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(STATS_HEADER.pack(STATS_MAGIC, len(meta)))
+        f.write(meta)
+        for name, table in tables.items():
+            table.write_columns(f, plans[name])
+        size = f.tell()
+    os.replace(tmp, filename)
+    return size
+
+class StatsStore:
+    """Statistiques des joueurs et des serveurs, tenues à jour à chaque règlement.
+    
+    Rien n'est recalculé depuis l'historique: chaque partie réglée et chaque job
+    d'intérim terminé incrémente les compteurs du joueur et ceux de son serveur.
+    Les statistiques restent hors du commit des soldes (les mises n'écrivent rien
+    de plus): les lignes modifiées partent dans le journal en une écriture au
+    plus toutes les `flush_delay` secondes, l'instantané est réécrit tous les
+    STATS_COMPACT_EVERY ajouts. Un arrêt brutal peut perdre ces dernières
+    secondes de statistiques, jamais d'argent.
+    
+    Les lignes sont copiées sur la boucle; l'encodage, l'écriture du journal et
+    celle de l'instantané se font dans un thread (un seul, dans l'ordre), comme
+    pour SnapshotStorage.
+    
+    Comme pour les soldes du backend 'snapshot', le démarrage ne lit que l'en-tête
+    de l'instantané: une ligne n'est lue que lorsqu'on la consulte."""
+    def __init__(self, filename=STATS_FILE, journal_file=STATS_JOURNAL_FILE, flush_delay=STATS_FLUSH_DELAY):
+        self.filename = filename
+        self.journal_file = journal_file
+        self.flush_delay = flush_delay
+        self.rotated = journal_file + '.1'  # Journal en cours de repli dans un instantané
+        self.players = StatsTable()
+        self.guilds = StatsTable()
+        self.appended = 0  # Lignes du journal depuis le dernier fichier complet
+        self.timer = None
+        self.compaction = None  # Écriture de l'instantané en cours dans le thread
+        self.loop = None
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='cazgino-stats')
+        if os.path.exists(filename):
+            self.open_base()
+        self.replay_journal()
+    
+    def open_base(self, written=None):
+        with open(self.filename, 'rb') as f:
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, size = STATS_HEADER.unpack_from(mapped)
+        if magic != STATS_MAGIC:
+            raise ValueError(f"{self.filename} n'est pas un instantané des statistiques du Cazgino")
+        offset = STATS_HEADER.size
+        meta = json.loads(mapped[offset:offset + size])
+        offset += size
+        view = memoryview(mapped)
+        for name, table in (('players', self.players), ('guilds', self.guilds)):
+            count = meta[name]['count']
+            columns = []
+            for fmt in ['Q'] + ['q'] * len(meta[name]['fields']):
+                columns.append(view[offset:offset + 8 * count].cast(fmt))
+                offset += 8 * count
+            table.attach(meta[name]['fields'], columns[0], columns[1:], None if written is None else written[name])
+    
+    def replay_journal(self):
+        # Le journal mis de côté par un repli interrompu précède le journal en cours
+        for filename in (self.rotated, self.journal_file):
+            if not os.path.exists(filename):
+                continue
+            with open(filename, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        break  # Dernière ligne tronquée par un crash
+                    self.players.load(record['players'])
+                    self.guilds.load(record['guilds'])
+                    self.appended += 1
+        if self.appended:
+            self.compact()
+    
+    def record_game(self, guild_id, outcomes):
+        """Une partie réglée: `outcomes` = [(joueur, mise totale, gain total, [(type de mise, gagnée)])]"""
+        players, guilds = self.players, self.guilds
+        guilds.add(guild_id, 'games')
+        for user_id, stake, winnings, bets in outcomes:
+            net = winnings - stake
+            players.add(user_id, 'games')
+            guilds.add(guild_id, 'player_games')
+            for table, key in ((players, user_id), (guilds, guild_id)):
+                table.add(key, 'wagered', stake)
+                if net > 0:
+                    table.add(key, 'won', net)
+                elif net < 0:
+                    table.add(key, 'lost', -net)
+                for kind, hit in bets:
+                    table.add(key, 'bets_' + kind)
+                    if hit:
+                        table.add(key, 'hits_' + kind)
+            # Série en cours: > 0 victoires d'affilée, < 0 défaites; une mise récupérée l'interrompt
+            streak = players.value(user_id, 'streak')
+            if net > 0:
+                players.add(user_id, 'wins')
+                streak = max(streak, 0) + 1
+                players.set(user_id, 'best_streak', max(streak, players.value(user_id, 'best_streak')))
+                if net > players.value(user_id, 'biggest_win'):
+                    players.set(user_id, 'biggest_win', net)
+                if net > guilds.value(guild_id, 'biggest_win'):
+                    guilds.set(guild_id, 'biggest_win', net)
+                    guilds.set(guild_id, 'biggest_winner', user_id)
+            elif net < 0:
+                players.add(user_id, 'losses')
+                streak = min(streak, 0) - 1
+                players.set(user_id, 'worst_streak', max(-streak, players.value(user_id, 'worst_streak')))
+            else:
+                streak = 0
+            players.set(user_id, 'streak', streak)
+        self.schedule_flush()
+    
+    def record_job(self, guild_id, user_id, recipe_key, completed):
+        """Un job d'intérim terminé, livré ou raté"""
+        name = ('jobs_' if completed else 'failed_') + recipe_key
+        self.players.add(user_id, name)
+        self.guilds.add(guild_id, name)
+        self.schedule_flush()
+    
+    def schedule_flush(self):
+        if self.timer is None:
+            self.timer = scheduler.call_later(self.flush_delay, self.flush)
+    
+    def submit(self, job, *args):
+        """Exécute `job` dans le thread d'écriture si la boucle tourne, sinon tout de suite.
+        Renvoie le futur de l'écriture, None si elle est déjà faite."""
+        try:
+            self.loop = asyncio.get_running_loop()
+        except RuntimeError:
+            job(*args)
+            return None
+        return self.executor.submit(job, *args)
+    
+    def flush(self):
+        """Ajoute au journal, en une ligne, les valeurs actuelles des lignes modifiées"""
+        self.timer = None
+        if not self.players.dirty and not self.guilds.dirty:
+            return
+        # Les valeurs sont copiées ici (listes), encodées et écrites dans le thread
+        record = {
+            'players': self.players.to_json(self.players.dirty),
+            'guilds': self.guilds.to_json(self.guilds.dirty),
+            't': int(time.time()),
+        }
+        self.players.dirty.clear()
+        self.guilds.dirty.clear()
+        self.appended += 1
+        future = self.submit(self.write_journal, record)
+        if future is not None:
+            future.add_done_callback(lambda future: self.done(future, self.flushed, record))
+        if self.appended >= STATS_COMPACT_EVERY:
+            self.compact()
+    
+    def write_journal(self, record):
+        started = time.perf_counter()
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with open(self.journal_file, 'a') as f:
+            f.write(line)
+        record_db_write('player_stats_journal', started, len(line.encode()))
+    
+    def flushed(self, record, error):
+        if error is not None:
+            print(f"❌ Échec de l'écriture du journal des statistiques: {error!r}")
+            # Réessaie au prochain ajout
+            self.players.dirty.update(map(int, record['players']['rows']))
+            self.guilds.dirty.update(map(int, record['guilds']['rows']))
+            self.schedule_flush()
+    
+    def compact(self, wait=False):
+        """Écrit un nouvel instantané puis vide le journal, dans le thread si la boucle tourne"""
+        if self.compaction is not None:
+            return
+        written = {'players': self.players.copy(), 'guilds': self.guilds.copy()}
+        self.appended = 0
+        if wait:
+            self.write_base(written)
+            self.compacted(written, None)
+            return
+        self.compaction = self.submit(self.write_base, written)
+        if self.compaction is None:
+            self.compacted(written, None)
+        else:
+            self.compaction.add_done_callback(lambda future: self.done(future, self.compacted, written))
+    
+    def write_base(self, written):
+        """Met le journal de côté puis écrit l'instantané (appelé depuis le thread, après les ajouts déjà demandés)"""
+        if os.path.exists(self.journal_file):
+            if os.path.exists(self.rotated):
+                # Un repli précédent a échoué: on garde tout, dans l'ordre
+                with open(self.journal_file, 'r') as source, open(self.rotated, 'a') as target:
+                    target.write(source.read())
+                os.remove(self.journal_file)
+            else:
+                os.replace(self.journal_file, self.rotated)
+        started = time.perf_counter()
+        record_db_write('player_stats', started, write_stats_snapshot(self.filename, written))
+        # Le journal mis de côté est maintenant dans l'instantané
+        if os.path.exists(self.rotated):
+            os.remove(self.rotated)
+    
+    def done(self, future, callback, arg):
+        # Appelé depuis le thread d'écriture
+        try:
+            self.loop.call_soon_threadsafe(callback, arg, future.exception())
+        except RuntimeError:
+            pass  # Boucle déjà fermée: close() réécrit l'instantané
+    
+    def compacted(self, written, error):
+        self.compaction = None
+        if error is not None:
+            # Le journal mis de côté reste là: il sera rejoué ou replié la prochaine fois
+            print(f"❌ Échec de l'écriture de l'instantané des statistiques: {error!r}")
+            return
+        # Les lignes copiées sont maintenant dans l'instantané
+        self.open_base(written)
+    
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.executor.shutdown(wait=True)
+        # Un repli fini dont la boucle n'a pas vu la fin est refait ici, de façon synchrone
+        pending, self.compaction = self.compaction, None
+        if pending is not None or self.players.dirty or self.guilds.dirty or self.appended:
+            self.compact(wait=True)
+
+# Classe pour gérer la base de données
+class Database:
+    def __init__(self, storage=None, stats=None):
+        self.storage = storage if storage is not None else open_storage()
+        self.stats = stats if stats is not None else StatsStore()
+        self.leaderboard_cache = LeaderboardCache()
+    
+    def close(self):
+        self.storage.close()
+        self.stats.close()
+    
+    def apply(self, balance_deltas, game_deltas):
+        """Applique un lot de modifications et le persiste en une seule écriture"""
+        # Calcule toutes les nouvelles valeurs avant de toucher aux données
+        balances = {}
+        created = []
+        for user_id, delta in balance_deltas.items():
+            current = self.storage.get_balance(user_id)
+            if current is None:
+                created.append(user_id)
+            balances[user_id] = (STARTING_BALANCE if current is None else current) + delta
+        games = {}
+        for user_id, count in game_deltas.items():
+            games[user_id] = self.storage.get_games_played(user_id) + count
+        events.ledger(balance_deltas, balances, game_deltas, games, created)
+        
+        cache = self.leaderboard_cache
+        if not cache.pages:
+            self.storage.commit(balances, games)
+            return
+        # Clés de classement avant/après (lectures par id, pas de calcul de rang)
+        changes = []
+        for user_id in balances.keys() | games.keys():
+            old_balance = self.storage.get_balance(user_id)
+            old_games = self.storage.get_games_played(user_id)
+            old_key = math.inf if old_balance is None or old_games == 0 else rank_key(old_balance, user_id)
+            new_balance = balances.get(user_id, old_balance)
+            new_games = games.get(user_id, old_games)
+            new_key = math.inf if new_balance is None or new_games == 0 else rank_key(new_balance, user_id)
+            # Une partie de plus change aussi la ligne affichée, même à clé égale
+            if old_key != new_key or (new_key != math.inf and user_id in games):
+                changes.append((old_key, new_key))
+        self.storage.commit(balances, games)
+        total_pages = None
+        if any(math.inf in change for change in changes):
+            # Entrée ou sortie du classement: le nombre de pages affiché peut changer
+            total_pages = cache.page_count(self.storage.ranked_count())
+        cache.invalidate(changes, total_pages)
+    
+    def transaction(self):
+        """Regroupe plusieurs modifications: `with db.transaction() as tx: ...`"""
+        return Transaction(self)
+    
+    def get_balance(self, user_id):
+        user_id = int(user_id)
+        balance = self.storage.get_balance(user_id)
+        if balance is None:
+            self.apply({user_id: 0}, {})
+            balance = STARTING_BALANCE
+        return balance
     
     def set_balance(self, user_id, amount):
-        self.data[str(user_id)] = amount
-        self.save_data()
+        user_id = int(user_id)
+        current = self.storage.get_balance(user_id)
+        self.apply({user_id: amount - (STARTING_BALANCE if current is None else current)}, {})
     
     def add_balance(self, user_id, amount):
-        current = self.get_balance(user_id)
-        self.set_balance(user_id, current + amount)
+        self.apply({int(user_id): amount}, {})
+    
+    def debit(self, user_id, amount):
+        """Débite `amount` si le solde suffit; renvoie (débité ou non, solde après l'opération)"""
+        balance = self.get_balance(user_id)
+        if amount > balance:
+            return False, balance
+        self.apply({int(user_id): -amount}, {})
+        return True, balance - amount
     
     def add_game_played(self, user_id):
         """Enregistre qu'un joueur a participé à une partie"""
-        user_id = str(user_id)
-        if user_id not in self.stats:
-            self.stats[user_id] = {'games_played': 0}
-        self.stats[user_id]['games_played'] += 1
-        self.save_stats()
+        self.apply({}, {int(user_id): 1})
+    
+    def get_games_played(self, user_id):
+        return self.storage.get_games_played(int(user_id))
     
     def has_played(self, user_id):
         """Vérifie si un joueur a déjà joué au moins une partie"""
-        user_id = str(user_id)
-        return user_id in self.stats and self.stats[user_id]['games_played'] > 0
+        return self.get_games_played(user_id) > 0
+    
+    def count_accounts(self):
+        return self.storage.count()
+    
+    def get_leaderboard(self, limit=None, offset=0):
+        """Retourne le classement (user_id, solde, parties) des joueurs ayant joué au moins une partie"""
+        return self.storage.leaderboard(limit, offset)
+    
+    def count_ranked(self):
+        """Nombre de joueurs présents dans le classement"""
+        return self.storage.ranked_count()
+    
+    def get_rank(self, user_id):
+        """Position (0 = premier) du joueur dans le classement, None s'il n'y figure pas"""
+        return self.storage.rank(int(user_id))
+    
+    def record_game(self, guild_id, outcomes):
+        """Met à jour les statistiques après le règlement d'une partie (voir StatsStore)"""
+        self.stats.record_game(int(guild_id), outcomes)
+    
+    def record_job(self, guild_id, user_id, recipe_key, completed):
+        self.stats.record_job(int(guild_id), int(user_id), recipe_key, completed)
+    
+    def get_player_stats(self, user_id):
+        """Compteurs d'un joueur ({nom: valeur}), None s'il n'a encore rien joué"""
+        return self.stats.players.get(int(user_id))
+    
+    def get_guild_stats(self, guild_id):
+        return self.stats.guilds.get(int(guild_id))
+
+class Transaction:
+    """Lot de modifications appliqué d'un coup à la sortie du bloc `with`.
+    
+    Si une exception survient dans le bloc, rien n'est appliqué."""
+    def __init__(self, db):
+        self.db = db
+        self.balance_deltas = {}
+        self.game_deltas = {}
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.commit()
+        return False
+    
+    def get_balance(self, user_id):
+        """Solde en tenant compte des modifications pas encore appliquées"""
+        user_id = int(user_id)
+        return self.db.get_balance(user_id) + self.balance_deltas.get(user_id, 0)
+    
+    def add_balance(self, user_id, amount):
+        user_id = int(user_id)
+        self.balance_deltas[user_id] = self.balance_deltas.get(user_id, 0) + amount
+    
+    def add_game_played(self, user_id):
+        user_id = int(user_id)
+        self.game_deltas[user_id] = self.game_deltas.get(user_id, 0) + 1
+    
+    def commit(self):
+        if self.balance_deltas or self.game_deltas:
+            self.db.apply(self.balance_deltas, self.game_deltas)
+        self.balance_deltas = {}
+        self.game_deltas = {}
+
+class LedgerError(Exception):
+    """Erreur renvoyée par le service de comptes"""
+
+class RemoteLeaderboardCache(LeaderboardCache):
+    """Pages du classement d'un client du service de comptes.
+    
+    Le service voit les modifications de tous les bots: c'est lui qui tient les
+    versions des pages, vérifiées à chaque lecture du cache."""
+    def __init__(self, client):
+        super().__init__()
+        self.client = client
+    
+    def get(self, page):
+        entry = self.pages.get(page)
+        if entry is None or time.monotonic() - entry[1] > self.ttl:
+            return None
+        if self.versions.get(page) != self.version(page):
+            return None
+        return entry[0]
+    
+    def version(self, page):
+        return self.client.call('page_version', page)
+    
+    def track(self, page):
+        return self.version(page)
+    
+    def put(self, page, text, version, rows, total_pages):
+        # La version vient du service: un rendu déjà invalidé sera refusé par get()
+        self.pages[page] = (text, time.monotonic(), None, total_pages)
+        self.versions[page] = version
+
+class LedgerClient(Database):
+    """Database servie par le service de comptes (ledger.py) à travers un socket Unix.
+    
+    Une ligne JSON par requête, précédée de son numéro, que la réponse reprend.
+    Le socket appartient à un thread qui fait tourner sa propre boucle asyncio:
+    lecture des réponses, reconnexion avec un délai croissant après une coupure.
+    La boucle du bot n'y fait que déposer ses requêtes.
+    
+    Les soldes attendent la réponse du service: une écriture refusée, sans réponse
+    dans le délai ou coupée par une déconnexion lève LedgerError, et Transaction
+    comme le règlement d'une table peuvent annuler au lieu de diverger du service.
+    Seules les statistiques partent sans l'attendre; pendant une coupure, elles
+    sont gardées (LEDGER_MAX_PENDING au plus) et envoyées à la reconnexion.
+    Le service exécute les requêtes une à une, si bien que chaque opération,
+    dont le débit conditionnel de `debit`, est atomique pour tous les bots."""
+    def __init__(self, path=LEDGER_SOCKET):
+        self.path = path
+        self.ids = itertools.count(1)
+        self.waiting = {}  # {numéro: concurrent.futures.Future, None pour une statistique}
+        self.backlog = deque(maxlen=LEDGER_MAX_PENDING)  # Statistiques arrivées pendant une coupure
+        self.writer = None
+        self.closing = False
+        self.leaderboard_cache = RemoteLeaderboardCache(self)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='cazgino-ledger', daemon=True)
+        self.thread.start()
+        connected = concurrent.futures.Future()
+        self.task = asyncio.run_coroutine_threadsafe(self.run(connected), self.loop)
+        # Le premier échec de connexion remonte: un chemin erroné se voit au démarrage
+        connected.result()
+    
+    async def run(self, connected):
+        """Connexion, lecture des réponses et reconnexion, dans le thread du client"""
+        delay = LEDGER_RECONNECT_DELAYS[0]
+        while not self.closing:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.path)
+            except OSError as e:
+                if not connected.done():
+                    connected.set_exception(e)
+                    return
+                print(f"⚠️ Service de comptes injoignable, nouvel essai dans {delay:.1f}s: {e!r}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, LEDGER_RECONNECT_DELAYS[1])
+                continue
+            delay = LEDGER_RECONNECT_DELAYS[0]
+            self.writer = writer
+            if not connected.done():
+                connected.set_result(None)
+            while self.backlog:
+                self.send(self.backlog.popleft(), None)
+            try:
+                while line := await reader.readline():
+                    self.receive(json.loads(line))
+                print("⚠️ Service de comptes: connexion fermée")
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Service de comptes: connexion perdue: {e!r}")
+            self.writer = None
+            writer.close()
+            # Réponses perdues: une écriture a pu être appliquée ou non, l'appelant annule
+            waiting, self.waiting = self.waiting, {}
+            for future in waiting.values():
+                if future is not None and not future.done():
+                    future.set_exception(LedgerError('connexion au service de comptes perdue'))
+    
+    def send(self, request, future):
+        """Envoie une requête (thread du client)"""
+        if self.writer is None:
+            if future is None:
+                self.backlog.append(request)
+            elif not future.done():
+                future.set_exception(LedgerError('service de comptes injoignable'))
+            return
+        request_id = next(self.ids)
+        self.waiting[request_id] = future
+        self.writer.write(json.dumps([request_id, *request], separators=(',', ':')).encode() + b'\n')
+    
+    def receive(self, response):
+        """Remet une réponse à la requête de même numéro (thread du client)"""
+        future = self.waiting.pop(response['id'], None)
+        if future is None:
+            if 'error' in response:
+                # Statistiques refusées par le service: son appelant est déjà reparti
+                print(f"⚠️ Service de comptes: {response['error']}")
+        elif future.done():
+            pass  # Délai dépassé: l'appelant est déjà reparti avec LedgerError
+        elif 'error' in response:
+            future.set_exception(LedgerError(response['error']))
+        else:
+            future.set_result(response['ok'])
+    
+    def close(self):
+        """Attend les réponses des statistiques envoyées, puis arrête le thread"""
+        async def stop():
+            self.closing = True
+            deadline = self.loop.time() + LEDGER_TIMEOUT
+            while self.waiting and self.writer is not None and self.loop.time() < deadline:
+                await asyncio.sleep(0.01)
+            if self.backlog:
+                print(f"⚠️ Service de comptes: {len(self.backlog)} statistiques non envoyées")
+            self.task.cancel()
+            if self.writer is not None:
+                self.writer.close()
+        try:
+            asyncio.run_coroutine_threadsafe(stop(), self.loop).result()
+        finally:
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+            self.loop.close()
+    
+    def call(self, op, *args):
+        """Envoie une requête et attend sa réponse"""
+        started = time.perf_counter()
+        future = concurrent.futures.Future()
+        self.loop.call_soon_threadsafe(self.send, [op, *args], future)
+        try:
+            result = future.result(LEDGER_TIMEOUT)
+        except concurrent.futures.TimeoutError:
+            raise LedgerError(f'{op}: pas de réponse du service de comptes en {LEDGER_TIMEOUT}s') from None
+        finally:
+            metrics.observe('cazgino_ledger_seconds', time.perf_counter() - started, op=op)
+        return result
+    
+    def write(self, op, *args):
+        """Envoie une écriture sans attendre sa réponse (statistiques seulement)"""
+        self.loop.call_soon_threadsafe(self.send, [op, *args], None)
+    
+    def apply(self, balance_deltas, game_deltas):
+        # Attend la confirmation: un échec doit remonter jusqu'à l'appelant
+        self.call('apply', balance_deltas, game_deltas)
+    
+    def get_balance(self, user_id):
+        return self.call('get_balance', int(user_id))
+    
+    def set_balance(self, user_id, amount):
+        self.call('set_balance', int(user_id), amount)
+    
+    def debit(self, user_id, amount):
+        debited, balance = self.call('debit', int(user_id), amount)
+        return debited, balance
+    
+    def get_games_played(self, user_id):
+        return self.call('get_games_played', int(user_id))
+    
+    def count_accounts(self):
+        return self.call('count_accounts')
+    
+    def get_leaderboard(self, limit=None, offset=0):
+        return [tuple(row) for row in self.call('get_leaderboard', limit, offset)]
+    
+    def count_ranked(self):
+        return self.call('count_ranked')
+    
+    def get_rank(self, user_id):
+        return self.call('get_rank', int(user_id))
     
-    def get_leaderboard(self):
-        """Retourne le classement des joueurs ayant joué au moins une partie"""
-        eligible_players = {k: v for k, v in self.data.items() if self.has_played(k)}
-        return sorted(eligible_players.items(), key=lambda x: x[1], reverse=True)
+    def record_game(self, guild_id, outcomes):
+        self.write('record_game', int(guild_id), outcomes)
+    
+    def record_job(self, guild_id, user_id, recipe_key, completed):
+        self.write('record_job', int(guild_id), int(user_id), recipe_key, completed)
+    
+    def get_player_stats(self, user_id):
+        return self.call('get_player_stats', int(user_id))
+    
+    def get_guild_stats(self, guild_id):
+        return self.call('get_guild_stats', int(guild_id))
 
-db = Database()
+db = LedgerClient() if LEDGER_SOCKET else Database()
+
+class UserResolver:
+    """Retrouve les pseudos: cache de discord.py, puis cache TTL borné, puis requêtes REST en parallèle"""
+    def __init__(self, bot, size=USERNAME_CACHE_SIZE, ttl=USERNAME_CACHE_TTL, concurrency=USERNAME_FETCH_CONCURRENCY):
+        self.bot = bot
+        self.size = size
+        self.ttl = ttl
+        self.cache = OrderedDict()  # {user_id: (pseudo, date d'expiration)}, ordre LRU
+        self.semaphore = asyncio.Semaphore(concurrency)
+    
+    def cached(self, user_id, guild=None):
+        user = self.bot.get_user(user_id)
+        if user is None and guild is not None:
+            user = guild.get_member(user_id)
+        if user is not None:
+            return user.name
+        entry = self.cache.get(user_id)
+        if entry is not None:
+            if entry[1] > time.monotonic():
+                self.cache.move_to_end(user_id)
+                return entry[0]
+            del self.cache[user_id]
+        return None
+    
+    def remember(self, user_id, name):
+        self.cache[user_id] = (name, time.monotonic() + self.ttl)
+        self.cache.move_to_end(user_id)
+        while len(self.cache) > self.size:
+            self.cache.popitem(last=False)
+    
+    async def fetch(self, user_id):
+        async with self.semaphore:
+            try:
+                user = await self.bot.fetch_user(user_id)
+                name = user.name
+            except discord.HTTPException:
+                name = f"Joueur {user_id}"
+        self.remember(user_id, name)
+        return name
+    
+    async def resolve_many(self, user_ids, guild=None):
+        """Retourne {user_id: pseudo}; les requêtes REST nécessaires partent toutes en même temps"""
+        names = {}
+        missing = []
+        for user_id in user_ids:
+            user_id = int(user_id)
+            name = self.cached(user_id, guild)
+            if name is None:
+                missing.append(user_id)
+            else:
+                names[user_id] = name
+        if missing:
+            fetched = await asyncio.gather(*(self.fetch(user_id) for user_id in missing))
+            names.update(zip(missing, fetched))
+        return names
+
+usernames = UserResolver(bot)
+
+class Timer:
+    """Échéance programmée dans le Scheduler"""
+    def __init__(self, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        # Comme loop.call_later: le callback s'exécute dans le contexte de l'appelant
+        self.context = contextvars.copy_context()
+    
+    def cancel(self):
+        self.cancelled = True
+
+class Scheduler:
+    """Échéancier partagé: un tas d'échéances sur l'horloge monotone.
+    
+    Une seule tâche dort jusqu'à la prochaine échéance, quel que soit le nombre
+    de tables ou de jobs. Un callback peut renvoyer une coroutine, qui est alors
+    lancée dans sa propre tâche."""
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.heap = []  # [(date, numéro d'ordre, Timer)]
+        self.counter = itertools.count()
+        self.task = None
+        self.wakeup = None
+        self.running = set()  # Tâches lancées par les callbacks, gardées en vie
+        self.autorun = True  # False: l'appelant pilote lui-même run_due() (replay.py)
+    
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self.clock() + delay, callback, *args)
+    
+    def call_at(self, deadline, callback, *args):
+        timer = Timer(deadline, callback, args)
+        first = not self.heap or deadline < self.heap[0][0]
+        heapq.heappush(self.heap, (deadline, next(self.counter), timer))
+        self.ensure_running(first)
+        return timer
+    
+    def ensure_running(self, reschedule):
+        try:
+            asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Pas de boucle: l'appelant pilote lui-même run_due()
+        if not self.autorun:
+            return
+        if self.task is None or self.task.done():
+            self.wakeup = asyncio.Event()
+            self.task = asyncio.create_task(self.run())
+        elif reschedule:
+            # La nouvelle échéance passe avant celle que la tâche attend
+            self.wakeup.set()
+    
+    def next_deadline(self):
+        while self.heap and self.heap[0][2].cancelled:
+            heapq.heappop(self.heap)
+        return self.heap[0][0] if self.heap else None
+    
+    def run_due(self, now=None):
+        """Déclenche toutes les échéances passées; renvoie le nombre déclenché"""
+        now = self.clock() if now is None else now
+        fired = 0
+        while self.heap and self.heap[0][0] <= now:
+            _, _, timer = heapq.heappop(self.heap)
+            if timer.cancelled:
+                continue
+            timer.cancelled = True  # Une échéance ne se déclenche qu'une fois
+            fired += 1
+            try:
+                result = timer.context.run(timer.callback, *timer.args)
+            except Exception:
+                traceback.print_exc()
+                continue
+            if asyncio.iscoroutine(result):
+                self.spawn(result, timer.context)
+        return fired
+    
+    def spawn(self, coro, context=None):
+        """Lance une coroutine dans une tâche suivie (erreurs affichées, pas de ramasse-miettes)"""
+        task = asyncio.get_running_loop().create_task(coro, context=context)
+        self.running.add(task)
+        task.add_done_callback(self.task_done)
+        return task
+    
+    def task_done(self, task):
+        self.running.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            traceback.print_exception(task.exception())
+    
+    async def run(self):
+        while True:
+            deadline = self.next_deadline()
+            self.wakeup.clear()
+            if deadline is None:
+                await self.wakeup.wait()
+                continue
+            delay = deadline - self.clock()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            self.run_due()
+
+scheduler = Scheduler()
 
 # Configuration de la roulette
 ROULETTE_NUMBERS = {
@@ -87,12 +2419,245 @@ ROULETTE_NUMBERS = {
     'noir': [2, 4, 6, 8, 10, 11, 13, 15, 17, 20, 22, 24, 26, 28, 29, 31, 33, 35],
     'vert': [0]
 }
+# Couleur de chaque case, indexée par numéro
+POCKET_COLORS = tuple(
+    'rouge' if n in ROULETTE_NUMBERS['rouge'] else 'noir' if n in ROULETTE_NUMBERS['noir'] else 'vert'
+    for n in range(37)
+)
+MAX_BETS_PER_SLIP = 10
+
+def mask_of(numbers):
+    """Masque de 37 bits: le bit n est à 1 si la mise couvre le numéro n"""
+    mask = 0
+    for n in numbers:
+        mask |= 1 << n
+    return mask
+
+# Mises simples et mises sur un groupe fixe de numéros
+NAMED_BETS = {
+    'rouge': mask_of(ROULETTE_NUMBERS['rouge']),
+    'noir': mask_of(ROULETTE_NUMBERS['noir']),
+    'pair': mask_of(range(2, 37, 2)),
+    'impair': mask_of(range(1, 37, 2)),
+    '1-18': mask_of(range(1, 19)),
+    '19-36': mask_of(range(19, 37)),
+    # Douzaines
+    '1-12': mask_of(range(1, 13)),
+    '13-24': mask_of(range(13, 25)),
+    '25-36': mask_of(range(25, 37)),
+    'd1': mask_of(range(1, 13)),
+    'd2': mask_of(range(13, 25)),
+    'd3': mask_of(range(25, 37)),
+    # Colonnes
+    'c1': mask_of(range(1, 37, 3)),
+    'c2': mask_of(range(2, 37, 3)),
+    'c3': mask_of(range(3, 37, 3)),
+}
+# Transversales: t1 = 1/2/3, t4 = 4/5/6, ... t34 = 34/35/36
+NAMED_BETS.update({f't{n}': mask_of(range(n, n + 3)) for n in range(1, 35, 3)})
+
+def is_valid_group(numbers):
+    """Vérifie qu'un groupe `a/b/...` est un cheval, une transversale ou un carré du tapis"""
+    numbers = sorted(numbers)
+    if len(set(numbers)) != len(numbers) or numbers[-1] > 36:
+        return False
+    if numbers[0] == 0:
+        # Le zéro touche 1, 2 et 3: 0/1, 0/1/2, 0/2/3, 0/1/2/3...
+        return set(numbers[1:]) <= {1, 2, 3} and (len(numbers) != 3 or numbers[1] + 1 == numbers[2])
+    low = numbers[0]
+    if len(numbers) == 2:
+        high = numbers[1]
+        return high - low == 3 or (high - low == 1 and low % 3 != 0)
+    if len(numbers) == 3:
+        return low % 3 == 1 and numbers == [low, low + 1, low + 2]
+    if len(numbers) == 4:
+        return low % 3 != 0 and numbers == [low, low + 1, low + 3, low + 4]
+    return False
+
+# Types de mise, par gain: nom dans les statistiques et libellé affiché
+BET_KINDS = {
+    36: ('plein', 'Numéro plein'),
+    18: ('cheval', 'Cheval'),
+    12: ('transversale', 'Transversale'),
+    9: ('carre', 'Carré'),
+    3: ('douzaine', 'Douzaine/colonne'),
+    2: ('simple', 'Chance simple'),
+}
+
+class Bet:
+    """Mise compilée: masque des numéros couverts et multiplicateur du gain (mise comprise)"""
+    def __init__(self, choice, mask):
+        self.choice = choice
+        self.mask = mask
+        # Table européenne: le gain total vaut 36 / nombre de numéros couverts
+        self.payout = 36 // bin(mask).count('1')
+        self.kind = BET_KINDS[self.payout][0]
+    
+    def wins(self, number):
+        return self.mask >> number & 1 == 1
+
+@functools.lru_cache(maxsize=1024)
+def compile_bet(choice):
+    """Compile un choix (`rouge`, `17`, `c2`, `8/11`...) en Bet, ou None s'il est invalide"""
+    choice = choice.lower()
+    if choice in NAMED_BETS:
+        return Bet(choice, NAMED_BETS[choice])
+    parts = choice.split('/')
+    # isdigit() accepte aussi les chiffres Unicode ('²', '٣'...) que int() refuse ou lit autrement
+    if not all(part.isascii() and part.isdigit() for part in parts):
+        return None
+    numbers = [int(part) for part in parts]
+    if len(numbers) == 1:
+        if numbers[0] > 36:
+            return None
+    elif not is_valid_group(numbers):
+        return None
+    return Bet(choice, mask_of(numbers))
+
+class Slip:
+    """Bulletin d'un joueur: ses mises et le gain qu'il touche pour chacun des 37 numéros"""
+    def __init__(self, bets):
+        self.bets = bets  # [(Bet, montant), ...]
+        self.stake = sum(amount for _, amount in bets)
+        self.payouts = tuple(
+            sum(amount * bet.payout for bet, amount in bets if bet.wins(number))
+            for number in range(37)
+        )
+    
+    def describe(self):
+        return ", ".join(f"`{bet.choice}` ({amount}€)" for bet, amount in self.bets)
+
+# Durée des phases de la roulette (en secondes)
+JOIN_SECONDS = 30
+BET_SECONDS = 30
+COUNTDOWN_STEP = 10
+TABLE_PLAYERS_SHOWN = 15  # Joueurs et bulletins listés sur le message de la table
+
+# Animation du tirage: le résultat final tombe toujours ANIMATION_SECONDS après le lancement
+ANIMATION_SECONDS = 5.0
+ANIMATION_MAX_FRAMES = 15
+ANIMATION_RESERVED = 2  # Requêtes gardées pour le résultat final et l'annonce des gains
+RESULT_DELAY = 1.0
+
+# Limites de débit Discord estimées: (requêtes, période en secondes)
+CHANNEL_RATE_LIMIT = (5, 5.0)
+GLOBAL_RATE_LIMIT = (50, 1.0)
+
+# File des messages sortants de chaque salon (voir Outbox)
+PRIORITY_GAME = 0  # Phases et résultats: partent tout de suite
+PRIORITY_INFO = 1  # Comptes à rebours, erreurs: attendent un jeton libre
+PRIORITY_NAMES = ('game', 'info')
+OUTBOX_INFO_MAX_AGE = 10.0  # Un message informatif qui a attendu plus longtemps est abandonné
+
+class EventLog:
+    """Journal compact de ce qui fait avancer le jeu, pour le rejouer avec replay.py
+    
+    Une ligne JSON par événement, `t` en microsecondes depuis l'ouverture sur
+    l'horloge de l'échéancier: commandes (`c`), réactions aux jobs (`r`), boutons
+    Rejoindre (`j`) et formulaires de mise (`m`), graines (`s`), modifications des
+    comptes avec leurs nouvelles valeurs (`l`) et échéances des tables et des
+    jobs (`k`), notées quand leur code commence à s'exécuter.
+    Avec le service de comptes, c'est lui qui note les modifications des comptes.
+    Le jeu ne tire rien au hasard en dehors des générateurs de ses tables et de
+    ses jobs, créés à partir des graines notées ici.
+    
+    En rejeu, `seeds` fournit les graines enregistrées de chaque salon et de chaque
+    joueur (une divergence ne décale pas celles des autres), et les échéances sont
+    déclenchées à leur place dans le journal plutôt qu'à leur date: une commande
+    ou une réaction arrivée juste avant ou juste après la fin d'une phase ou d'un
+    job est rejouée du même côté."""
+    def __init__(self, filename=''):
+        self.file = None
+        self.started = scheduler.clock()
+        self.seeds = None  # En rejeu: {(type, id): deque des graines enregistrées}
+        self.pending = {}  # En rejeu: {clé: Timer} des échéances en attente de leur `k`
+        if filename:
+            self.file = open(filename, 'a', buffering=1, encoding='utf-8')
+            self.record('start', v=1, wall=round(time.time(), 3), cfg={
+                'join': JOIN_SECONDS, 'bet': BET_SECONDS, 'step': COUNTDOWN_STEP,
+                'animation': ANIMATION_SECONDS, 'result': RESULT_DELAY,
+                'limits': {key: recipe['time_limit'] for key, recipe in RECIPES.items()},
+            })
+    
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+    
+    def record(self, event, **fields):
+        if self.file is None:
+            return
+        fields['e'] = event
+        fields['t'] = int((scheduler.clock() - self.started) * 1e6)
+        self.file.write(json.dumps(fields, separators=(',', ':'), ensure_ascii=False) + '\n')
+    
+    def seed(self, kind, owner):
+        """Graine du générateur d'une table (`owner`: son salon) ou d'un job (son joueur)"""
+        if self.seeds is not None:
+            seeds = self.seeds.get((kind, owner))
+            return seeds.popleft() if seeds else 0
+        seed = random.getrandbits(48)
+        self.record('s', k=kind, id=owner, s=seed)
+        return seed
+    
+    def command(self, ctx):
+        """Note une commande, préfixée ou slash, sous sa forme texte `!commande arguments`"""
+        if self.file is None:
+            return
+        # ctx.args commence par ctx lui-même
+        args = [value for value in itertools.chain(ctx.args[1:], ctx.kwargs.values()) if value is not None]
+        text = ' '.join(['!' + ctx.command.qualified_name] + [
+            f'<@{value.id}>' if isinstance(value, discord.abc.User) else str(value) for value in args
+        ])
+        admin = ctx.guild is not None and ctx.author.guild_permissions.administrator
+        self.record('c', ch=ctx.channel.id, u=ctx.author.id, a=int(admin), x=text)
+    
+    def ledger(self, balance_deltas, balances, game_deltas, games, created):
+        """Note une modification des comptes: {id: [écart, nouvelle valeur]}"""
+        if self.file is None:
+            return
+        fields = {}
+        if balances:
+            fields['b'] = {user_id: [balance_deltas[user_id], value] for user_id, value in balances.items()}
+        if games:
+            fields['p'] = {user_id: [game_deltas[user_id], value] for user_id, value in games.items()}
+        if created:
+            fields['n'] = created
+        self.record('l', **fields)
+    
+    def call_at(self, key, deadline, callback):
+        """Échéance d'une table (`key`: [graine, numéro]) ou d'un job ([graine]), notée quand elle s'exécute"""
+        if self.seeds is not None:
+            timer = self.pending[tuple(key)] = Timer(deadline, callback, ())
+            return timer
+        return scheduler.call_at(deadline, self.fire, key, callback)
+    
+    def fire(self, key, callback):
+        result = callback()
+        if asyncio.iscoroutine(result):
+            # Une coroutine ne démarre qu'au tour suivant de la boucle, peut-être après
+            # d'autres événements: la note est prise à son démarrage
+            return self.run_fired(key, result)
+        self.record('k', k=key)
+        return result
+    
+    async def run_fired(self, key, coro):
+        self.record('k', k=key)
+        return await coro
+
+# Tables de roulette en cours: {channel_id: RouletteGame}
+tables = {}
 
-# Partie de roulette en cours
-active_roulette = None
+# Délai de regroupement des éditions de la commande d'intérim (en secondes)
+INTERIM_EDIT_DEBOUNCE = 0.5
 
-# Jobs d'intérim en cours
+# Jobs d'intérim en cours: {user_id: InterimJob}, et le même index par message
 active_jobs = {}
+jobs_by_message = {}
+
+metrics.gauge('cazgino_roulette_tables', lambda: len(tables), 'Tables de roulette en cours')
+metrics.gauge('cazgino_interim_jobs', lambda: len(active_jobs), "Jobs d'intérim en cours")
+metrics.gauge('cazgino_scheduler_timers', lambda: len(scheduler.heap), "Échéances en attente dans l'échéancier")
 
 # Recettes possibles pour l'intérim
 RECIPES = {
@@ -133,17 +2698,97 @@ RECIPES = {
     }
 }
 
+# Journal des événements (l'en-tête reprend les durées des phases et des recettes)
+events = EventLog(EVENT_LOG_FILE)
+
+class InterimTemplate:
+    """Embed « en cours » d'une recette, construit une fois; seules la progression et les erreurs changent"""
+    def __init__(self, recipe):
+        self.base = discord.Embed(
+            title="💼 INTÉRIM - En cours...",
+            description=f"**Prépare:** {recipe['name']}",
+            color=discord.Color.orange()
+        )
+        steps = recipe['steps']
+        # Barre de progression et consigne pour chaque étape
+        self.progress = [("✅ " * i + "⬜ " * (len(steps) - i), f"Clique sur **{steps[i]}**") for i in range(len(steps))]
+    
+    def render(self, job):
+        embed = self.base.copy()
+        progress, instruction = self.progress[job.current_step]
+        embed.add_field(name="📊 Progression", value=progress, inline=False)
+        embed.add_field(name="➡️ Prochaine étape", value=instruction, inline=False)
+        if job.mistakes:
+            embed.add_field(
+                name="❌ Mauvais ingrédient",
+                value=f"{job.last_mistake} n'est pas le bon ! ({job.mistakes} erreur{'s' if job.mistakes > 1 else ''})",
+                inline=False
+            )
+        return embed
+
+INTERIM_TEMPLATES = {key: InterimTemplate(recipe) for key, recipe in RECIPES.items()}
+
+class MessageDebouncer:
+    """Regroupe les changements rapides d'un message en une seule édition montrant le dernier état.
+    
+    Il n'y a jamais plus d'une édition en cours par message, donc elles ne peuvent
+    pas arriver dans le désordre."""
+    def __init__(self, message, render, delay=None):
+        self.message = message
+        self.render = render  # Renvoie les arguments de message.edit pour l'état actuel
+        self.delay = INTERIM_EDIT_DEBOUNCE if delay is None else delay
+        self.timer = None
+        self.in_flight = False
+        self.pending = False
+    
+    def touch(self):
+        """Signale un changement d'état; l'édition partira au plus tard après `delay`"""
+        self.pending = True
+        if self.timer is None and not self.in_flight:
+            self.timer = scheduler.call_later(self.delay, self.flush)
+    
+    def cancel(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.pending = False
+    
+    async def flush(self):
+        self.timer = None
+        if not self.pending:
+            return
+        self.pending = False
+        self.in_flight = True
+        try:
+            await self.message.edit(**self.render())
+        finally:
+            self.in_flight = False
+            # Des changements sont arrivés pendant l'édition
+            if self.pending:
+                self.timer = scheduler.call_later(self.delay, self.flush)
+
 class InterimJob:
-    def __init__(self, user_id, recipe_key):
+    def __init__(self, user_id, recipe_key, rng):
         self.user_id = user_id
+        self.rng = rng  # Générateur du job: ordre des réactions proposées
+        self.recipe_key = recipe_key
         self.recipe = RECIPES[recipe_key]
         self.current_step = 0
-        self.start_time = datetime.now()
+        self.mistakes = 0
+        self.last_mistake = None
+        self.updates = None  # MessageDebouncer du message de la commande
+        self.start_time = scheduler.clock()
         self.message = None
+        self.channel = None
         self.completed = False
+        self.seed = None  # Graine de `rng`, qui identifie aussi l'échéance du job dans le journal
+        self.timer = None  # Échéance de fin du temps imparti dans le Scheduler
     
     def is_expired(self):
-        return (datetime.now() - self.start_time).seconds > self.recipe['time_limit']
+        if events.seeds is not None:
+            # En rejeu, seule l'échéance notée dans le journal met fin au job
+            return False
+        return scheduler.clock() - self.start_time > self.recipe['time_limit']
     
     def get_current_emoji(self):
         if self.current_step < len(self.recipe['steps']):
@@ -153,325 +2798,783 @@ class InterimJob:
     def next_step(self):
         self.current_step += 1
         return self.current_step >= len(self.recipe['steps'])
+    
+    def render_progress(self):
+        return {'embed': INTERIM_TEMPLATES[self.recipe_key].render(self)}
+
+def finish_job(job):
+    """Retire le job des jobs actifs et annule son échéance"""
+    if active_jobs.get(job.user_id) is job:
+        del active_jobs[job.user_id]
+    if job.message is not None and jobs_by_message.get(job.message.id) is job:
+        del jobs_by_message[job.message.id]
+    if job.timer is not None:
+        job.timer.cancel()
+    if job.updates is not None:
+        job.updates.cancel()
+
+async def expire_job(job):
+    """Appelé une seule fois par l'échéancier quand le temps imparti est écoulé"""
+    if active_jobs.get(job.user_id) is not job or job.completed:
+        return
+    finish_job(job)
+    db.record_job(guild_key(job.channel), job.user_id, job.recipe_key, False)
+    await job.channel.send(f"⏰ <@{job.user_id}> Temps écoulé ! Tu n'as pas terminé la commande à temps.")
+
+class RateBudget:
+    """Seau à jetons estimant les requêtes encore disponibles sur une limite de débit Discord"""
+    def __init__(self, capacity, period, parent=None, clock=time.monotonic):
+        self.capacity = capacity
+        self.rate = capacity / period
+        self.parent = parent  # Limite globale partagée par tous les salons
+        self.clock = clock
+        self.tokens = capacity
+        self.updated = clock()
+    
+    def refill(self):
+        now = self.clock()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+    
+    def available(self, within=0.0):
+        """Requêtes utilisables maintenant et pendant les `within` prochaines secondes"""
+        self.refill()
+        available = self.tokens + within * self.rate
+        if self.parent is not None:
+            available = min(available, self.parent.available(within))
+        return available
+    
+    def try_acquire(self):
+        """Prend un jeton s'il en reste (ici et dans la limite globale)"""
+        self.refill()
+        # Tolère les erreurs d'arrondi: sinon un jeton à 1e-15 près se fait attendre
+        # un délai plus court que la résolution de l'horloge (boucle en temps virtuel)
+        if self.tokens < 1 - 1e-9:
+            return False
+        if self.parent is not None and not self.parent.try_acquire():
+            return False
+        self.tokens -= 1
+        return True
+    
+    def acquire_now(self):
+        """Prend un jeton même à découvert: réservé aux messages qui doivent partir"""
+        self.refill()
+        self.tokens -= 1
+        if self.parent is not None:
+            self.parent.acquire_now()
+    
+    def delay(self):
+        """Secondes avant qu'un jeton soit disponible (ici et dans la limite globale)"""
+        self.refill()
+        delay = max(0.0, (1 - self.tokens) / self.rate)
+        if self.parent is not None:
+            delay = max(delay, self.parent.delay())
+        return delay
+    
+    def full_delay(self):
+        """Secondes avant que le seau soit plein: un budget neuf le remplacerait alors sans rien changer"""
+        self.refill()
+        return max(0.0, (self.capacity - self.tokens) / self.rate)
+
+global_budget = RateBudget(*GLOBAL_RATE_LIMIT)
+channel_budgets = {}
+
+def channel_budget(channel_id):
+    budget = channel_budgets.get(channel_id)
+    if budget is None:
+        budget = channel_budgets[channel_id] = RateBudget(*CHANNEL_RATE_LIMIT, parent=global_budget, clock=global_budget.clock)
+    return budget
+
+class Outgoing:
+    """Message en attente dans la file d'un salon"""
+    __slots__ = ('priority', 'created', 'key', 'action', 'future')
+    
+    def __init__(self, priority, key, action, future):
+        self.priority = priority
+        self.created = scheduler.clock()
+        self.key = key
+        self.action = action  # Renvoie la coroutine d'envoi; None si abandonné
+        self.future = future
+
+class Outbox:
+    """File des messages sortants d'un salon, vidée au rythme de son budget.
+    
+    Les messages de jeu partent aussitôt, même à découvert, et ne restent
+    jamais derrière les messages informatifs: ceux-ci attendent un jeton libre,
+    partent un par un et sont abandonnés après OUTBOX_INFO_MAX_AGE secondes.
+    Une édition avec une clé remplace celle encore en attente avec la même clé,
+    et son contenu n'est calculé qu'au départ: seul le dernier état est envoyé.
+    
+    Une file vide, sans envoi en cours ni table dans son salon, est retirée du
+    registre avec son budget dès que celui-ci est plein: un salon inactif ne
+    garde rien en mémoire, et la file recréée au besoin repart du même état."""
+    def __init__(self, channel):
+        self.channel = channel
+        self.budget = channel_budget(channel.id)
+        self.queue = []  # Tas [(priorité, numéro d'ordre, Outgoing)]
+        self.keyed = {}  # {clé: Outgoing en attente}
+        self.counter = itertools.count()
+        self.timer = None
+        self.in_flight = 0
+        self.held_until = 0.0
+    
+    def send(self, content=None, *, priority=PRIORITY_INFO, **kwargs):
+        """Envoie un message; renvoie un futur du message envoyé (None s'il est abandonné)"""
+        return self.push(priority, None, lambda: self.channel.send(content, **kwargs))
+    
+    def edit(self, message, render, *, key, priority=PRIORITY_INFO):
+        """Édite `message` avec les arguments renvoyés par render(), appelé au moment de l'envoi"""
+        return self.push(priority, key, lambda: message.edit(**render()))
+    
+    def push(self, priority, key, action):
+        if key is not None:
+            stale = self.keyed.get(key)
+            if stale is not None:
+                # Remplacée avant d'être partie: garde la priorité la plus haute des deux
+                priority = min(priority, stale.priority)
+                self.drop(stale)
+                metrics.inc('cazgino_outbox_messages_total', priority=PRIORITY_NAMES[stale.priority], outcome='superseded')
+        item = Outgoing(priority, key, action, asyncio.get_running_loop().create_future())
+        if key is not None:
+            self.keyed[key] = item
+        heapq.heappush(self.queue, (priority, next(self.counter), item))
+        self.pump()
+        return item.future
+    
+    def drop(self, item):
+        item.action = None
+        if item.key is not None and self.keyed.get(item.key) is item:
+            del self.keyed[item.key]
+        if not item.future.done():
+            item.future.set_result(None)
+    
+    def cancel(self, key):
+        """Abandonne l'édition en attente avec cette clé"""
+        item = self.keyed.get(key)
+        if item is not None:
+            self.drop(item)
+    
+    def hold_info(self, seconds):
+        """Retient les messages informatifs, par exemple pour laisser le budget à l'animation"""
+        self.held_until = max(self.held_until, scheduler.clock() + seconds)
+    
+    def pump(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        now = scheduler.clock()
+        while self.queue:
+            priority, _, item = self.queue[0]
+            if item.action is None:
+                heapq.heappop(self.queue)
+                continue
+            if priority == PRIORITY_INFO:
+                if now - item.created > OUTBOX_INFO_MAX_AGE:
+                    heapq.heappop(self.queue)
+                    self.drop(item)
+                    metrics.inc('cazgino_outbox_messages_total', priority='info', outcome='expired')
+                    continue
+                if self.in_flight:
+                    return  # Relancé à la fin de l'envoi en cours
+                if now < self.held_until:
+                    self.timer = scheduler.call_at(self.held_until, self.pump)
+                    return
+                if not self.budget.try_acquire():
+                    self.timer = scheduler.call_later(self.budget.delay(), self.pump)
+                    return
+            else:
+                self.budget.acquire_now()
+            heapq.heappop(self.queue)
+            action = item.action
+            if item.key is not None and self.keyed.get(item.key) is item:
+                del self.keyed[item.key]
+            self.in_flight += 1
+            metrics.inc('cazgino_outbox_messages_total', priority=PRIORITY_NAMES[priority], outcome='sent')
+            scheduler.spawn(self.deliver(item, action))
+        self.release()
+    
+    def release(self):
+        """Retire la file vide du registre, ou attend que son budget et sa retenue soient épuisés"""
+        channel_id = self.channel.id
+        if self.in_flight or channel_id in tables:
+            return  # Relancé à la fin de l'envoi ou par la fermeture de la table
+        delay = max(self.budget.full_delay(), self.held_until - scheduler.clock())
+        if delay > 0:
+            self.timer = scheduler.call_later(delay, self.pump)
+            return
+        if outboxes.get(channel_id) is self:
+            del outboxes[channel_id]
+        if channel_budgets.get(channel_id) is self.budget:
+            del channel_budgets[channel_id]
+    
+    async def deliver(self, item, action):
+        try:
+            result = await action()
+        except Exception as e:
+            if item.priority == PRIORITY_INFO:
+                # Personne n'attend un message informatif
+                traceback.print_exc()
+                item.future.set_result(None)
+            else:
+                item.future.set_exception(e)
+        else:
+            item.future.set_result(result)
+        finally:
+            self.in_flight -= 1
+            self.pump()
+
+outboxes = {}
+
+def guild_key(channel):
+    """Serveur d'un salon pour les statistiques (0 pour les messages privés)"""
+    guild = getattr(channel, 'guild', None)
+    return 0 if guild is None else guild.id
+
+def channel_outbox(channel):
+    outbox = outboxes.get(channel.id)
+    if outbox is None:
+        outbox = outboxes[channel.id] = Outbox(channel)
+    return outbox
+
+def color_emoji(number):
+    color = POCKET_COLORS[number]
+    return "🔴" if color == "rouge" else "⚫" if color == "noir" else "🟢"
+
+class SpinAnimation:
+    """Animation du tirage: images précalculées, cadence adaptée au budget du salon.
+    
+    Une image qui ne peut pas partir à l'heure (budget épuisé ou édition précédente
+    encore en cours) est abandonnée au lieu d'être mise en file d'attente, et le
+    résultat final part toujours ANIMATION_SECONDS après le lancement."""
+    def __init__(self, message, result, budget, rng):
+        self.message = message
+        self.budget = budget
+        # Garde de quoi publier le résultat final et les gains
+        affordable = int(budget.available(ANIMATION_SECONDS)) - ANIMATION_RESERVED
+        count = max(0, min(ANIMATION_MAX_FRAMES, affordable))
+        self.frames = [self.spin_frame(rng.randint(0, 36)) for _ in range(count)]
+        self.final = self.result_frame(result)
+        # Intervalles croissants (la roue ralentit), ramenés à la durée de l'animation
+        weights = [3 + i for i in range(count + 1)]
+        self.offsets = list(itertools.accumulate(w * ANIMATION_SECONDS / sum(weights) for w in weights))[:-1]
+        self.in_flight = None
+        self.shown = 0
+        self.dropped = 0
+    
+    @staticmethod
+    def spin_frame(number):
+        emoji = color_emoji(number)
+        return f"""
+🎰 **LA ROULETTE TOURNE...**
+
+{emoji} **{number}** {emoji}
+
+{'▬' * 20}
+        """
+    
+    @staticmethod
+    def result_frame(result):
+        color = POCKET_COLORS[result]
+        emoji = color_emoji(result)
+        return f"""
+🎰 **RÉSULTAT DE LA ROULETTE**
+
+{'=' * 20}
+{emoji} **{result}** {emoji}
+({color.upper()})
+{'=' * 20}
+
+Calcul des gains...
+        """
+    
+    def start(self, on_done):
+        """Programme les images; on_done est appelé une fois le résultat final affiché"""
+        start = scheduler.clock()
+        for offset, frame in zip(self.offsets, self.frames):
+            scheduler.call_at(start + offset, self.show, frame)
+        scheduler.call_at(start + ANIMATION_SECONDS, self.show_final, on_done)
+    
+    def show(self, frame):
+        if (self.in_flight is not None and not self.in_flight.done()) or not self.budget.try_acquire():
+            self.dropped += 1
+            return
+        self.shown += 1
+        self.in_flight = scheduler.spawn(self.message.edit(content=frame))
+    
+    async def show_final(self, on_done):
+        self.budget.acquire_now()
+        try:
+            await self.message.edit(content=self.final)
+        finally:
+            on_done()
 
 class RouletteGame:
+    """Table de roulette d'un salon: avance de phase en phase via l'échéancier partagé"""
     def __init__(self, ctx):
         self.ctx = ctx
-        self.players = {}  # {user_id: {'bet': amount, 'choice': choice}}
-        self.phase = 'joining'  # 'joining', 'betting', 'finished'
+        self.channel = ctx.channel
+        self.players = {}  # {user_id: Slip ou None tant qu'il n'a pas misé}
+        self.phase = 'joining'  # 'joining', 'betting', 'spinning', 'finished'
         self.result = None
-        self.message = None
+        self.message = None  # Message de la table, mis à jour à chaque échéance
+        self.view = None
+        self.remaining = 0  # Secondes restantes dans la phase en cours
+        self.timer = None
+        # Tirage et animation viennent du générateur de la table (rejouable, voir EventLog)
+        self.seed = events.seed('table', self.channel.id)
+        self.rng = random.Random(self.seed)
+        self.timers = 0  # Échéances programmées, numérotées pour le journal
+    
+    @property
+    def outbox(self):
+        # Relue à chaque envoi: la file d'un salon sans table peut avoir été retirée
+        return channel_outbox(self.channel)
     
     def add_player(self, user_id):
         if user_id not in self.players:
-            self.players[user_id] = {'bet': None, 'choice': None}
+            self.players[user_id] = None
             return True
         return False
     
-    def set_bet(self, user_id, choice, amount):
+    def set_bet(self, user_id, slip):
         if user_id in self.players:
-            self.players[user_id]['bet'] = amount
-            self.players[user_id]['choice'] = choice
+            self.players[user_id] = slip
             return True
         return False
     
     def spin(self):
-        self.result = random.randint(0, 36)
+        self.result = self.rng.randint(0, 36)
         return self.result
     
     def get_color(self, number):
-        if number in ROULETTE_NUMBERS['rouge']:
-            return 'rouge'
-        elif number in ROULETTE_NUMBERS['noir']:
-            return 'noir'
-        else:
-            return 'vert'
+        return POCKET_COLORS[number]
     
     def calculate_winnings(self, choice, bet):
-        # Vérifie d'abord si c'est un numéro exact
-        if choice.isdigit() and choice == str(self.result):
-            return bet * 36  # Numéro exact: x36
-        # Couleur
-        elif choice in ['rouge', 'noir'] and choice == self.get_color(self.result):
-            return bet * 2  # Couleur: x2
-        # Parité (pair/impair)
-        elif choice == 'pair' and self.result != 0 and self.result % 2 == 0:
-            return bet * 2
-        elif choice == 'impair' and self.result % 2 == 1:
-            return bet * 2
-        # Moitiés
-        elif choice == '1-18' and 1 <= self.result <= 18:
-            return bet * 2
-        elif choice == '19-36' and 19 <= self.result <= 36:
-            return bet * 2
+        compiled = compile_bet(choice)
+        if compiled is not None and compiled.wins(self.result):
+            return bet * compiled.payout
         # Aucun gain
         return 0
-
-@bot.event
-async def on_ready():
-    print(f'✅ {bot.user} est connecté au Cazgino!')
-    print(f'📊 {len(db.data)} joueurs enregistrés')
-
-@bot.command(name='roulette')
-async def roulette(ctx):
-    """Lance une partie de roulette"""
-    global active_roulette
-    
-    if active_roulette is not None:
-        await ctx.send("❌ Une partie de roulette est déjà en cours !")
-        return
-    
-    # Crée la partie
-    active_roulette = RouletteGame(ctx)
     
-    # Phase 1: Rejoindre (30 secondes)
-    msg = await ctx.send(f"""
-🎰 **CAZGINO - ROULETTE**
-
-Une nouvelle partie de roulette commence !
-
-**Phase 1: REJOINDRE LA PARTIE**
-⏰ Vous avez **30 secondes** pour rejoindre !
-
-Tapez `!join` pour participer !
-
-Joueurs inscrits: **0**
-    """)
-    active_roulette.message = msg
-    
-    # Compte à rebours
-    for i in range(30, 0, -10):
-        await asyncio.sleep(10)
-        if active_roulette is None:
-            return
-        player_count = len(active_roulette.players)
-        await msg.edit(content=f"""
+    def settle(self):
+        """Gain total de chaque joueur pour le numéro tiré: une lecture de table par bulletin"""
+        return {user_id: slip.payouts[self.result] for user_id, slip in self.players.items()}
+    
+    def call_later(self, delay, callback):
+        self.timers += 1
+        self.timer = events.call_at([self.seed, self.timers], scheduler.clock() + delay, callback)
+    
+    def schedule_tick(self):
+        self.call_later(COUNTDOWN_STEP, self.tick)
+    
+    def schedule_finish(self):
+        self.call_later(RESULT_DELAY, self.finish)
+    
+    def close(self):
+        """Retire la table du registre et annule sa prochaine échéance"""
+        self.phase = 'finished'
+        if self.timer is not None:
+            self.timer.cancel()
+        if self.view is not None:
+            # Les boutons restants sont alors servis par la vue persistante
+            self.view.stop()
+        self.outbox.cancel('table')
+        if tables.get(self.channel.id) is self:
+            del tables[self.channel.id]
+        # Sans table, la file du salon peut être retirée une fois vide
+        self.outbox.pump()
+    
+    def refund(self):
+        """Rembourse tous les joueurs qui ont misé"""
+        with db.transaction() as tx:
+            for user_id, slip in self.players.items():
+                if slip is not None:
+                    tx.add_balance(user_id, slip.stake)
+    
+    def joining_text(self):
+        return f"""
 🎰 **CAZGINO - ROULETTE**
 
 Une nouvelle partie de roulette commence !
 
 **Phase 1: REJOINDRE LA PARTIE**
-⏰ Il reste **{i} secondes** pour rejoindre !
+⏰ Il reste **{self.remaining} secondes** pour rejoindre !
 
-Tapez `!join` pour participer !
+Clique sur **Rejoindre** (ou `{PREFIX}join`) pour participer !
 
-Joueurs inscrits: **{player_count}**
-        """)
-    
-    if len(active_roulette.players) == 0:
-        await ctx.send("❌ Aucun joueur n'a rejoint ! Partie annulée.")
-        active_roulette = None
-        return
-    
-    # Phase 2: Miser (30 secondes)
-    active_roulette.phase = 'betting'
-    player_count = len(active_roulette.players)
-    
-    await ctx.send(f"""
+Joueurs inscrits: **{len(self.players)}**
+{self.players_text()}
+        """
+    
+    def players_text(self):
+        mentions = [f"<@{user_id}>" for user_id in itertools.islice(self.players, TABLE_PLAYERS_SHOWN)]
+        if len(self.players) > TABLE_PLAYERS_SHOWN:
+            mentions.append(f"et {len(self.players) - TABLE_PLAYERS_SHOWN} autres")
+        return ", ".join(mentions)
+    
+    def betting_text(self):
+        slips = [(user_id, slip) for user_id, slip in self.players.items() if slip is not None]
+        text = f"""
 🎰 **PHASE 2: PLACER VOS MISES**
 
-**{player_count} joueurs** participent !
+**{len(self.players)} joueurs** participent !
 
-⏰ Vous avez **30 secondes** pour miser !
+⏰ Il reste **{self.remaining} secondes** pour miser ! ({len(slips)}/{len(self.players)} ont misé)
 
-**Commande:** `!mise <choix> <montant>`
+Clique sur **Miser**, ou `{PREFIX}mise <choix> <montant> [<choix> <montant>...]`
 
 **Choix disponibles:**
 • Numéro exact: `0` à `36` (gain x36)
+• Cheval: `8/11`, `17/18` (gain x18)
+• Transversale: `t1`, `t4`... `t34` (gain x12)
+• Carré: `1/2/4/5` (gain x9)
+• Douzaine: `d1`, `d2`, `d3` (gain x3)
+• Colonne: `c1`, `c2`, `c3` (gain x3)
 • Couleur: `rouge` ou `noir` (gain x2)
 • Parité: `pair` ou `impair` (gain x2)
 • Moitié: `1-18` ou `19-36` (gain x2)
 
 **Exemples:**
-• `!mise rouge 50` - Mise 50€ sur rouge
-• `!mise 17 100` - Mise 100€ sur le 17
-• `!mise pair 25` - Mise 25€ sur pair
-    """)
+• `{PREFIX}mise rouge 50` - Mise 50€ sur rouge
+• `{PREFIX}mise pair 25 d3 10 17/20 5` - Trois mises d'un coup
+"""
+        if slips:
+            text += "\n**Mises:**\n"
+            for user_id, slip in slips[:TABLE_PLAYERS_SHOWN]:
+                text += f"• <@{user_id}> - **{slip.stake}€** ({len(slip.bets)} mise{'s' if len(slip.bets) > 1 else ''})\n"
+            if len(slips) > TABLE_PLAYERS_SHOWN:
+                text += f"• ... et {len(slips) - TABLE_PLAYERS_SHOWN} autres\n"
+        return text
+    
+    def closed_text(self):
+        stake = sum(slip.stake for slip in self.players.values())
+        return f"🎰 **LES JEUX SONT FAITS** - {len(self.players)} joueurs, **{stake}€** en jeu"
+    
+    def render(self):
+        """Message de la table pour la phase en cours, calculé au départ de chaque édition"""
+        if self.phase == 'joining':
+            return {'content': self.joining_text()}
+        if self.phase == 'betting':
+            return {'content': self.betting_text()}
+        # Mises closes: plus de boutons
+        return {'content': self.closed_text(), 'view': None}
+    
+    def refresh(self, priority=PRIORITY_INFO):
+        """Met à jour le message de la table; une mise à jour encore en attente est remplacée"""
+        return self.outbox.edit(self.message, self.render, key='table', priority=priority)
+    
+    async def start(self):
+        # Phase 1: Rejoindre. Un seul message pour toute la partie, mis à jour
+        # à chaque échéance: c'est aussi lui qui confirme inscriptions et mises
+        self.remaining = JOIN_SECONDS
+        self.view = RouletteView(self)
+        if self.ctx.interaction is not None:
+            # Réponse à la commande slash
+            self.message = await self.ctx.send(self.joining_text(), view=self.view)
+        else:
+            self.message = await self.outbox.send(self.joining_text(), view=self.view, priority=PRIORITY_GAME)
+        self.schedule_tick()
     
-    # Compte à rebours pour les mises
-    for i in range(30, 0, -10):
-        await asyncio.sleep(10)
-        if active_roulette is None:
+    async def tick(self):
+        """Appelé par l'échéancier toutes les COUNTDOWN_STEP secondes"""
+        if self.phase == 'finished':
+            return
+        try:
+            self.remaining -= COUNTDOWN_STEP
+            if self.phase == 'joining':
+                if self.remaining > 0:
+                    self.refresh()
+                    self.schedule_tick()
+                else:
+                    await self.start_betting()
+            elif self.phase == 'betting':
+                if self.remaining > 0:
+                    self.refresh()
+                    self.schedule_tick()
+                else:
+                    await self.spin_and_settle()
+        except Exception:
+            # Une table bloquée ne doit pas garder les mises ni occuper le salon
+            traceback.print_exc()
+            if self.phase != 'finished':
+                self.refund()
+                self.close()
+    
+    async def start_betting(self):
+        if len(self.players) == 0:
+            self.close()
+            await self.outbox.send("❌ Aucun joueur n'a rejoint ! Partie annulée.", priority=PRIORITY_GAME)
             return
-        bets_placed = sum(1 for p in active_roulette.players.values() if p['bet'] is not None)
-        await ctx.send(f"⏰ **{i} secondes** restantes pour miser ! ({bets_placed}/{player_count} ont misé)")
-    
-    # Filtre les joueurs qui n'ont pas misé
-    active_roulette.players = {k: v for k, v in active_roulette.players.items() if v['bet'] is not None}
-    
-    if len(active_roulette.players) == 0:
-        await ctx.send("❌ Personne n'a misé ! Partie annulée.")
-        active_roulette = None
-        return
-    
-    # Phase 3: Lancement de la roulette avec animation
-    result = active_roulette.spin()
-    
-    # Animation de la roulette
-    animation_msg = await ctx.send("🎰 **LA ROULETTE TOURNE...**")
-    
-    # Génère une séquence de numéros aléatoires
-    animation_numbers = [random.randint(0, 36) for _ in range(15)]
-    # Ajoute le vrai résultat à la fin
-    animation_numbers.append(result)
-    
-    for i, num in enumerate(animation_numbers):
-        anim_color = active_roulette.get_color(num)
-        anim_emoji = "🔴" if anim_color == "rouge" else "⚫" if anim_color == "noir" else "🟢"
         
-        # Ralentit progressivement l'animation
-        delay = 0.3 + (i * 0.1)
+        # Phase 2: Miser
+        self.phase = 'betting'
+        self.remaining = BET_SECONDS
+        await self.refresh(PRIORITY_GAME)
+        self.schedule_tick()
+    
+    async def spin_and_settle(self):
+        # Filtre les joueurs qui n'ont pas misé
+        self.players = {k: v for k, v in self.players.items() if v is not None}
         
-        if i < len(animation_numbers) - 1:
-            # Pendant l'animation
-            await animation_msg.edit(content=f"""
-🎰 **LA ROULETTE TOURNE...**
-
-{anim_emoji} **{num}** {anim_emoji}
-
-{'▬' * 20}
-            """)
-        else:
-            # Résultat final
-            color = active_roulette.get_color(result)
-            color_emoji = "🔴" if color == "rouge" else "⚫" if color == "noir" else "🟢"
-            await animation_msg.edit(content=f"""
-🎰 **RÉSULTAT DE LA ROULETTE**
-
-{'=' * 20}
-{color_emoji} **{result}** {color_emoji}
-({color.upper()})
-{'=' * 20}
-
-Calcul des gains...
-            """)
+        if len(self.players) == 0:
+            self.close()
+            await self.outbox.send("❌ Personne n'a misé ! Partie annulée.", priority=PRIORITY_GAME)
+            return
         
-        await asyncio.sleep(delay)
-    
-    await asyncio.sleep(1)
-    
-    # Calcul des gains
-    results_text = "🏆 **RÉSULTATS:**\n\n"
-    winners = []
-    losers = []
-    
-    for user_id, data in active_roulette.players.items():
-        # Enregistre que le joueur a participé à une partie
-        db.add_game_played(user_id)
+        # Phase 3: Lancement de la roulette avec animation
+        self.phase = 'spinning'
+        result = self.spin()
+        
+        # Retire les boutons: plus personne ne peut rejoindre ni miser
+        await self.refresh(PRIORITY_GAME)
+        # Le budget du salon est laissé à l'animation et aux résultats
+        self.outbox.hold_info(ANIMATION_SECONDS + RESULT_DELAY)
+        animation_msg = await self.outbox.send("🎰 **LA ROULETTE TOURNE...**", priority=PRIORITY_GAME)
+        SpinAnimation(animation_msg, result, self.outbox.budget, self.rng).start(self.schedule_finish)
+    
+    async def finish(self):
+        """Règle les mises et annonce les résultats, une fois le numéro affiché"""
+        # Calcul des gains
+        results_text = "🏆 **RÉSULTATS:**\n\n"
+        winners = []
+        losers = []
         
+        # Règle toute la partie en une seule transaction: une seule écriture,
+        # et jamais de partie à moitié payée en cas de crash
+        settlement = []
         try:
-            user = await bot.fetch_user(int(user_id))
-            username = user.name
-        except:
-            username = f"Joueur {user_id}"
+            with db.transaction() as tx:
+                for user_id, winnings in self.settle().items():
+                    # Enregistre que le joueur a participé à une partie
+                    tx.add_game_played(user_id)
+                    if winnings > 0:
+                        tx.add_balance(user_id, winnings)
+                    settlement.append((user_id, self.players[user_id], winnings))
+        except Exception:
+            # Rien n'est réglé: comme dans tick(), les mises sont rendues et le salon libéré
+            traceback.print_exc()
+            try:
+                self.refund()
+            finally:
+                self.close()
+            return
+        try:
+            # Statistiques: une mise à jour en mémoire par joueur, rien de plus à écrire ici
+            db.record_game(guild_key(self.channel), [
+                (user_id, slip.stake, winnings, [(bet.kind, bet.wins(self.result)) for bet, _ in slip.bets])
+                for user_id, slip, winnings in settlement
+            ])
+        except Exception:
+            # Les gains sont versés: des statistiques manquantes ne bloquent pas le salon
+            traceback.print_exc()
+        # La partie est réglée: le salon est libre pour une nouvelle table
+        self.close()
         
-        choice = data['choice']
-        bet = data['bet']
-        winnings = active_roulette.calculate_winnings(choice, bet)
+        names = await usernames.resolve_many([user_id for user_id, _, _ in settlement], self.channel.guild)
+        for user_id, slip, winnings in settlement:
+            username = names[int(user_id)]
+            
+            if winnings > slip.stake:
+                winners.append(f"✅ **{username}** - Misé {slip.stake}€ sur {slip.describe()} → **+{winnings - slip.stake}€** (total: {winnings}€)")
+            elif winnings > 0:
+                winners.append(f"➖ **{username}** - Misé {slip.stake}€ sur {slip.describe()} → **récupère {winnings}€**")
+            else:
+                losers.append(f"❌ **{username}** - Misé {slip.stake}€ sur {slip.describe()} → **Perdu**")
         
-        if winnings > 0:
-            profit = winnings - bet
-            db.add_balance(user_id, winnings)
-            winners.append(f"✅ **{username}** - Misé {bet}€ sur `{choice}` → **+{profit}€** (total: {winnings}€)")
-        else:
-            losers.append(f"❌ **{username}** - Misé {bet}€ sur `{choice}` → **Perdu**")
-    
-    if winners:
-        results_text += "\n".join(winners) + "\n\n"
-    if losers:
-        results_text += "\n".join(losers)
-    
-    await ctx.send(results_text)
-    
-    # Réinitialise la partie
-    active_roulette = None
-    await ctx.send("✅ Partie terminée ! Vous pouvez relancer une nouvelle partie avec `!roulette`")
+        if winners:
+            results_text += "\n".join(winners) + "\n\n"
+        if losers:
+            results_text += "\n".join(losers)
+        
+        results_text += f"\n\n✅ Partie terminée ! Vous pouvez relancer une nouvelle partie avec `{PREFIX}roulette`"
+        await self.outbox.send(results_text, priority=PRIORITY_GAME)
 
-@bot.command(name='join', aliases=['rejoindre'])
-async def join(ctx):
-    """Rejoindre la partie de roulette en cours"""
-    global active_roulette
-    
-    if active_roulette is None:
-        await ctx.send("❌ Aucune partie de roulette en cours ! Lance-en une avec `!roulette`")
-        return
-    
-    if active_roulette.phase != 'joining':
-        await ctx.send("❌ La phase d'inscription est terminée !")
-        return
-    
-    if active_roulette.add_player(ctx.author.id):
-        await ctx.send(f"✅ {ctx.author.mention} a rejoint la partie !")
+@bot.event
+async def on_ready():
+    print(f'✅ {bot.user} est connecté au Cazgino!')
+    print(f'📊 {db.count_accounts()} joueurs enregistrés')
+
+async def reply(ctx, text):
+    """Répond en privé à une commande slash; une commande texte reçoit un message
+    informatif, qui passe après les messages de jeu du salon"""
+    if ctx.interaction is not None:
+        await ctx.send(text, ephemeral=True)
     else:
-        await ctx.send(f"❌ {ctx.author.mention} tu es déjà inscrit !")
+        channel_outbox(ctx.channel).send(text)
 
-@bot.command(name='mise', aliases=['bet'])
-async def mise(ctx, choix: str = None, montant: int = None):
-    """Placer une mise - !mise <choix> <montant>"""
-    global active_roulette
+def join_table(game, user):
+    """Inscrit un joueur à une table; renvoie (inscrit ou non, réponse à lui afficher)"""
+    if game is None:
+        return False, f"❌ Aucune partie de roulette en cours dans ce salon ! Lance-en une avec `{PREFIX}roulette`"
     
-    if active_roulette is None:
-        await ctx.send("❌ Aucune partie de roulette en cours !")
-        return
-    
-    if active_roulette.phase != 'betting':
-        await ctx.send("❌ Ce n'est pas le moment de miser !")
-        return
-    
-    if ctx.author.id not in active_roulette.players:
-        await ctx.send("❌ Tu n'as pas rejoint la partie !")
-        return
-    
-    if active_roulette.players[ctx.author.id]['bet'] is not None:
-        await ctx.send("❌ Tu as déjà misé ! Une seule mise par joueur.")
-        return
+    if game.phase != 'joining':
+        return False, "❌ La phase d'inscription est terminée !"
     
-    if choix is None or montant is None:
-        await ctx.send("❌ Usage: `!mise <choix> <montant>` - Exemple: `!mise rouge 50`")
-        return
-    
-    # Valide le choix
-    choix = choix.lower()
-    valid_choices = ['rouge', 'noir', 'pair', 'impair', '1-18', '19-36'] + [str(i) for i in range(37)]
+    if game.add_player(user.id):
+        return True, f"✅ {user.mention} a rejoint la partie !"
+    return False, f"❌ {user.mention} tu es déjà inscrit !"
+
+def bet_refusal(game, user_id):
+    """Raison pour laquelle un joueur ne peut pas miser à cette table, ou None"""
+    if game is None:
+        return "❌ Aucune partie de roulette en cours dans ce salon !"
     
-    if choix not in valid_choices:
-        await ctx.send(f"❌ Choix invalide ! Choisis parmi: {', '.join(valid_choices[:10])}...")
-        return
+    if game.phase != 'betting':
+        return "❌ Ce n'est pas le moment de miser !"
     
-    if montant <= 0:
-        await ctx.send("❌ La mise doit être positive !")
-        return
+    if user_id not in game.players:
+        return "❌ Tu n'as pas rejoint la partie !"
     
-    balance = db.get_balance(ctx.author.id)
-    if montant > balance:
-        await ctx.send(f"❌ Tu n'as pas assez d'argent ! Ton solde: {balance}€")
+    if game.players[user_id] is not None:
+        return "❌ Tu as déjà misé ! Un seul bulletin par joueur."
+    return None
+
+def place_bet(game, user, slip):
+    """Valide et débite un bulletin (`slip`: choix et montants en alternance); renvoie (accepté ou non, réponse)"""
+    refusal = bet_refusal(game, user.id)
+    if refusal is not None:
+        return False, refusal
+    
+    if not slip or len(slip) % 2 != 0:
+        return False, f"❌ Usage: `{PREFIX}mise <choix> <montant>` - Exemple: `{PREFIX}mise rouge 50` ou `{PREFIX}mise rouge 50 17 10`"
+    
+    if len(slip) // 2 > MAX_BETS_PER_SLIP:
+        return False, f"❌ Maximum {MAX_BETS_PER_SLIP} mises par bulletin !"
+    
+    bets = []
+    for choix, montant in zip(slip[::2], slip[1::2]):
+        # Valide le choix
+        bet = compile_bet(choix)
+        if bet is None:
+            return False, f"❌ Choix invalide: `{choix}` ! Tape `{PREFIX}regles` pour voir les mises possibles."
+        
+        digits = montant[1:] if montant.startswith('-') else montant
+        if not (digits.isascii() and digits.isdigit()):
+            return False, "❌ Le montant doit être un nombre !"
+        
+        montant = int(montant)
+        if montant <= 0:
+            return False, "❌ La mise doit être positive !"
+        bets.append((bet, montant))
+    
+    slip = Slip(bets)
+    # Vérifie le solde et débite la mise en une seule opération
+    debited, balance = db.debit(user.id, slip.stake)
+    if not debited:
+        return False, f"❌ Tu n'as pas assez d'argent ! Ton solde: {balance}€"
+    
+    game.set_bet(user.id, slip)
+    return True, f"✅ {user.mention} mise **{slip.stake}€** sur {slip.describe()} !"
+
+class BetModal(discord.ui.Modal, title='Placer une mise'):
+    """Formulaire ouvert par le bouton Miser"""
+    choix = discord.ui.TextInput(label='Choix', placeholder='rouge, 17, 8/11, t4, d2, pair, 1-18...', max_length=20)
+    montant = discord.ui.TextInput(label='Montant (€)', placeholder='50', max_length=12)
+    
+    def __init__(self, game):
+        super().__init__()
+        self.game = game
+    
+    async def on_submit(self, interaction):
+        slip_tokens = [self.choix.value.strip(), self.montant.value.strip()]
+        events.record('m', ch=self.game.channel.id, u=interaction.user.id, g=self.game.seed, x=slip_tokens)
+        _, text = place_bet(self.game, interaction.user, slip_tokens)
+        await interaction.response.send_message(text, ephemeral=True)
+
+class RouletteView(discord.ui.View):
+    """Boutons du message de la table, confirmés en privé (réponses éphémères)
+    
+    Chaque table a sa vue; celle sans table, enregistrée au démarrage, répond
+    aux boutons des parties terminées ou d'avant un redémarrage."""
+    def __init__(self, game=None):
+        super().__init__(timeout=None)
+        self.game = game
+    
+    @discord.ui.button(label='Rejoindre', emoji='🎰', style=discord.ButtonStyle.success, custom_id='cazgino:join')
+    async def join_button(self, interaction, button):
+        if self.game is None:
+            await interaction.response.send_message("❌ Cette partie est terminée !", ephemeral=True)
+            return
+        events.record('j', ch=self.game.channel.id, u=interaction.user.id, g=self.game.seed)
+        _, text = join_table(self.game, interaction.user)
+        await interaction.response.send_message(text, ephemeral=True)
+    
+    @discord.ui.button(label='Miser', emoji='💰', style=discord.ButtonStyle.primary, custom_id='cazgino:bet')
+    async def bet_button(self, interaction, button):
+        if self.game is None:
+            await interaction.response.send_message("❌ Cette partie est terminée !", ephemeral=True)
+            return
+        refusal = bet_refusal(self.game, interaction.user.id)
+        if refusal is not None:
+            await interaction.response.send_message(refusal, ephemeral=True)
+            return
+        await interaction.response.send_modal(BetModal(self.game))
+
+@bot.hybrid_command(name='roulette')
+async def roulette(ctx):
+    """Lance une partie de roulette dans ce salon"""
+    if ctx.channel.id in tables:
+        await reply(ctx, "❌ Une partie de roulette est déjà en cours dans ce salon !")
         return
     
-    # Débite la mise
-    db.add_balance(ctx.author.id, -montant)
-    active_roulette.set_bet(ctx.author.id, choix, montant)
-    
-    await ctx.send(f"✅ {ctx.author.mention} mise **{montant}€** sur `{choix}` !")
+    # Crée la table du salon; la suite est pilotée par l'échéancier
+    game = RouletteGame(ctx)
+    tables[ctx.channel.id] = game
+    try:
+        await game.start()
+    except Exception:
+        game.close()
+        raise
 
-@bot.command(name='balance', aliases=['bal', 'argent'])
+@bot.hybrid_command(name='join', aliases=['rejoindre'])
+async def join(ctx):
+    """Rejoindre la partie de roulette en cours"""
+    joined, text = join_table(tables.get(ctx.channel.id), ctx.author)
+    # Inscription par commande texte: confirmée par la prochaine mise à jour de la table
+    if not joined or ctx.interaction is not None:
+        await reply(ctx, text)
+
+@bot.hybrid_command(name='mise', aliases=['bet'])
+@app_commands.describe(mises="Choix et montants en alternance, ex: rouge 50 17 10")
+async def mise(ctx, *, mises: str):
+    """Placer une ou plusieurs mises - <choix> <montant> [<choix> <montant>...]"""
+    accepted, text = place_bet(tables.get(ctx.channel.id), ctx.author, mises.split())
+    # Mise par commande texte: confirmée par la prochaine mise à jour de la table
+    if not accepted or ctx.interaction is not None:
+        await reply(ctx, text)
+
+@bot.hybrid_command(name='balance', aliases=['bal', 'argent'])
 async def balance(ctx):
     """Affiche ton solde"""
     balance = db.get_balance(ctx.author.id)
     await ctx.send(f"💰 **{ctx.author.name}**, tu as **{balance}€**")
 
-@bot.command(name='interim', aliases=['job', 'travail'])
+@bot.hybrid_command(name='interim', aliases=['job', 'travail'])
 async def interim(ctx):
     """Lance un job d'intérim pour gagner de l'argent"""
     
     if ctx.author.id in active_jobs:
-        await ctx.send("❌ Tu as déjà un job en cours ! Termine-le d'abord.")
+        await ctx.send("❌ Tu as déjà un job en cours ! Termine-le d'abord.", ephemeral=True)
         return
     
     # Choisit une recette aléatoire
-    recipe_key = random.choice(list(RECIPES.keys()))
-    job = InterimJob(ctx.author.id, recipe_key)
+    seed = events.seed('job', ctx.author.id)
+    rng = random.Random(seed)
+    recipe_key = rng.choice(list(RECIPES.keys()))
+    job = InterimJob(ctx.author.id, recipe_key, rng)
+    job.seed = seed
+    job.channel = ctx.channel
     active_jobs[ctx.author.id] = job
-    
+    # L'échéancier partagé gère la fin du temps: rien ne reste en attente ici
+    job.timer = events.call_at([seed], scheduler.clock() + job.recipe['time_limit'], lambda: expire_job(job))
+    try:
+        await send_job(ctx, job)
+    except Exception:
+        finish_job(job)
+        raise
+
+async def send_job(ctx, job):
+    """Envoie la commande d'intérim et ajoute les réactions"""
     # Crée le message avec les instructions
     embed = discord.Embed(
         title="💼 INTÉRIM - Nouvelle commande !",
@@ -496,77 +3599,66 @@ async def interim(ctx):
     
     msg = await ctx.send(embed=embed)
     job.message = msg
+    job.updates = MessageDebouncer(msg, job.render_progress)
+    jobs_by_message[msg.id] = job
     
     # Ajoute toutes les réactions nécessaires (mélangées pour la difficulté)
     emojis = job.recipe['emojis'].copy()
-    random.shuffle(emojis)
+    job.rng.shuffle(emojis)
     
     for emoji in emojis:
         await msg.add_reaction(emoji)
-    
-    # Vérifie le timeout avec une boucle qui s'arrête si le job est complété
-    for _ in range(job.recipe['time_limit']):
-        await asyncio.sleep(1)
-        
-        # Si le job n'existe plus (complété ou annulé), on arrête
-        if ctx.author.id not in active_jobs:
-            return
-        
-        # Si le job est marqué comme complété, on arrête
-        if active_jobs[ctx.author.id].completed:
-            return
-    
-    # Si on arrive ici, c'est que le temps est écoulé
-    if ctx.author.id in active_jobs and not active_jobs[ctx.author.id].completed:
-        await ctx.send(f"⏰ {ctx.author.mention} Temps écoulé ! Tu n'as pas terminé la commande à temps.")
-        del active_jobs[ctx.author.id]
-@bot.command(name='reroll', aliases=['relancer'])
+
+@bot.hybrid_command(name='reroll', aliases=['relancer'])
 async def reroll(ctx):
-    balance = db.get_balance(ctx.author.id)
-    if 200 > balance:
-        await ctx.send(f"❌ Tu n'as pas assez d'argent ! Ton solde: {balance}€")
+    """Paie 200€ pour relancer une fois de plus"""
+    debited, balance = db.debit(ctx.author.id, 200)
+    if not debited:
+        await ctx.send(f"❌ Tu n'as pas assez d'argent ! Ton solde: {balance}€", ephemeral=True)
         return
     else:
-        db.add_balance(ctx.author.id, -200)
         await ctx.send(f"✅ {ctx.author.mention} peut reroll une fois de plus !")
 
 @bot.event
-async def on_reaction_add(reaction, user):
-    """Gère les réactions pour le jeu d'intérim"""
+async def on_raw_reaction_add(payload):
+    """Gère les réactions pour le jeu d'intérim, même sur un message sorti du cache"""
+    current_command.set('interim')
     
-    # Ignore les réactions du bot
-    if user.bot:
+    # Retrouve le job à partir du message
+    job = jobs_by_message.get(payload.message_id)
+    if job is None:
         return
     
-    # Vérifie si l'utilisateur a un job actif
-    if user.id not in active_jobs:
+    # Ignore les réactions du bot et des autres joueurs
+    if payload.user_id != job.user_id:
         return
     
-    job = active_jobs[user.id]
-    
-    # Vérifie si c'est le bon message
-    if reaction.message.id != job.message.id:
-        return
-    
-    # Vérifie si le temps est écoulé
+    # Vérifie si le temps est écoulé: si l'échéance s'est déjà déclenchée, sa tâche va
+    # terminer le job; sinon (boucle en retard) la fin est notée comme si elle se
+    # déclenchait ici
     if job.is_expired():
-        await reaction.message.channel.send(f"⏰ {user.mention} Temps écoulé !")
-        del active_jobs[user.id]
+        if not job.timer.cancelled:
+            job.timer.cancel()
+            events.record('k', k=[job.seed])
+            await expire_job(job)
         return
+    events.record('r', ch=payload.channel_id, u=payload.user_id, x=str(payload.emoji))
     
-    # Vérifie si c'est la bonne réaction
-    expected_emoji = job.get_current_emoji()
+    mention = f"<@{payload.user_id}>"
     
-    if str(reaction.emoji) == expected_emoji:
+    # Vérifie si c'est la bonne réaction
+    if str(payload.emoji) == job.get_current_emoji():
         # Bonne réaction !
         is_complete = job.next_step()
         
         if is_complete:
             # Commande terminée !
             job.completed = True
+            finish_job(job)
             reward = job.recipe['reward']
-            db.add_balance(user.id, reward)
-            new_balance = db.get_balance(user.id)
+            db.add_balance(job.user_id, reward)
+            db.record_job(guild_key(job.channel), job.user_id, job.recipe_key, True)
+            new_balance = db.get_balance(job.user_id)
             
             embed = discord.Embed(
                 title="✅ COMMANDE LIVRÉE !",
@@ -576,40 +3668,38 @@ async def on_reaction_add(reaction, user):
             embed.add_field(name="💰 Récompense", value=f"+{reward}€", inline=True)
             embed.add_field(name="💵 Nouveau solde", value=f"{new_balance}€", inline=True)
             
-            await reaction.message.channel.send(f"{user.mention}", embed=embed)
-            del active_jobs[user.id]
+            await job.channel.send(mention, embed=embed)
         else:
-            # Passe à l'étape suivante
-            next_emoji = job.get_current_emoji()
-            progress = "✅ " * job.current_step + "⬜ " * (len(job.recipe['steps']) - job.current_step)
-            
-            embed = discord.Embed(
-                title="💼 INTÉRIM - En cours...",
-                description=f"**Prépare:** {job.recipe['name']}",
-                color=discord.Color.orange()
-            )
-            embed.add_field(
-                name="📊 Progression",
-                value=progress,
-                inline=False
-            )
-            embed.add_field(
-                name="➡️ Prochaine étape",
-                value=f"Clique sur **{next_emoji}**",
-                inline=False
-            )
-            
-            await reaction.message.edit(embed=embed)
+            # Passe à l'étape suivante: une seule édition pour une rafale de clics
+            job.updates.touch()
     else:
-        # Mauvaise réaction
-        await reaction.message.channel.send(f"❌ {user.mention} Mauvais ingrédient ! Clique sur **{expected_emoji}**")
-        await reaction.remove(user)
+        # Mauvaise réaction: signalée dans la même édition que la progression
+        job.mistakes += 1
+        job.last_mistake = str(payload.emoji)
+        job.updates.touch()
+        await job.message.remove_reaction(payload.emoji, discord.Object(payload.user_id))
 
-@bot.command(name='leaderboard', aliases=['classement', 'top'])
-async def leaderboard(ctx):
+@bot.hybrid_command(name='leaderboard', aliases=['classement', 'top'])
+async def leaderboard(ctx, page: int = 1):
     """Affiche le classement des plus riches (joueurs ayant participé à au moins 1 partie)"""
     
-    leaderboard = db.get_leaderboard()[:10]
+    cache = db.leaderboard_cache
+    text = cache.get(page)
+    if text is not None:
+        await ctx.send(text)
+        return
+    
+    # Les pseudos à résoudre peuvent dépasser les 3s accordées à une commande slash
+    await ctx.defer()
+    page_size = cache.page_size
+    total_pages = cache.page_count(db.count_ranked())
+    if page < 1 or page > total_pages:
+        await ctx.send(f"❌ Page invalide ! Le classement compte **{total_pages}** pages.")
+        return
+    # Seule une page existante est suivie: une page invalide ne laisse rien dans le cache
+    version = cache.track(page)
+    
+    leaderboard = db.get_leaderboard(page_size, (page - 1) * page_size)
     
     if not leaderboard:
         await ctx.send("❌ Aucun joueur n'a encore participé à une partie !")
@@ -618,25 +3708,126 @@ async def leaderboard(ctx):
     text = "🏆 **CAZGINO - CLASSEMENT DES PLUS RICHES**\n\n"
     medals = ['🥇', '🥈', '🥉']
     
-    for i, (user_id, balance) in enumerate(leaderboard, 1):
-        try:
-            user = await bot.fetch_user(int(user_id))
-            username = user.name
-        except:
-            username = f"Joueur {user_id}"
-        
+    names = await usernames.resolve_many([user_id for user_id, _, _ in leaderboard], ctx.guild)
+    for i, (user_id, balance, games_played) in enumerate(leaderboard, (page - 1) * page_size + 1):
+        username = names[user_id]
         medal = medals[i-1] if i <= 3 else f"**{i}.**"
-        games_played = db.stats.get(user_id, {}).get('games_played', 0)
         text += f"{medal} {username} - **{balance}€** ({games_played} parties)\n"
     
+    if total_pages > 1:
+        text += f"\nPage {page}/{total_pages} - `{PREFIX}leaderboard <page>` pour voir la suite"
     text += "\n_Seuls les joueurs ayant participé à au moins 1 partie apparaissent._"
+    cache.put(page, text, version, leaderboard, total_pages)
     await ctx.send(text)
 
-@bot.command(name='regles', aliases=['règles', 'regle', 'règle', 'rules'])
+@bot.hybrid_command(name='rank', aliases=['rang'])
+async def rank(ctx, member: discord.Member = None):
+    """Affiche la position d'un joueur dans le classement"""
+    member = member or ctx.author
+    position = db.get_rank(member.id)
+    
+    if position is None:
+        await ctx.send(f"❌ **{member.name}** n'apparaît pas au classement (aucune partie jouée).", ephemeral=True)
+        return
+    
+    balance = db.get_balance(member.id)
+    games_played = db.get_games_played(member.id)
+    await ctx.send(f"🏅 **{member.name}** est **n°{position + 1}** sur {db.count_ranked()} avec **{balance}€** ({games_played} parties)")
+
+def bet_kind_lines(counters):
+    """Taux de réussite par type de mise, pour les types joués"""
+    lines = []
+    for kind, label in BET_KINDS.values():
+        bets = counters.get('bets_' + kind, 0)
+        if bets:
+            hits = counters.get('hits_' + kind, 0)
+            lines.append(f"• {label}: {hits}/{bets} ({hits / bets:.0%})")
+    return lines
+
+def job_lines(counters):
+    """Jobs d'intérim livrés et ratés par recette"""
+    lines = []
+    for key, recipe in RECIPES.items():
+        done = counters.get('jobs_' + key, 0)
+        failed = counters.get('failed_' + key, 0)
+        if done or failed:
+            lines.append(f"• {recipe['name']}: {done} livrés, {failed} ratés")
+    return lines
+
+@bot.hybrid_command(name='stats', aliases=['statistiques'])
+async def stats(ctx, member: discord.Member = None):
+    """Affiche les statistiques d'un joueur"""
+    member = member or ctx.author
+    counters = db.get_player_stats(member.id)
+    
+    if counters is None:
+        await ctx.send(f"❌ **{member.name}** n'a encore ni joué ni fait de job.", ephemeral=True)
+        return
+    
+    games = counters.get('games', 0)
+    won = counters.get('won', 0)
+    lost = counters.get('lost', 0)
+    streak = counters.get('streak', 0)
+    if streak > 0:
+        current = f"{streak} victoire(s)"
+    elif streak < 0:
+        current = f"{-streak} défaite(s)"
+    else:
+        current = "aucune"
+    
+    text = f"📊 **STATISTIQUES DE {member.name}**\n\n"
+    text += f"🎰 **Roulette:** {games} parties, {counters.get('wins', 0)} gagnées, {counters.get('losses', 0)} perdues\n"
+    text += f"💸 Misé: **{counters.get('wagered', 0)}€** - Gagné: **{won}€** - Perdu: **{lost}€** (bilan {won - lost:+}€)\n"
+    text += f"💎 Plus gros gain: **{counters.get('biggest_win', 0)}€**\n"
+    text += f"🔥 Série en cours: {current} - Meilleure: {counters.get('best_streak', 0)} - Pire: {counters.get('worst_streak', 0)}\n"
+    kinds = bet_kind_lines(counters)
+    if kinds:
+        text += "\n🎯 **Mises gagnantes:**\n" + "\n".join(kinds) + "\n"
+    jobs = job_lines(counters)
+    if jobs:
+        text += "\n💼 **Intérim:**\n" + "\n".join(jobs) + "\n"
+    await ctx.send(text)
+
+@bot.hybrid_command(name='casino')
+async def casino(ctx):
+    """Affiche les statistiques du serveur"""
+    counters = db.get_guild_stats(guild_key(ctx.channel))
+    
+    if counters is None:
+        await ctx.send("❌ Aucune partie ni aucun job sur ce serveur pour l'instant !")
+        return
+    
+    wagered = counters.get('wagered', 0)
+    # Ce que les joueurs ont perdu moins ce qu'ils ont gagné reste à la maison
+    profit = counters.get('lost', 0) - counters.get('won', 0)
+    edge = f" ({profit / wagered:.2%} des mises)" if wagered else ""
+    
+    text = "🏛️ **CAZGINO - STATISTIQUES DU SERVEUR**\n\n"
+    text += f"🎰 **{counters.get('games', 0)}** parties, {counters.get('player_games', 0)} bulletins réglés\n"
+    text += f"💸 Misé: **{wagered}€** - Gardé par la maison: **{profit}€**{edge}\n"
+    biggest = counters.get('biggest_win', 0)
+    if biggest:
+        winner = counters['biggest_winner']
+        names = await usernames.resolve_many([winner], ctx.guild)
+        text += f"💎 Plus gros gain: **{biggest}€** par {names[winner]}\n"
+    kinds = bet_kind_lines(counters)
+    if kinds:
+        text += "\n🎯 **Mises gagnantes:**\n" + "\n".join(kinds) + "\n"
+    jobs = job_lines(counters)
+    if jobs:
+        text += "\n💼 **Intérim:**\n" + "\n".join(jobs) + "\n"
+    await ctx.send(text)
+
+@bot.hybrid_command(name='regles', aliases=['règles', 'regle', 'règle', 'rules'])
 async def regles(ctx):
     """Affiche les règles de la roulette"""
     
-    text = """
+    # Tirées de RECIPES pour ne jamais annoncer d'autres montants que ceux versés
+    rewards = "\n".join(
+        f"• {recipe['name']}: {recipe['reward']}€ ({recipe['time_limit']}s)"
+        for recipe in sorted(RECIPES.values(), key=lambda recipe: recipe['reward'])
+    )
+    text = f"""
 📜 **CAZGINO - RÈGLES**
 
 🎰 **ROULETTE:**
@@ -644,70 +3835,167 @@ async def regles(ctx):
 **Objectif:** Parier sur le résultat de la roulette (0-36)
 
 **Déroulement:**
-• Phase 1 (30s): `!roulette` puis `!join` pour rejoindre
-• Phase 2 (30s): `!mise <choix> <montant>` pour miser
+• Phase 1 (30s): `{PREFIX}roulette` puis bouton **Rejoindre** (ou `{PREFIX}join`)
+• Phase 2 (30s): bouton **Miser** (ou `{PREFIX}mise <choix> <montant>`)
 • Phase 3: Résultat et gains automatiques
 
 **Types de mises:**
 • Numéro exact (0-36): x36
+• Cheval (`8/11`): x18
+• Transversale (`t1` à `t34`): x12
+• Carré (`1/2/4/5`): x9
+• Douzaine (`d1`, `d2`, `d3`): x3
+• Colonne (`c1`, `c2`, `c3`): x3
 • Couleur (rouge/noir): x2
 • Parité (pair/impair): x2
 • Moitié (1-18 ou 19-36): x2
+Plusieurs mises par bulletin: `{PREFIX}mise rouge 50 17 10`
 
 💼 **INTÉRIM (Gagner de l'argent):**
 
 **Comment jouer:**
-1. Tape `!interim` pour recevoir une commande
+1. Tape `{PREFIX}interim` pour recevoir une commande
 2. Clique sur les réactions **dans l'ordre** indiqué
 3. Finis avant la fin du temps pour gagner !
 
 **Récompenses:**
-• 🥗 Salade: 35€ (12s)
-• 🌮 Tacos: 45€ (15s)
-• 🍔 Burger: 50€ (20s)
-• 🍕 Pizza: 60€ (15s)
-• 🍣 Sushi: 70€ (12s)
+{rewards}
 
 ⚡ **Commandes:**
-`!roulette` - Lancer la roulette
-`!join` - Rejoindre la partie
-`!mise <choix> <montant>` - Miser
-`!interim` - Faire un job
-`!balance` - Voir son solde
-`!leaderboard` - Classement
+`{PREFIX}roulette` - Lancer la roulette
+`{PREFIX}join` - Rejoindre la partie
+`{PREFIX}mise <choix> <montant>` - Miser
+`{PREFIX}interim` - Faire un job
+`{PREFIX}balance` - Voir son solde
+`{PREFIX}leaderboard [page]` - Classement
+`{PREFIX}rank [@joueur]` - Position au classement
+`{PREFIX}stats [@joueur]` - Statistiques d'un joueur
+`{PREFIX}casino` - Statistiques du serveur
 
 💵 Solde de départ: **500€**
     """
     
     await ctx.send(text)
 
-@bot.command(name='stop')
+@bot.hybrid_command(name='stop')
+@app_commands.default_permissions(administrator=True)
 async def stop(ctx):
-    """Arrête la partie en cours (admin seulement)"""
-    global active_roulette
-    
+    """Arrête la partie en cours dans ce salon (admin seulement)"""
     if not ctx.author.guild_permissions.administrator:
-        await ctx.send("❌ Seuls les administrateurs peuvent arrêter une partie !")
+        await ctx.send("❌ Seuls les administrateurs peuvent arrêter une partie !", ephemeral=True)
         return
     
-    if active_roulette is None:
-        await ctx.send("❌ Aucune partie en cours !")
+    game = tables.get(ctx.channel.id)
+    if game is None:
+        await ctx.send("❌ Aucune partie en cours !", ephemeral=True)
         return
     
-    # Rembourse tous les joueurs qui ont misé
-    for user_id, data in active_roulette.players.items():
-        if data['bet'] is not None:
-            db.add_balance(user_id, data['bet'])
+    if game.phase == 'spinning':
+        await ctx.send("❌ La roulette tourne déjà, la partie va se terminer !", ephemeral=True)
+        return
     
-    active_roulette = None
+    game.close()
+    game.refund()
     await ctx.send("✅ Partie arrêtée et mises remboursées !")
 
+@bot.hybrid_command(name='profile', aliases=['profil'])
+@app_commands.default_permissions(administrator=True)
+async def profile(ctx, seconds: int = 10):
+    """Profile le bot en production pendant quelques secondes (admin seulement)"""
+    if not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ Seuls les administrateurs peuvent lancer le profileur !", ephemeral=True)
+        return
+    
+    if profiler_lock.locked():
+        await ctx.send("❌ Un profilage est déjà en cours !", ephemeral=True)
+        return
+    
+    seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+    async with profiler_lock:
+        await ctx.send(f"🔬 Profilage pendant **{seconds}s**...")
+        profiler = SamplingProfiler(threading.get_ident(), seconds)
+        await asyncio.to_thread(profiler.run)
+        
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        filename = os.path.join(PROFILE_DIR, f'profile-{int(time.time())}.folded')
+        await asyncio.to_thread(profiler.write, filename)
+    
+    text = f"🔬 **PROFIL** - {profiler.samples} échantillons en {seconds}s\n\n"
+    for function, count in profiler.top():
+        text += f"• `{function}`: {count * 100 / max(profiler.samples, 1):.0f}%\n"
+    text += f"\nPiles complètes: `{filename}` (format flamegraph)"
+    await ctx.send(text, file=discord.File(filename))
+
+@bot.hybrid_command(name='metrics', aliases=['metriques'])
+@app_commands.default_permissions(administrator=True)
+async def metrics_summary(ctx):
+    """Résumé des métriques du bot (admin seulement)"""
+    if not ctx.author.guild_permissions.administrator:
+        await ctx.send("❌ Seuls les administrateurs peuvent voir les métriques !", ephemeral=True)
+        return
+    
+    def ms(value):
+        return "—" if value is None else "∞" if value == float('inf') else f"≤{value * 1000:.0f}ms"
+    
+    text = "📈 **CAZGINO - MÉTRIQUES**\n\n**Commandes** (nombre, p50, p99, appels API)\n"
+    for (name, labels), histogram in sorted(metrics.histograms.items()):
+        if name != 'cazgino_command_seconds':
+            continue
+        command = dict(labels)['command']
+        api_calls = metrics.counter_total('cazgino_discord_api_calls_total', command=command)
+        text += f"• `{command}`: {histogram.count}, {ms(histogram.quantile(0.5))}, {ms(histogram.quantile(0.99))}, {api_calls} appels\n"
+    
+    text += "\n**Appels API**\n"
+    for kind in ('send', 'edit', 'fetch_user', 'add_reaction', 'remove_reaction', 'other'):
+        count = metrics.counter_total('cazgino_discord_api_calls_total', kind=kind)
+        if count:
+            text += f"• {kind}: {count}\n"
+    
+    outcomes = {outcome: metrics.counter_total('cazgino_outbox_messages_total', priority='info', outcome=outcome)
+                for outcome in ('sent', 'superseded', 'expired')}
+    if any(outcomes.values()):
+        text += f"• messages informatifs: {outcomes['sent']} envoyés, {outcomes['superseded']} remplacés, {outcomes['expired']} expirés\n"
+    
+    text += "\n**Persistance**\n"
+    for (name, labels), histogram in sorted(metrics.histograms.items()):
+        if name != 'cazgino_db_write_seconds':
+            continue
+        target = dict(labels)['target']
+        size = metrics.counter_total('cazgino_db_write_bytes_total', target=target)
+        text += f"• {target}: {histogram.count} écritures, {size / 1024:.1f} Ko, {histogram.sum * 1000:.0f}ms au total\n"
+    
+    hits = metrics.counter_total('cazgino_account_lookups_total', tier='hot')
+    misses = metrics.counter_total('cazgino_account_lookups_total', tier='cold')
+    if hits or misses:
+        text += f"• comptes en mémoire: {len(db.storage.hot)}, lectures en mémoire: {hits * 100 / (hits + misses):.0f}% ({misses} depuis le disque)\n"
+    
+    ledger_calls = [h for (name, _), h in metrics.histograms.items() if name == 'cazgino_ledger_seconds']
+    if ledger_calls:
+        count = sum(h.count for h in ledger_calls)
+        total = sum(h.sum for h in ledger_calls)
+        text += f"• service de comptes: {count} allers-retours, {total * 1e6 / count:.0f}µs en moyenne\n"
+    
+    lag = metrics.histograms.get(('cazgino_loop_lag_seconds', ()))
+    if lag is not None:
+        blocked = metrics.counter_total('cazgino_loop_blocked_total')
+        text += f"\n**Boucle d'événements**\n• retard p99: {ms(lag.quantile(0.99))}, blocages > {LOOP_BLOCK_THRESHOLD * 1000:.0f}ms: {blocked}\n"
+    
+    text += f"\n🎰 Tables en cours: **{len(tables)}** - 💼 Jobs en cours: **{len(active_jobs)}**"
+    await ctx.send(text)
+
 # Gestion des erreurs
 @mise.error
 async def mise_error(ctx, error):
     if isinstance(error, commands.MissingRequiredArgument):
-        await ctx.send("❌ Usage: `!mise <choix> <montant>` - Exemple: `!mise rouge 50`")
-    elif isinstance(error, commands.BadArgument):
-        await ctx.send("❌ Le montant doit être un nombre !")
+        await reply(ctx, f"❌ Usage: `{PREFIX}mise <choix> <montant>` - Exemple: `{PREFIX}mise rouge 50`")
 
-bot.run(os.getenv("DISCORD_TOKEN"))
\ No newline at end of file
+if __name__ == '__main__':
+    # SIGTERM (systemd, docker stop) arrête le bot comme Ctrl+C, pour passer par la sauvegarde finale
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        bot.run(os.getenv("DISCORD_TOKEN"))
+    finally:
+        # Replie le journal, ou écrit le dernier instantané, dans les fichiers JSON
+        watchdog.stop()
+        db.close()
+        events.close()
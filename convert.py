@@ -0,0 +1,47 @@
+"""Conversion des comptes du Cazgino entre fichiers JSON et instantané binaire.
+
+    python convert.py to-snapshot   # cazgino_data.json + cazgino_stats.json (+ journal) -> cazgino.snap
+    python convert.py to-json       # cazgino.snap (+ journal) -> cazgino_data.json + cazgino_stats.json
+
+À lancer bot arrêté, dans le dossier des données. Le format de départ reste la
+référence: le journal de l'autre format est vidé pour ne pas être rejoué par-dessus.
+"""
+import argparse
+import os
+import sys
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('direction', choices=['to-snapshot', 'to-json'])
+    args = parser.parse_args()
+
+    # Le bot ouvre son stockage à l'import: on lui fait ouvrir le format de départ
+    os.environ['CAZGINO_STORAGE'] = 'json' if args.direction == 'to-snapshot' else 'snapshot'
+    os.environ['CAZGINO_JSON_PERSISTENCE'] = 'journal'
+    os.environ.pop('CAZGINO_LEDGER', None)  # Fichiers locaux, jamais le service de comptes
+    if args.direction == 'to-json' and not os.path.exists('cazgino.snap'):
+        sys.exit('❌ Pas de cazgino.snap dans ce dossier')
+
+    import bot
+    storage = bot.db.storage
+    if args.direction == 'to-snapshot':
+        bot.write_snapshot(bot.SNAPSHOT_FILE, storage.accounts, storage.ranking.slice(0, len(storage.ranking)))
+        stale_journals = [bot.SNAPSHOT_JOURNAL_FILE, bot.SNAPSHOT_JOURNAL_FILE + '.1']
+        target = bot.SNAPSHOT_FILE
+    else:
+        storage.export_json()
+        stale_journals = [bot.JOURNAL_FILE]
+        target = 'cazgino_data.json, cazgino_stats.json'
+    bot.db.close()
+    for journal in stale_journals:
+        if os.path.exists(journal):
+            os.remove(journal)
+    print(f'✅ {storage.count()} comptes écrits dans {target}')
+
+
+if __name__ == '__main__':
+    main()
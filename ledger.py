@@ -0,0 +1,154 @@
+"""Service de comptes du Cazgino: une seule source de vérité pour plusieurs bots.
+
+    python ledger.py                                        # écoute sur cazgino_ledger.sock
+    CAZGINO_LEDGER=/chemin/cazgino_ledger.sock python bot.py   # chaque bot (ou shard)
+
+Le service ouvre le stockage configuré (CAZGINO_STORAGE...) dans le dossier
+courant et sert les méthodes de Database sur un socket Unix, une ligne JSON par
+requête (`[numéro, opération, arguments...]`) et par réponse (`{"id": numéro,
+"ok": résultat}` ou `{"id": numéro, "error": message}`). Les requêtes sont exécutées une à une, dans l'ordre
+d'arrivée: chaque opération est atomique pour tous les bots, y compris le débit
+conditionnel d'une mise. Les requêtes déjà arrivées sur une connexion sont
+traitées en lot: leurs écritures consécutives forment une seule modification
+du stockage, et leurs réponses partent en une seule écriture sur le socket.
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import sys
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+# Le service est le seul à ouvrir le stockage: le bot importé ne doit pas se connecter à lui-même
+os.environ.pop('CAZGINO_LEDGER', None)
+
+import bot  # noqa: E402
+
+DEFAULT_SOCKET = 'cazgino_ledger.sock'
+READ_SIZE = 1 << 16
+
+
+class LedgerServer:
+    """Exécute les requêtes des bots sur la Database locale"""
+    def __init__(self, db):
+        self.db = db
+        self.requests = 0
+        self.batches = 0
+        self.ops = {
+            'get_balance': db.get_balance,
+            'set_balance': db.set_balance,
+            'debit': db.debit,
+            'get_games_played': db.get_games_played,
+            'count_accounts': db.count_accounts,
+            'get_leaderboard': db.get_leaderboard,
+            'count_ranked': db.count_ranked,
+            'get_rank': db.get_rank,
+            'page_version': self.page_version,
+            'record_game': db.record_game,
+            'record_job': db.record_job,
+            'get_player_stats': db.get_player_stats,
+            'get_guild_stats': db.get_guild_stats,
+        }
+
+    def page_version(self, page):
+        """Version d'une page du classement, suivie dès qu'un bot l'a demandée"""
+        cache = self.db.leaderboard_cache
+        if page not in cache.pages:
+            total_pages = cache.page_count(self.db.count_ranked())
+            if not 1 <= page <= total_pages:
+                raise ValueError(f'page {page} hors du classement ({total_pages} pages)')
+            # Une page présente dans le cache est invalidée par les modifications qui la touchent:
+            # le service relève ses bornes comme le ferait un rendu
+            rows = self.db.get_leaderboard(cache.page_size, (page - 1) * cache.page_size)
+            cache.put(page, None, cache.version(page), rows, total_pages)
+        return cache.version(page)
+
+    def execute_batch(self, requests):
+        """Exécute un lot de requêtes; renvoie une réponse par requête, dans l'ordre"""
+        self.batches += 1
+        self.requests += len(requests)
+        responses = []
+        tx = self.db.transaction()
+        applied = []  # Numéros des écritures regroupées dans tx
+        for request in requests:
+            request_id, op, *args = request
+            if op == 'apply':
+                balance_deltas, game_deltas = args
+                for user_id, delta in balance_deltas.items():
+                    tx.add_balance(user_id, delta)
+                for user_id, count in game_deltas.items():
+                    tx.game_deltas[int(user_id)] = tx.game_deltas.get(int(user_id), 0) + count
+                applied.append(request_id)
+                continue
+            # Une lecture voit toutes les écritures arrivées avant elle
+            responses += self.commit(tx, applied)
+            applied = []
+            try:
+                responses.append({'id': request_id, 'ok': self.ops[op](*args)})
+            except Exception as e:
+                responses.append({'id': request_id, 'error': f'{op}: {e!r}'})
+        responses += self.commit(tx, applied)
+        return responses
+
+    @staticmethod
+    def commit(tx, applied):
+        if not applied:
+            return []
+        try:
+            tx.commit()
+        except Exception as e:
+            tx.balance_deltas = {}
+            tx.game_deltas = {}
+            return [{'id': request_id, 'error': f'apply: {e!r}'} for request_id in applied]
+        return [{'id': request_id, 'ok': None} for request_id in applied]
+
+    async def serve(self, reader, writer):
+        buffer = b''
+        try:
+            while True:
+                data = await reader.read(READ_SIZE)
+                if not data:
+                    break
+                buffer += data
+                *lines, buffer = buffer.split(b'\n')
+                if not lines:
+                    continue
+                responses = self.execute_batch([json.loads(line) for line in lines])
+                writer.write(b''.join(json.dumps(r, separators=(',', ':')).encode() + b'\n' for r in responses))
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+async def serve(path):
+    if os.path.exists(path):
+        os.remove(path)  # Socket laissé par un arrêt brutal
+    ledger = LedgerServer(bot.db)
+    server = await asyncio.start_unix_server(ledger.serve, path)
+    print(f'📒 Service de comptes sur {path} ({bot.db.count_accounts()} comptes)')
+    stop = asyncio.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        asyncio.get_running_loop().add_signal_handler(signum, stop.set)
+    async with server:
+        await stop.wait()
+    os.remove(path)
+    print(f'📒 Arrêt: {ledger.requests} requêtes en {ledger.batches} lots')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--socket', default=DEFAULT_SOCKET, help='Chemin du socket Unix')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.socket))
+    finally:
+        # Replie le journal, ou écrit le dernier instantané, comme à l'arrêt du bot
+        bot.db.close()
+
+
+if __name__ == '__main__':
+    main()
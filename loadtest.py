@@ -0,0 +1,410 @@
+"""Test de charge de bout en bout du Cazgino, sans Discord.
+
+Les vrais gestionnaires de commandes et d'événements du bot sont pilotés par
+une passerelle simulée (messages et réactions de N joueurs dans M salons) et
+une API REST simulée qui enregistre chaque envoi, édition et requête, avec
+une latence et des limites de débit proches de celles de Discord.
+
+Le temps du jeu est accéléré (--time-scale): les phases, l'animation et les
+limites de débit sont raccourcies d'autant, les latences mesurées restent
+en temps réel.
+
+    python loadtest.py --users 500 --channels 25 --duration 60 --output load.json
+    python loadtest.py --interface buttons   # Inscriptions et mises par boutons et formulaire
+    python loadtest.py --event-log events.log   # Journal à rejouer avec replay.py
+"""
+import argparse
+import asyncio
+import atexit
+import itertools
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+# Le bot lit et écrit ses fichiers dans le dossier courant: on travaille dans
+# un dossier temporaire pour ne jamais toucher aux vraies données
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+WORK_DIR = tempfile.mkdtemp(prefix='cazgino-load-')
+os.chdir(WORK_DIR)
+
+
+def remove_work_dir():
+    # Après la fin des threads d'écriture du bot, qui sont attendus avant atexit
+    os.chdir(REPO_DIR)
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+atexit.register(remove_work_dir)
+# Le journal d'événements est ouvert après l'accélération du temps (--event-log)
+os.environ.pop('CAZGINO_EVENT_LOG', None)
+
+import discord  # noqa: E402
+
+import bot  # noqa: E402
+
+GUILD_ID = 10
+BOT_ID = 1
+TIMESTAMP = '2024-01-01T00:00:00+00:00'
+
+# Limites de débit simulées par type de requête: (requêtes, période, portée)
+RATE_LIMITS = {
+    'send': (5, 5.0, 'channel'),
+    'edit': (5, 5.0, 'channel'),
+    'add_reaction': (1, 0.25, 'channel'),
+    'remove_reaction': (1, 0.25, 'channel'),
+    'fetch_user': (50, 1.0, 'global'),
+    'other': (50, 1.0, 'global'),
+}
+GLOBAL_LIMIT = (50, 1.0)
+
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def summary_ms(values):
+    return {
+        'count': len(values),
+        'p50_ms': None if not values else percentile(values, 0.50) * 1000,
+        'p99_ms': None if not values else percentile(values, 0.99) * 1000,
+        'max_ms': None if not values else max(values) * 1000,
+    }
+
+
+class Bucket:
+    """Limite de débit simulée: renvoie l'attente qu'imposerait Discord"""
+    def __init__(self, capacity, period):
+        self.interval = period / capacity
+        self.capacity = capacity
+        self.next_free = 0.0
+    
+    def reserve(self, now):
+        # Jusqu'à `capacity` requêtes d'avance, puis une toutes les `interval` secondes
+        start = max(now, self.next_free - self.interval * (self.capacity - 1))
+        self.next_free = max(now, self.next_free) + self.interval
+        return start - now
+
+
+class FakeDiscord:
+    """API REST simulée: répond comme Discord et enregistre chaque appel"""
+    def __init__(self, state, latency, time_scale):
+        self.state = state
+        self.latency = latency
+        self.time_scale = time_scale
+        self.ids = itertools.count(10**15)
+        self.calls = []  # [(date, type, salon, attente due aux limites)]
+        self.responses = {}  # {id d'interaction: réponse attendue du bot}
+        self.buckets = {}
+        self.global_bucket = Bucket(GLOBAL_LIMIT[0], GLOBAL_LIMIT[1] / time_scale)
+    
+    def next_id(self):
+        return next(self.ids)
+    
+    def bucket(self, kind, channel_id):
+        capacity, period, scope = RATE_LIMITS[kind]
+        key = (kind, channel_id if scope == 'channel' else None)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            bucket = self.buckets[key] = Bucket(capacity, period / self.time_scale)
+        return bucket
+    
+    def user_payload(self, user_id):
+        return {'id': str(user_id), 'username': f'joueur{user_id}', 'discriminator': '0', 'avatar': None, 'bot': user_id == BOT_ID}
+    
+    def message_payload(self, message_id, channel_id, author_id, content='', embeds=()):
+        return {
+            'id': str(message_id), 'channel_id': str(channel_id), 'guild_id': str(GUILD_ID),
+            'author': self.user_payload(author_id), 'content': content or '', 'embeds': list(embeds),
+            'timestamp': TIMESTAMP, 'edited_timestamp': None, 'tts': False, 'mention_everyone': False,
+            'mentions': [], 'mention_roles': [], 'attachments': [], 'pinned': False, 'type': 0,
+        }
+    
+    def interaction_payload(self, interaction_type, channel_id, user_id, data, message=None):
+        payload = {
+            'id': str(self.next_id()), 'application_id': str(BOT_ID), 'type': interaction_type, 'token': 'jeton',
+            'version': 1, 'channel_id': str(channel_id), 'guild_id': str(GUILD_ID), 'data': data,
+            'member': {'user': self.user_payload(user_id), 'roles': [], 'joined_at': TIMESTAMP, 'deaf': False,
+                       'mute': False, 'flags': 0, 'permissions': '0'},
+            'locale': 'fr', 'guild_locale': 'fr', 'entitlements': [], 'authorizing_integration_owners': {},
+            'attachment_size_limit': 8 * 1024 * 1024,
+        }
+        if message is not None:
+            payload['message'] = message
+        return payload
+    
+    async def request(self, route, **kwargs):
+        kind = bot.api_call_kind(route)
+        channel_id = route.channel_id
+        now = time.monotonic()
+        wait = max(self.bucket(kind, channel_id).reserve(now), self.global_bucket.reserve(now))
+        self.calls.append((now, kind, channel_id, wait))
+        await asyncio.sleep(wait + random.uniform(0.5, 1.5) * self.latency)
+        
+        payload = kwargs.get('json') or {}
+        if kind == 'send':
+            return self.message_payload(self.next_id(), channel_id, BOT_ID, payload.get('content'), payload.get('embeds', []))
+        if kind == 'edit':
+            return self.message_payload(route.url.rsplit('/', 1)[1], channel_id, BOT_ID, payload.get('content'), payload.get('embeds', []))
+        if kind == 'fetch_user':
+            return self.user_payload(int(route.url.rsplit('/', 1)[1]))
+        return None
+    
+    async def interaction_request(self, route, session=None, *, payload=None, multipart=None, **kwargs):
+        """Réponses aux interactions (passent par l'adaptateur des webhooks, hors des limites du bot)"""
+        self.calls.append((time.monotonic(), 'interaction', None, 0.0))
+        await asyncio.sleep(random.uniform(0.5, 1.5) * self.latency)
+        if payload is None and multipart:
+            payload = json.loads(multipart[0]['value'])
+        interaction_id = int(route.url.split('/interactions/', 1)[1].split('/', 1)[0])
+        response = self.responses.pop(interaction_id, None)
+        if response is not None and not response.done():
+            response.set_result(payload)
+        return {'interaction': {'id': str(interaction_id), 'type': payload['type']}}
+
+
+class LoadTest:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.latencies = {}  # {commande: [durées]}
+        self.loop_lag = []
+        self.games = []  # [(salon, début, fin)]
+        self.interim = {'started': 0, 'completed': 0}
+        self.running = True
+    
+    def speed_up(self):
+        """Accélère le temps du jeu de `time_scale`"""
+        scale = self.args.time_scale
+        for name in ('JOIN_SECONDS', 'BET_SECONDS', 'COUNTDOWN_STEP', 'ANIMATION_SECONDS',
+                     'RESULT_DELAY', 'INTERIM_EDIT_DEBOUNCE', 'OUTBOX_INFO_MAX_AGE'):
+            setattr(bot, name, getattr(bot, name) / scale)
+        for recipe in bot.RECIPES.values():
+            recipe['time_limit'] /= scale
+        bot.CHANNEL_RATE_LIMIT = (bot.CHANNEL_RATE_LIMIT[0], bot.CHANNEL_RATE_LIMIT[1] / scale)
+        bot.global_budget = bot.RateBudget(bot.GLOBAL_RATE_LIMIT[0], bot.GLOBAL_RATE_LIMIT[1] / scale)
+        bot.channel_budgets.clear()
+    
+    async def setup(self):
+        client = bot.bot
+        await client._async_setup_hook()
+        self.state = client._connection
+        self.api = FakeDiscord(self.state, self.args.api_latency, self.args.time_scale)
+        client.http.request = self.api.request
+        discord.webhook.async_.async_context.get().request = self.api.interaction_request
+        bot.instrument_http(client.http)
+        self.state.user = discord.ClientUser(state=self.state, data=self.api.user_payload(BOT_ID))
+        self.channel_ids = [1000 + i for i in range(self.args.channels)]
+        self.guild = self.state._add_guild_from_data({
+            'id': str(GUILD_ID), 'name': 'Cazgino', 'owner_id': '2', 'emojis': [], 'features': [],
+            'members': [], 'member_count': self.args.users,
+            'roles': [{'id': str(GUILD_ID), 'name': '@everyone', 'permissions': '0', 'position': 0,
+                       'color': 0, 'hoist': False, 'managed': False, 'mentionable': False}],
+            'channels': [{'id': str(channel_id), 'type': 0, 'name': f'roulette-{channel_id}', 'position': i,
+                          'permission_overwrites': []} for i, channel_id in enumerate(self.channel_ids)],
+        })
+    
+    async def command(self, channel_id, user_id, content):
+        """Simule un message d'un joueur et mesure le temps de traitement de la commande"""
+        data = self.api.message_payload(self.api.next_id(), channel_id, user_id, content)
+        data['member'] = {'roles': [], 'joined_at': TIMESTAMP, 'deaf': False, 'mute': False, 'flags': 0}
+        message = discord.Message(state=self.state, channel=self.guild.get_channel(channel_id), data=data)
+        start = time.monotonic()
+        ctx = await bot.bot.get_context(message)
+        if ctx.command is None:
+            return
+        # Comme discord.py, chaque commande s'exécute dans sa propre tâche (et son propre contexte)
+        await asyncio.create_task(bot.bot.invoke(ctx))
+        self.latencies.setdefault(ctx.command.name, []).append(time.monotonic() - start)
+    
+    async def interact(self, name, interaction_type, channel_id, user_id, data, message=None):
+        """Simule une interaction (bouton, formulaire) et attend la réponse du bot"""
+        payload = self.api.interaction_payload(interaction_type, channel_id, user_id, data, message)
+        response = self.api.responses[int(payload['id'])] = asyncio.get_running_loop().create_future()
+        start = time.monotonic()
+        self.state.parse_interaction_create(payload)
+        try:
+            result = await asyncio.wait_for(response, 10)
+        except asyncio.TimeoutError:
+            self.api.responses.pop(int(payload['id']), None)
+            return None
+        self.latencies.setdefault(name, []).append(time.monotonic() - start)
+        return result
+    
+    async def click(self, channel_id, user_id, table, custom_id):
+        message = self.api.message_payload(table.message.id, channel_id, BOT_ID, table.message.content)
+        data = {'custom_id': custom_id, 'component_type': 2}
+        return await self.interact(custom_id, 3, channel_id, user_id, data, message)
+    
+    async def submit(self, channel_id, user_id, modal, values):
+        """Remplit un formulaire reçu du bot avec `values`, dans l'ordre de ses champs"""
+        fields = []
+        for row in modal['components']:
+            fields += row.get('components') or [row['component']]
+        components = [
+            {'type': 1, 'components': [{'type': 4, 'custom_id': field['custom_id'], 'value': value}]}
+            for field, value in zip(fields, values)
+        ]
+        data = {'custom_id': modal['custom_id'], 'components': components}
+        return await self.interact('modal', 5, channel_id, user_id, data)
+    
+    def react(self, channel_id, message_id, user_id, emoji):
+        """Simule une réaction reçue par la passerelle"""
+        self.state.parse_message_reaction_add({
+            'user_id': str(user_id), 'channel_id': str(channel_id), 'message_id': str(message_id),
+            'guild_id': str(GUILD_ID), 'emoji': {'id': None, 'name': emoji}, 'burst': False, 'type': 0,
+        })
+    
+    async def pause(self, low, high):
+        await asyncio.sleep(self.rng.uniform(low, high) / self.args.time_scale)
+    
+    async def roulette_channel(self, channel_id, players):
+        """Enchaîne des parties de roulette dans un salon"""
+        while self.running:
+            start = time.monotonic()
+            await self.command(channel_id, players[0], '!roulette')
+            await asyncio.gather(*(self.join_and_bet(channel_id, user_id) for user_id in players))
+            while channel_id in bot.tables:
+                await asyncio.sleep(0.05 / self.args.time_scale)
+            self.games.append((channel_id, start, time.monotonic()))
+            await self.command(channel_id, self.rng.choice(players), f'!leaderboard {self.rng.randint(1, 3)}')
+            await self.pause(1, 3)
+    
+    async def join_and_bet(self, channel_id, user_id):
+        buttons = self.args.interface == 'buttons'
+        table = bot.tables.get(channel_id)
+        await self.pause(0, bot.JOIN_SECONDS * self.args.time_scale * 0.8)
+        if buttons and table is not None:
+            await self.click(channel_id, user_id, table, 'cazgino:join')
+        else:
+            await self.command(channel_id, user_id, '!join')
+        while table is not None and table.phase == 'joining' and self.running:
+            await asyncio.sleep(0.05 / self.args.time_scale)
+        await self.pause(0, bot.BET_SECONDS * self.args.time_scale * 0.8)
+        if buttons and table is not None:
+            # Le formulaire ne prend qu'une mise
+            modal = await self.click(channel_id, user_id, table, 'cazgino:bet')
+            if modal is not None and modal['type'] == 9:
+                await self.submit(channel_id, user_id, modal['data'], [self.rng.choice(BET_CHOICES), str(self.rng.randint(1, 20))])
+            return
+        bets = [f'{self.rng.choice(BET_CHOICES)} {self.rng.randint(1, 20)}' for _ in range(self.rng.randint(1, 3))]
+        await self.command(channel_id, user_id, '!mise ' + ' '.join(bets))
+    
+    async def interim_player(self, channel_id, user_id):
+        """Enchaîne des jobs d'intérim en cliquant les ingrédients (avec quelques erreurs)"""
+        while self.running:
+            await self.pause(1, 5)
+            await self.command(channel_id, user_id, '!interim')
+            job = bot.active_jobs.get(user_id)
+            if job is None or job.message is None:
+                continue
+            self.interim['started'] += 1
+            for emoji in job.recipe['steps']:
+                await self.pause(0.2, 1.0)
+                if self.rng.random() < 0.1:
+                    self.react(channel_id, job.message.id, user_id, '🦑')
+                self.react(channel_id, job.message.id, user_id, emoji)
+            # Laisse le bot traiter les dernières réactions
+            await self.pause(0.1, 0.2)
+            if job.completed:
+                self.interim['completed'] += 1
+            if self.rng.random() < 0.2:
+                await self.command(channel_id, user_id, '!balance')
+    
+    async def monitor_loop_lag(self):
+        interval = 0.05
+        while self.running:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            self.loop_lag.append(max(0.0, time.monotonic() - start - interval))
+    
+    async def run(self):
+        self.speed_up()
+        if self.args.event_log:
+            bot.events = bot.EventLog(os.path.join(REPO_DIR, self.args.event_log))
+        await self.setup()
+        users = list(range(100000, 100000 + self.args.users))
+        # Répartit les joueurs entre les salons
+        per_channel = {channel_id: users[i::len(self.channel_ids)] for i, channel_id in enumerate(self.channel_ids)}
+        tasks = [asyncio.create_task(self.monitor_loop_lag())]
+        for channel_id, players in per_channel.items():
+            if not players:
+                continue
+            interim_count = int(len(players) * self.args.interim_share)
+            tasks.append(asyncio.create_task(self.roulette_channel(channel_id, players[interim_count:] or players)))
+            tasks += [asyncio.create_task(self.interim_player(channel_id, user_id)) for user_id in players[:interim_count]]
+        
+        started = time.monotonic()
+        await asyncio.sleep(self.args.duration)
+        self.running = False
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        bot.events.close()
+        return self.report(time.monotonic() - started)
+    
+    def report(self, elapsed):
+        calls = self.api.calls
+        by_kind = {}
+        for _, kind, _, _ in calls:
+            by_kind[kind] = by_kind.get(kind, 0) + 1
+        per_game = [
+            sum(1 for at, _, channel, _ in calls if channel == channel_id and start <= at <= end)
+            for channel_id, start, end in self.games
+        ]
+        waits = [wait for _, _, _, wait in calls if wait > 0]
+        return {
+            'config': vars(self.args),
+            'elapsed_seconds': elapsed,
+            'games_completed': len(self.games),
+            'interim_jobs': self.interim,
+            'commands': {name: summary_ms(values) for name, values in sorted(self.latencies.items())},
+            'all_commands': summary_ms([v for values in self.latencies.values() for v in values]),
+            'api_calls': by_kind,
+            'api_calls_by_command': {
+                dict(labels)['command']: bot.metrics.counter_total(name, command=dict(labels)['command'])
+                for name, labels in bot.metrics.counters if name == 'cazgino_discord_api_calls_total'
+            },
+            'api_calls_total': len(calls),
+            'api_calls_per_second': len(calls) / elapsed,
+            'api_calls_per_game': None if not per_game else sum(per_game) / len(per_game),
+            'rate_limited': {'count': len(waits), 'total_wait_seconds': sum(waits)},
+            'event_loop_lag': summary_ms(self.loop_lag),
+        }
+
+
+BET_CHOICES = ['rouge', 'noir', 'pair', 'impair', '1-18', '19-36', 'd1', 'd2', 'c3', 't13', '8/11', '17']
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=200, help='Joueurs simulés')
+    parser.add_argument('--channels', type=int, default=10, help='Salons (une table de roulette par salon)')
+    parser.add_argument('--duration', type=float, default=30, help='Durée du test en secondes réelles')
+    parser.add_argument('--time-scale', type=float, default=10, help='Accélération du temps du jeu')
+    parser.add_argument('--api-latency', type=float, default=0.05, help='Latence moyenne simulée de l\'API (s)')
+    parser.add_argument('--interim-share', type=float, default=0.3, help="Part des joueurs qui font de l'intérim")
+    parser.add_argument('--interface', choices=['text', 'buttons'], default='text',
+                        help="Rejoindre et miser par commandes texte ou par les boutons de la table")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--event-log', help="Journal d'événements à écrire (voir replay.py)")
+    parser.add_argument('--output', help='Fichier JSON de résultats (stdout sinon)')
+    args = parser.parse_args()
+    
+    report = asyncio.run(LoadTest(args).run())
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(os.path.join(REPO_DIR, args.output) if not os.path.isabs(args.output) else args.output, 'w') as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == '__main__':
+    main()
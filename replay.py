@@ -0,0 +1,314 @@
+"""Rejoue un journal d'événements du Cazgino (CAZGINO_EVENT_LOG) en temps virtuel.
+
+    CAZGINO_EVENT_LOG=events.log python bot.py      # enregistre (ou: loadtest.py --event-log)
+    python replay.py events.log                     # rejoue et vérifie les comptes
+    python replay.py events.log --output replay.json
+
+Les vrais gestionnaires du bot reçoivent les commandes, réactions et mises du
+journal, face à l'API simulée de loadtest.py sans latence ni limite de débit.
+Le temps est virtuel: l'échéancier saute d'un événement au suivant, le rejeu
+va aussi vite que le processeur. Tables et jobs retrouvent leurs graines, les
+échéances des tables se déclenchent à leur place dans le journal, et chaque
+modification des comptes est comparée à celle enregistrée, comme les soldes
+finaux. Le débit du rejeu (événements par seconde) sert de référence pour les
+régressions de performance.
+
+Les comptes sont recréés avec leurs soldes d'avant leur première modification
+dans le journal; ceux qui n'y sont jamais modifiés partent de STARTING_BALANCE.
+"""
+import argparse
+import asyncio
+import collections
+import json
+import os
+import sys
+import time
+from types import SimpleNamespace
+
+# Chemins donnés par rapport au dossier de lancement (loadtest passe dans un dossier temporaire)
+START_DIR = os.getcwd()
+
+# Pas de journal ni de service de comptes pour le bot rejoué, et les
+# commandes du journal sont écrites sous leur forme préfixée (!commande)
+os.environ.pop('CAZGINO_EVENT_LOG', None)
+os.environ.pop('CAZGINO_LEDGER', None)
+os.environ['CAZGINO_PREFIX_COMMANDS'] = '1'
+
+import loadtest  # noqa: E402  (dossier temporaire, API simulée)
+from loadtest import bot, discord, summary_ms  # noqa: E402
+
+ADMIN_ROLE_ID = loadtest.GUILD_ID + 1
+MISMATCHES_SHOWN = 10
+
+
+class VirtualClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def read_log(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def initial_accounts(events):
+    """Soldes et parties de chaque compte avant sa première modification dans le journal"""
+    balances = {}
+    games = {}
+    created = set()
+    for event in events:
+        if event['e'] != 'l':
+            continue
+        for user_id in event.get('n', ()):
+            if str(user_id) not in balances:
+                created.add(str(user_id))
+                balances[str(user_id)] = None
+        for user_id, (delta, after) in event.get('b', {}).items():
+            balances.setdefault(user_id, after - delta)
+        for user_id, (delta, after) in event.get('p', {}).items():
+            games.setdefault(user_id, after - delta)
+    # Joueurs du journal dont le solde n'a jamais changé
+    for event in events:
+        if 'u' in event and event['e'] != 'l':
+            balances.setdefault(str(event['u']), bot.STARTING_BALANCE)
+    return (
+        {int(user_id): balance for user_id, balance in balances.items() if user_id not in created},
+        {int(user_id): count for user_id, count in games.items() if user_id not in created},
+    )
+
+
+def final_accounts(events):
+    balances = {}
+    for event in events:
+        if event['e'] == 'l':
+            for user_id, (_, after) in event.get('b', {}).items():
+                balances[int(user_id)] = after
+    return balances
+
+
+class Replay:
+    def __init__(self, events):
+        self.events = events
+        self.clock = VirtualClock()
+        self.offset = 0.0  # Début du segment en cours (un segment par démarrage du bot)
+        self.expected = collections.deque(event for event in events if event['e'] == 'l')
+        self.ledger = {'expected': len(self.expected), 'matched': 0, 'mismatched': 0, 'extra': 0}
+        self.mismatches = []
+        self.skipped = collections.Counter()  # Événements sans cible au rejeu (divergence)
+        self.latencies = {}
+        self.current = None  # Événement en cours de rejeu
+
+    async def setup(self):
+        bot.scheduler.clock = self.clock
+        bot.scheduler.autorun = False
+        bot.events.seeds = collections.defaultdict(collections.deque)
+        for event in self.events:
+            if event['e'] == 's':
+                bot.events.seeds[event['k'], event.get('id')].append(event['s'])
+        bot.events.ledger = self.check_ledger
+        bot.global_budget = bot.RateBudget(*bot.GLOBAL_RATE_LIMIT, clock=self.clock)
+        bot.channel_budgets.clear()
+
+        client = bot.bot
+        await client._async_setup_hook()
+        self.state = client._connection
+        self.api = loadtest.FakeDiscord(self.state, 0.0, float('inf'))
+        client.http.request = self.api.request
+        discord.webhook.async_.async_context.get().request = self.api.interaction_request
+        bot.instrument_http(client.http)
+        self.state.user = discord.ClientUser(state=self.state, data=self.api.user_payload(loadtest.BOT_ID))
+        channel_ids = sorted({event['ch'] for event in self.events if 'ch' in event})
+        role = {'permissions': '0', 'position': 0, 'color': 0, 'hoist': False, 'managed': False, 'mentionable': False}
+        self.guild = self.state._add_guild_from_data({
+            'id': str(loadtest.GUILD_ID), 'name': 'Cazgino', 'owner_id': '2', 'emojis': [], 'features': [],
+            'members': [], 'member_count': 0,
+            'roles': [dict(role, id=str(loadtest.GUILD_ID), name='@everyone'),
+                      dict(role, id=str(ADMIN_ROLE_ID), name='admin', permissions='8', position=1)],
+            'channels': [{'id': str(channel_id), 'type': 0, 'name': f'salon-{channel_id}', 'position': i,
+                          'permission_overwrites': []} for i, channel_id in enumerate(channel_ids)],
+        })
+
+        balances, games = initial_accounts(self.events)
+        bot.db.storage.commit(balances, {user_id: games.get(user_id, 0) for user_id in balances})
+
+    def configure(self, header):
+        """Durées enregistrées dans l'en-tête d'un segment"""
+        cfg = header.get('cfg', {})
+        for name, key in (('JOIN_SECONDS', 'join'), ('BET_SECONDS', 'bet'), ('COUNTDOWN_STEP', 'step'),
+                          ('ANIMATION_SECONDS', 'animation'), ('RESULT_DELAY', 'result')):
+            if key in cfg:
+                setattr(bot, name, cfg[key])
+        for key, limit in cfg.get('limits', {}).items():
+            if key in bot.RECIPES:
+                bot.RECIPES[key]['time_limit'] = limit
+
+    def restart(self):
+        """Le bot a redémarré: tables, jobs et échéances en mémoire sont perdus"""
+        for game in list(bot.tables.values()):
+            game.close()
+        for job in list(bot.active_jobs.values()):
+            bot.finish_job(job)
+        bot.scheduler.heap.clear()
+        bot.events.pending.clear()
+        bot.outboxes.clear()
+        self.offset = self.clock.now
+
+    def check_ledger(self, balance_deltas, balances, game_deltas, games, created):
+        """Compare une modification des comptes du rejeu à la suivante du journal"""
+        actual = {}
+        if balances:
+            actual['b'] = {str(user_id): [balance_deltas[user_id], value] for user_id, value in balances.items()}
+        if games:
+            actual['p'] = {str(user_id): [game_deltas[user_id], value] for user_id, value in games.items()}
+        if created:
+            actual['n'] = list(created)
+        if not self.expected:
+            self.ledger['extra'] += 1
+            self.mismatch(None, actual)
+            return
+        expected = self.expected.popleft()
+        if all(expected.get(key) == actual.get(key) for key in ('b', 'p', 'n')):
+            self.ledger['matched'] += 1
+        else:
+            self.ledger['mismatched'] += 1
+            self.mismatch(expected, actual)
+
+    def mismatch(self, expected, actual):
+        if len(self.mismatches) < MISMATCHES_SHOWN:
+            self.mismatches.append({'after': self.current, 'expected': expected, 'replayed': actual})
+
+    async def settle(self):
+        """Laisse tourner les tâches lancées jusqu'à ce qu'elles attendent toutes une échéance"""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(0)
+            if not loop._ready:
+                return
+
+    async def advance(self, until):
+        """Avance l'horloge virtuelle jusqu'à `until` en déclenchant les échéances dans l'ordre"""
+        while True:
+            deadline = bot.scheduler.next_deadline()
+            if deadline is None or deadline > until:
+                break
+            self.clock.now = max(self.clock.now, deadline)
+            bot.scheduler.run_due()
+            await self.settle()
+        self.clock.now = max(self.clock.now, until)
+
+    async def dispatch(self, event):
+        kind = event['e']
+        if kind == 'c':
+            await self.command(event)
+        elif kind == 'r':
+            job = bot.active_jobs.get(event['u'])
+            if job is None or job.message is None:
+                self.skipped['r'] += 1
+                return
+            self.state.parse_message_reaction_add({
+                'user_id': str(event['u']), 'channel_id': str(event['ch']), 'message_id': str(job.message.id),
+                'guild_id': str(loadtest.GUILD_ID), 'emoji': {'id': None, 'name': event['x']}, 'burst': False, 'type': 0,
+            })
+        elif kind in ('j', 'm'):
+            # Bouton Rejoindre et formulaire de mise: mêmes fonctions que les vues
+            game = bot.tables.get(event['ch'])
+            if game is None or game.seed != event['g']:
+                self.skipped[kind] += 1
+                return
+            user = SimpleNamespace(id=event['u'], mention=f"<@{event['u']}>")
+            if kind == 'j':
+                bot.join_table(game, user)
+            else:
+                bot.place_bet(game, user, event['x'])
+        elif kind == 'k':
+            timer = bot.events.pending.pop(tuple(event['k']), None)
+            if timer is None or timer.cancelled:
+                self.skipped['k'] += 1
+                return
+            result = timer.callback()
+            if asyncio.iscoroutine(result):
+                bot.scheduler.spawn(result)
+
+    async def command(self, event):
+        data = self.api.message_payload(self.api.next_id(), event['ch'], event['u'], event['x'])
+        data['member'] = {'roles': [str(ADMIN_ROLE_ID)] if event.get('a') else [], 'joined_at': loadtest.TIMESTAMP,
+                          'deaf': False, 'mute': False, 'flags': 0}
+        message = discord.Message(state=self.state, channel=self.guild.get_channel(event['ch']), data=data)
+        ctx = await bot.bot.get_context(message)
+        if ctx.command is None:
+            self.skipped['c'] += 1
+            return
+        await asyncio.create_task(bot.bot.invoke(ctx))
+
+    async def run(self):
+        await self.setup()
+        counts = collections.Counter()
+        started = time.perf_counter()
+        first = True
+        for event in self.events:
+            kind = event['e']
+            counts[kind] += 1
+            if kind == 'start':
+                if not first:
+                    self.restart()
+                first = False
+                self.configure(event)
+                continue
+            await self.advance(self.offset + event['t'] / 1e6)
+            if kind in ('s', 'l'):
+                continue
+            self.current = event
+            dispatched = time.perf_counter()
+            await self.dispatch(event)
+            await self.settle()
+            self.latencies.setdefault(kind, []).append(time.perf_counter() - dispatched)
+        await self.advance(self.clock.now)
+        return self.report(counts, time.perf_counter() - started)
+
+    def report(self, counts, elapsed):
+        expected = final_accounts(self.events)
+        balances = []
+        for user_id, balance in sorted(expected.items()):
+            replayed = bot.db.storage.get_balance(user_id)
+            if replayed != balance:
+                balances.append({'user_id': user_id, 'expected': balance, 'replayed': replayed})
+        inbound = sum(len(values) for values in self.latencies.values())
+        by_kind = collections.Counter(kind for _, kind, _, _ in self.api.calls)
+        return {
+            'events': dict(counts),
+            'virtual_seconds': self.clock.now,
+            'wall_seconds': elapsed,
+            'events_per_second': inbound / elapsed if elapsed else None,
+            'speedup': self.clock.now / elapsed if elapsed else None,
+            'dispatch': {kind: summary_ms(values) for kind, values in sorted(self.latencies.items())},
+            'api_calls': dict(by_kind),
+            'ledger': dict(self.ledger, missing=len(self.expected)),
+            'ledger_mismatches': self.mismatches,
+            'balances': {'checked': len(expected), 'mismatched': len(balances), 'first': balances[:MISMATCHES_SHOWN]},
+            'skipped': dict(self.skipped),
+            'seeds_left': sum(map(len, bot.events.seeds.values())),
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('log', help="Journal d'événements (CAZGINO_EVENT_LOG)")
+    parser.add_argument('--output', help='Fichier JSON de résultats (stdout sinon)')
+    args = parser.parse_args()
+
+    report = asyncio.run(Replay(read_log(os.path.join(START_DIR, args.log))).run())
+    text = json.dumps(report, indent=4, ensure_ascii=False)
+    if args.output:
+        with open(os.path.join(START_DIR, args.output), 'w') as f:
+            f.write(text)
+    print(text)
+    ledger = report['ledger']
+    if ledger['mismatched'] or ledger['extra'] or ledger['missing'] or report['balances']['mismatched']:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
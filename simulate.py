@@ -0,0 +1,246 @@
+"""Simulation Monte-Carlo de l'économie du Cazgino (nécessite NumPy).
+
+Les gains de la roulette viennent des mêmes fonctions que le bot (compile_bet,
+Slip, contrôlés numéro par numéro avec RouletteGame.calculate_winnings) et les
+récompenses d'intérim de RECIPES. À lancer avant chaque changement de gains ou
+de récompenses:
+
+    python simulate.py --strategy "rouge 10" --strategy "17 10" --spins 10000000
+    python simulate.py --players 10000 --rounds 500 --jobs-per-round 2 --output economie.json
+
+Pour chaque stratégie (un bulletin, comme `!mise`): avantage de la maison et
+variance par tirage, exacts et mesurés. Puis une population de joueurs qui
+alternent jobs d'intérim et parties (les joueurs d'une même table partagent
+le tirage): répartition des soldes au fil des parties.
+"""
+import argparse
+import atexit
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+
+try:
+    import numpy as np
+except ImportError:
+    sys.exit('❌ simulate.py a besoin de NumPy: pip install numpy')
+
+# Le bot lit et écrit ses fichiers dans le dossier courant: on travaille dans
+# un dossier temporaire pour ne jamais toucher aux vraies données
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, REPO_DIR)
+WORK_DIR = tempfile.mkdtemp(prefix='cazgino-sim-')
+os.chdir(WORK_DIR)
+
+
+def remove_work_dir():
+    # Après la fin des threads d'écriture du bot, qui sont attendus avant atexit
+    os.chdir(REPO_DIR)
+    shutil.rmtree(WORK_DIR, ignore_errors=True)
+
+
+atexit.register(remove_work_dir)
+
+os.environ.pop('CAZGINO_LEDGER', None)
+
+import bot  # noqa: E402
+
+CHUNK = 1 << 20  # Tirages générés d'un coup
+DEFAULT_STRATEGIES = ['rouge 10', '17 10', 'd1 10', 't13 10', 'rouge 5 17 5']
+PERCENTILES = (10, 25, 50, 75, 90, 99)
+
+
+def payout_table(strategy):
+    """Gain total d'un bulletin (`"rouge 10 17 5"`) pour chacun des 37 numéros, et sa mise"""
+    tokens = strategy.split()
+    if not tokens or len(tokens) % 2:
+        sys.exit(f'❌ Bulletin invalide: "{strategy}" (choix et montants en alternance)')
+    bets = []
+    for choice, amount in zip(tokens[::2], tokens[1::2]):
+        bet = bot.compile_bet(choice)
+        if bet is None or not (amount.isascii() and amount.isdigit()) or int(amount) <= 0:
+            sys.exit(f'❌ Mise invalide: "{choice} {amount}"')
+        bets.append((bet, int(amount)))
+    slip = bot.Slip(bets)
+    # Le bot règle avec Slip.payouts: on vérifie qu'ils suivent calculate_winnings
+    for number in range(37):
+        table = SimpleNamespace(result=number)
+        expected = sum(bot.RouletteGame.calculate_winnings(table, bet.choice, amount) for bet, amount in bets)
+        assert expected == slip.payouts[number], (strategy, number)
+    return np.array(slip.payouts, dtype=np.int64), slip.stake
+
+
+def spin_stats(strategy, spins, rng):
+    """Avantage de la maison et variance d'un bulletin, exacts puis mesurés sur `spins` tirages"""
+    payouts, stake = payout_table(strategy)
+    net = payouts - stake
+    exact_mean = net.mean()
+    exact_std = net.std()
+
+    started = time.perf_counter()
+    total = 0
+    total_sq = 0.0
+    hits = 0
+    for start in range(0, spins, CHUNK):
+        results = net[rng.integers(0, 37, size=min(CHUNK, spins - start))]
+        total += int(results.sum())
+        total_sq += float(np.dot(results, results.astype(np.float64)))
+        hits += int(np.count_nonzero(results > 0))
+    elapsed = time.perf_counter() - started
+    mean = total / spins
+    std = (total_sq / spins - mean * mean) ** 0.5
+    return {
+        'strategy': strategy,
+        'stake': stake,
+        'house_edge': -exact_mean / stake,
+        'std_per_spin': exact_std,
+        'win_probability': float(np.count_nonzero(net > 0)) / 37,
+        'simulated': {
+            'spins': spins,
+            'house_edge': -mean / stake,
+            # Intervalle de confiance à 95% de l'avantage mesuré
+            'house_edge_ci95': 1.96 * std / spins ** 0.5 / stake,
+            'std_per_spin': std,
+            'win_rate': hits / spins,
+            'seconds': elapsed,
+        },
+    }
+
+
+def gini(balances):
+    """Coefficient de Gini des soldes (0: tous égaux, 1: un seul joueur a tout)"""
+    values = np.sort(np.maximum(balances, 0)).astype(np.float64)
+    total = values.sum()
+    if total == 0:
+        return 0.0
+    n = len(values)
+    return float(2 * np.dot(np.arange(1, n + 1), values) / (n * total) - (n + 1) / n)
+
+
+def wealth_snapshot(round_number, balances, min_stake):
+    return {
+        'round': round_number,
+        'mean': float(balances.mean()),
+        'percentiles': {str(p): float(v) for p, v in zip(PERCENTILES, np.percentile(balances, PERCENTILES))},
+        'broke_share': float(np.count_nonzero(balances < min_stake)) / len(balances),
+        'gini': gini(balances),
+    }
+
+
+def simulate_population(strategies, players, rounds, table_size, jobs_per_round, job_success, checkpoints, rng):
+    """Fait jouer `players` joueurs pendant `rounds` parties; renvoie la répartition des soldes aux étapes données
+
+    Avant chaque partie, chaque joueur fait un nombre de jobs d'intérim tiré d'une
+    loi de Poisson (moyenne `jobs_per_round`), réussis avec la probabilité
+    `job_success`, sur une recette tirée au hasard comme `!interim`. Il mise
+    ensuite son bulletin s'il en a les moyens; les joueurs d'une même table
+    partagent le numéro tiré."""
+    tables = [payout_table(strategy) for strategy in strategies]
+    payouts = np.stack([payout for payout, _ in tables])  # (stratégies, 37)
+    stakes = np.array([stake for _, stake in tables], dtype=np.int64)
+    rewards = np.array([recipe['reward'] for recipe in bot.RECIPES.values()], dtype=np.int64)
+
+    strategy = rng.integers(0, len(strategies), size=players)
+    stake = stakes[strategy]
+    table = np.arange(players) // table_size
+    table_count = int(table[-1]) + 1
+    balances = np.full(players, bot.STARTING_BALANCE, dtype=np.int64)
+    snapshots = [wealth_snapshot(0, balances, stakes.min())]
+    checkpoints = set(checkpoints)
+
+    earned = 0
+    wagered = 0
+    won = 0
+    started = time.perf_counter()
+    for round_number in range(1, rounds + 1):
+        jobs = rng.binomial(rng.poisson(jobs_per_round, size=players), job_success)
+        draws = rewards[rng.integers(0, len(rewards), size=int(jobs.sum()))]
+        income = np.bincount(np.repeat(np.arange(players), jobs), weights=draws, minlength=players).astype(np.int64)
+        balances += income
+        earned += int(income.sum())
+
+        playing = balances >= stake
+        spins = rng.integers(0, 37, size=table_count)[table]
+        winnings = np.where(playing, payouts[strategy, spins], 0)
+        bets = np.where(playing, stake, 0)
+        balances += winnings - bets
+        wagered += int(bets.sum())
+        won += int(winnings.sum())
+        if round_number in checkpoints:
+            snapshots.append(wealth_snapshot(round_number, balances, stakes.min()))
+    return {
+        'players': players,
+        'rounds': rounds,
+        'table_size': table_size,
+        'jobs_per_round': jobs_per_round,
+        'job_success': job_success,
+        'interim_income': earned,
+        'wagered': wagered,
+        'house_profit': wagered - won,
+        'realized_house_edge': (wagered - won) / wagered if wagered else None,
+        'seconds': time.perf_counter() - started,
+        'wealth': snapshots,
+    }
+
+
+def print_report(report):
+    print('🎰 ROULETTE (par tirage)')
+    print(f"{'bulletin':<20} {'mise':>6} {'avantage':>9} {'mesuré':>16} {'écart-type':>11} {'gagne':>7} {'Mtirages/s':>11}")
+    for s in report['strategies']:
+        sim = s['simulated']
+        print(f"{s['strategy']:<20} {s['stake']:>6} {s['house_edge']:>8.2%} "
+              f"{sim['house_edge']:>8.2%} ±{sim['house_edge_ci95']:>6.2%} {s['std_per_spin']:>11.1f} "
+              f"{s['win_probability']:>7.1%} {sim['spins'] / sim['seconds'] / 1e6:>11.1f}")
+
+    population = report['population']
+    if population is None:
+        return
+    print(f"\n👥 POPULATION: {population['players']} joueurs, {population['rounds']} parties, "
+          f"tables de {population['table_size']}, {population['jobs_per_round']} jobs/partie "
+          f"({population['seconds']:.1f}s)")
+    print(f"Intérim: {population['interim_income']}€ gagnés - Roulette: {population['wagered']}€ misés, "
+          f"{population['house_profit']}€ gardés par la maison")
+    print(f"{'partie':>7} {'moyenne':>9} " + ' '.join(f"{'p' + str(p):>8}" for p in PERCENTILES) + f" {'à sec':>7} {'gini':>6}")
+    for w in population['wealth']:
+        print(f"{w['round']:>7} {w['mean']:>9.0f} " + ' '.join(f"{v:>8.0f}" for v in w['percentiles'].values())
+              + f" {w['broke_share']:>7.1%} {w['gini']:>6.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--strategy', action='append', help='Bulletin à simuler, ex: "rouge 10 17 5" (répétable)')
+    parser.add_argument('--spins', type=int, default=10_000_000, help='Tirages simulés par bulletin')
+    parser.add_argument('--players', type=int, default=10000, help='Joueurs de la population (0: pas de population)')
+    parser.add_argument('--rounds', type=int, default=500, help='Parties jouées par la population')
+    parser.add_argument('--table-size', type=int, default=8, help='Joueurs par table (partagent le tirage)')
+    parser.add_argument('--jobs-per-round', type=float, default=1.0, help="Jobs d'intérim par joueur entre deux parties")
+    parser.add_argument('--job-success', type=float, default=0.85, help="Part des jobs d'intérim réussis")
+    parser.add_argument('--checkpoints', type=int, default=10, help='Étapes de la répartition des soldes')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Fichier JSON de résultats')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    strategies = args.strategy or DEFAULT_STRATEGIES
+    report = {
+        'config': vars(args),
+        'strategies': [spin_stats(strategy, args.spins, rng) for strategy in strategies],
+        'population': None,
+    }
+    if args.players > 0 and args.rounds > 0:
+        step = max(1, args.rounds // args.checkpoints)
+        checkpoints = list(range(step, args.rounds + 1, step)) + [args.rounds]
+        report['population'] = simulate_population(strategies, args.players, args.rounds, args.table_size,
+                                                   args.jobs_per_round, args.job_success, checkpoints, rng)
+
+    print_report(report)
+    if args.output:
+        with open(os.path.join(REPO_DIR, args.output) if not os.path.isabs(args.output) else args.output, 'w') as f:
+            json.dump(report, f, indent=4)
+
+
+if __name__ == '__main__':
+    main()